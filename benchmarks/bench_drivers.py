@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the driver hot paths and whole measurement cycles against the simulated instruments.
+
+Each case is timed for a fixed wall clock time and reported as operations per second and latency percentiles,
+along with the peak memory allocated by one operation (measured separately with tracemalloc so that tracing
+doesn't slow down the timed runs). The simulators run with no latency and no simulated sweep time, so the
+numbers measure the cost of pyscpi itself.
+
+Usage:
+    python benchmarks/bench_drivers.py [--filter text] [--time s] [--save file.json] [--compare file.json]
+        [--threshold percent]
+
+With --compare, the exit status is non-zero if the median latency of any case is more than --threshold percent
+slower than in the baseline file (as written by --save).
+
+@author: phygbu
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+from functools import partial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from pyscpi.core.base import Param, parse_block  # noqa: E402
+from pyscpi.instr.keithley import K2182A, K6221  # noqa: E402
+from pyscpi.measurements.K6221_K2182 import Measurement  # noqa: E402
+from pyscpi.sim import K2182A_Simulator, K6221_Simulator, Simulated_Resource_Manager  # noqa: E402
+
+CASES = OrderedDict()
+
+
+def case(name):
+    """Register a setup function that returns the operation to benchmark for *name*."""
+
+    def register(setup):
+        CASES[name] = setup
+        return setup
+
+    return register
+
+
+def simulated_rm():
+    """A resource manager with a 6221 (and 2182A on its serial port) and a directly connected 2182A."""
+    bridged = K2182A_Simulator(time_scale=0.0, seed=1)
+    k6221 = K6221_Simulator(nanovoltmeter=bridged, time_scale=0.0, serial_rate=None, seed=1)
+    return Simulated_Resource_Manager(
+        {"GPIB0::11::INSTR": k6221, "GPIB0::7::INSTR": K2182A_Simulator(time_scale=0.0, seed=1)}
+    )
+
+
+def _walk(depth):
+    """Walk *depth* attributes down k2182.sens.volt.chan1.rang.upp - reading UPP at depth 5."""
+    instr = K2182A(simulated_rm(), "GPIB0::7::INSTR", via_6221=False)
+    names = ["sens", "volt", "chan1", "rang", "upp"][:depth]
+
+    def walk():
+        node = instr
+        for name in names:
+            node = getattr(node, name)
+        return node
+
+    return walk
+
+
+for _depth in range(1, 5):
+    case("path/proxy_depth_{}".format(_depth))(partial(_walk, _depth))
+case("path/read_depth_5")(partial(_walk, 5))
+
+
+@case("path/resolve_uncached")
+def _resolve_uncached():
+    k2182 = K2182A(simulated_rm(), "GPIB0::7::INSTR", via_6221=False)
+
+    def resolve():
+        k2182.path_cache.clear()
+        return k2182._get_path("SENS:VOLT:CHAN1:RANG:UPP")
+
+    return resolve
+
+
+@case("param/format_write_scalar")
+def _format_write_scalar():
+    param = Param(float, float)
+    return lambda: param.format_write("SOUR:DELT:HIGH", 1.234e-6)
+
+
+@case("param/format_write_list_100")
+def _format_write_list():
+    param, tree, _ = K6221(simulated_rm())._get_path("SOUR:LIST:CURR")
+    values = np.linspace(-1e-6, 1e-6, 100)
+    return lambda: param.format_write(tree, values)
+
+
+def _trace(points):
+    """Some random TRAC:DATA readings."""
+    return np.random.RandomState(1).normal(size=points)
+
+
+def _format_read(points):
+    """Convert an ASCII TRAC:DATA reply of *points* readings."""
+    param = Param(np.array([]))
+    text = ",".join("{:+.6E}".format(x) for x in _trace(points))
+    return partial(param.format_read, text)
+
+
+def _parse_block(points):
+    """Convert a binary REAL,32 TRAC:DATA reply of *points* readings."""
+    payload = _trace(points).astype("<f4").tobytes()
+    size = str(len(payload)).encode("ascii")
+    block = b"#" + str(len(size)).encode("ascii") + size + payload
+    return partial(parse_block, block, "<f4")
+
+
+for _points in (1000, 10000, 65536):
+    case("param/format_read_trace_{}".format(_points))(partial(_format_read, _points))
+    case("param/parse_block_trace_{}".format(_points))(partial(_parse_block, _points))
+
+
+def _measurement(binary=False):
+    meas = Measurement(simulate=simulated_rm(), binary=binary, repeats=4)
+    meas.connect()
+    meas.configure_delta()
+    return meas
+
+
+@case("measurement/configure_delta")
+def _configure_delta():
+    return _measurement().configure_delta
+
+
+@case("measurement/measure_delta")
+def _measure_delta():
+    return _measurement().measure_delta
+
+
+@case("measurement/measure_delta_binary")
+def _measure_delta_binary():
+    return _measurement(binary=True).measure_delta
+
+
+def run_case(operation, duration):
+    """Time *operation* for about *duration* seconds.
+
+    Returns:
+        (dict): ops per second, mean and percentile latencies in microseconds and the peak bytes allocated by one
+        operation.
+    """
+    for _ in range(3):  # Warm up caches
+        operation()
+    number = 1
+    while True:  # Batch fast operations so that the timer resolution doesn't matter
+        start = time.perf_counter()
+        for _ in range(number):
+            operation()
+        if time.perf_counter() - start > 2e-4 or number >= 1 << 16:
+            break
+        number *= 2
+    samples = []
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end or len(samples) < 5:
+        start = time.perf_counter()
+        for _ in range(number):
+            operation()
+        samples.append((time.perf_counter() - start) / number)
+    samples = np.array(samples) * 1e6
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        operation()
+        peak = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    return OrderedDict(
+        [
+            ("ops_per_sec", 1e6 / samples.mean()),
+            ("mean_us", samples.mean()),
+            ("p50_us", np.percentile(samples, 50)),
+            ("p90_us", np.percentile(samples, 90)),
+            ("p99_us", np.percentile(samples, 99)),
+            ("peak_alloc_bytes", int(peak)),
+            ("samples", len(samples)),
+        ]
+    )
+
+
+def compare(results, baseline, threshold):
+    """Print the change from the *baseline* results and return the names of cases slower by over *threshold* %."""
+    slower = []
+    print("\n{:<40s} {:>12s} {:>12s} {:>8s}".format("case", "baseline", "now", "change"))
+    for name, result in results.items():
+        old = baseline.get("results", {}).get(name)
+        if old is None:
+            continue
+        change = 100.0 * (result["p50_us"] / old["p50_us"] - 1.0)
+        flag = ""
+        if change > threshold:
+            slower.append(name)
+            flag = " SLOWER"
+        print(
+            "{:<40s} {:>10.2f}us {:>10.2f}us {:>+7.1f}%{}".format(
+                name, old["p50_us"], result["p50_us"], change, flag
+            )
+        )
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--filter", default="", help="Only run cases whose name contains this")
+    parser.add_argument("--time", type=float, default=1.0, help="Seconds to time each case for (default 1)")
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Compare with the results in this JSON file")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Percent slowdown to fail on (default 10)")
+    args = parser.parse_args(argv)
+
+    results = OrderedDict()
+    print("{:<40s} {:>12s} {:>10s} {:>10s} {:>10s} {:>10s}".format(
+        "case", "ops/s", "p50 us", "p90 us", "p99 us", "peak B"))
+    for name, setup in CASES.items():
+        if args.filter not in name:
+            continue
+        result = results[name] = run_case(setup(), args.time)
+        print(
+            "{:<40s} {:>12.1f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10d}".format(
+                name,
+                result["ops_per_sec"],
+                result["p50_us"],
+                result["p90_us"],
+                result["p99_us"],
+                result["peak_alloc_bytes"],
+            )
+        )
+    report = OrderedDict(
+        [
+            ("python", platform.python_version()),
+            ("platform", platform.platform()),
+            ("numpy", np.__version__),
+            ("time", time.strftime("%Y-%m-%dT%H:%M:%S")),
+            ("results", results),
+        ]
+    )
+    if args.save:
+        with open(args.save, "w") as data:
+            json.dump(report, data, indent=2)
+    if args.compare:
+        with open(args.compare, "r") as data:
+            slower = compare(results, json.load(data), args.threshold)
+        if slower:
+            print("\n{} case(s) slower than the baseline: {}".format(len(slower), ", ".join(slower)))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
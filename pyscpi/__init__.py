@@ -1,5 +1,17 @@
-"""pyscpi is a package to implement a SCPI driver for Python"""
-__all__ = ["core","intr","measurements"]
-import pyscpi.core as core
-import pyscpi.instr as instr
-import pyscpi.measurements as measurements
\ No newline at end of file
+"""pyscpi is a package to implement a SCPI driver for Python
+
+The sub-packages are only imported when they are first used, so ``import pyscpi`` (or ``import pyscpi.core``)
+does not pull in numpy, VISA or EPICS until something actually needs them.
+"""
+__all__ = ["core", "instr", "measurements", "sim"]
+
+import importlib
+
+
+def __getattr__(name):
+    """Import the sub-packages on first access."""
+    if name in __all__:
+        module = importlib.import_module("pyscpi." + name)
+        globals()[name] = module
+        return module
+    raise AttributeError("module 'pyscpi' has no attribute {}".format(name))
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Asyncio support for the communications classes and instrument drivers.
+
+Every :py:class:`pyscpi.core.comms.InstrumentComms` has awaitable versions of its operations - ``atrans``,
+``atrans_raw``, ``awrite``, ``aread`` and ``aread_raw`` - and every driver has ``aget`` and ``aset`` for reading and
+setting commands by their path::
+
+    async def poll(k6221):
+        await k6221.aset("SOUR:DELT:HIGH", 1e-6)
+        return await k6221.aget("STAT:MEAS:EVEN")
+
+By default the blocking operations are run in the event loop's executor, holding the
+:py:func:`pyscpi.core.comms.transport_lock` so that concurrent coroutines, and any
+:py:class:`pyscpi.core.group.InstrumentGroup` using the same connection, don't interleave their commands and
+replies - this is the bridge used for VISA. The :py:class:`AsyncSocketInstrument` transport talks to the
+instrument over asyncio streams instead, so it needs no threads for the I/O. A raw socket driver becomes a
+native asyncio driver by mixing it in::
+
+    class K6221_Async(K6221_LAN, AsyncSocketInstrument):
+        pass
+
+This module is only imported when one of the asynchronous methods is first used, so the blocking API doesn't pay
+for importing asyncio.
+
+@author: phygbu
+"""
+__all__ = ["AsyncSocketInstrument", "run_blocking", "get_param", "set_param"]
+
+import asyncio
+import socket
+from contextlib import asynccontextmanager
+from functools import partial
+
+from ..exceptions import CommandError
+from .cache import missing
+from .comms import SocketInstrument, transport_lock
+
+
+def _locked(comms, method, args, kargs):
+    with transport_lock(comms):
+        return getattr(comms, method)(*args, **kargs)
+
+
+async def _acquire(lock):
+    """Acquire the threading *lock* without blocking the event loop."""
+    if lock.acquire(blocking=False):
+        return
+    acquired = asyncio.get_running_loop().run_in_executor(None, lock.acquire)
+    try:
+        await asyncio.shield(acquired)
+    except asyncio.CancelledError:  # Give it back once the worker thread gets it
+        acquired.add_done_callback(lambda future: lock.release())
+        raise
+
+
+async def run_blocking(comms, method, *args, **kargs):
+    """Run the blocking *method* (by name) of *comms* in the event loop's executor and return its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(_locked, comms, method, args, kargs))
+
+
+async def get_param(instr, param, tree):
+    """Read *param* at *tree* from *instr* with its asynchronous operations - see :py:meth:`aget`.
+
+    This follows :py:meth:`pyscpi.core.base.SCPI_Instrument_Mixin._read_param`, answering from the shadow where
+    it allows.
+    """
+    if instr._batch is not None:
+        raise CommandError("aget can't be used inside a batch()")
+    shadow = instr._shadow
+    use_shadow = shadow is not None and param._decode is not None and not param._array
+    if use_shadow:
+        value = shadow.value(tree)
+        if value is not missing:
+            return value
+    if param._decode is None:
+        await instr.awrite(tree)
+        return None
+    query = tree + "?"
+    dtype = getattr(instr, "_block_dtype", None) if param._array else None
+    if dtype is not None:
+        return param.format_block(await instr.atrans_raw(query), dtype)
+    value = param.format_read(await instr.atrans(query))
+    if use_shadow:
+        instr._remember_read(param, tree, value)
+    return value
+
+
+async def set_param(instr, param, tree, value):
+    """Set *param* at *tree* on *instr* with its asynchronous operations - see :py:meth:`aset`."""
+    if instr._batch is not None:
+        raise CommandError("aset can't be used inside a batch()")
+    command = param.format_write(tree, value)
+    shadow = instr._shadow
+    if shadow is None or param._decode is None or param._write is None or param._array:
+        await instr.awrite(command)
+    elif not shadow.unchanged(tree, command):
+        await instr.awrite(command)
+        shadow.wrote(tree, command)
+
+
+class AsyncSocketInstrument(SocketInstrument):
+
+    """Raw socket SCPI with native asyncio versions of the operations, built on asyncio streams.
+
+    The blocking methods inherited from :py:class:`pyscpi.core.comms.SocketInstrument` still work, but the
+    blocking and asyncio operations each use their own connection, and switching from one to the other closes the
+    connection of the other first, so it is best to stick to one style. Coroutines sharing an instance are
+    serialised with an asyncio lock, so each transaction's reply goes back to the coroutine that asked for it, and
+    also hold the :py:func:`pyscpi.core.comms.transport_lock` while they talk to the instrument. The stream and
+    lock belong to the event loop they were made in, so using the instance from a new loop (e.g. a second
+    :py:func:`asyncio.run`) starts afresh with a new connection.
+
+    The arguments are the same as for :py:class:`pyscpi.core.comms.SocketInstrument`.
+    """
+
+    def __init__(self, *args, **kargs):
+        self._reader = None
+        self._writer = None
+        self._alock = None
+        self._loop = None  # The event loop that the stream and lock were made in
+        super(AsyncSocketInstrument, self).__init__(*args, **kargs)
+
+    @property
+    def connection(self):
+        """The blocking connection - closing the asyncio one first if it is open."""
+        if self._writer is not None:
+            self._close_stream()
+        return super(AsyncSocketInstrument, self).connection
+
+    @property
+    def _lock(self):
+        """The asyncio lock for the running event loop, forgetting the stream of any earlier loop."""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._reader = self._writer = None  # Closing it would need the old loop, which may have gone
+            self._alock = asyncio.Lock()
+            self._loop = loop
+        return self._alock
+
+    @asynccontextmanager
+    async def _exclusive(self):
+        """Hold the connection for one operation, against other coroutines and against group worker threads."""
+        async with self._lock:
+            lock = transport_lock(self)
+            await _acquire(lock)
+            try:
+                yield
+            finally:
+                lock.release()
+
+    async def _stream(self):
+        """Return the (reader, writer) for the asyncio connection, opening it if needed."""
+        if self._writer is None:
+            if self._connection is not None:  # Switching over from the blocking connection
+                super(AsyncSocketInstrument, self).close()
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.ip, self.port), self.connect_timeout
+            )
+            sock = writer.get_extra_info("socket")
+            if sock is not None:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._reader, self._writer = reader, writer
+        return self._reader, self._writer
+
+    def _close_stream(self):
+        if self._writer is not None:
+            try:
+                self._writer.close()
+            except (OSError, RuntimeError):  # RuntimeError if the event loop has already gone
+                pass
+        self._reader = self._writer = None
+
+    def close(self):
+        """Close both connections."""
+        self._close_stream()
+        super(AsyncSocketInstrument, self).close()
+
+    async def _awrite(self, command):
+        if self.debug:
+            print("DEBUG {}:{} Write :{}".format(self.ip, self.port, command))
+        data = command.strip().encode("ascii") + self.terminator
+        for attempt in range(self.retries + 1):
+            try:
+                writer = (await self._stream())[1]
+                writer.write(data)
+                await writer.drain()
+                return
+            except (OSError, IOError):
+                self._close_stream()
+                if attempt == self.retries:
+                    raise
+
+    async def _areadline(self, timeout):
+        reader = (await self._stream())[0]
+        try:
+            return (await asyncio.wait_for(reader.readuntil(self.terminator), timeout))[
+                : -len(self.terminator)
+            ]
+        except asyncio.IncompleteReadError:
+            self._close_stream()
+            raise ConnectionError(
+                "Connection to {}:{} closed by the instrument".format(self.ip, self.port)
+            )
+
+    async def _aread(self, wait=None, timeout=None):
+        if wait is not None:
+            await asyncio.sleep(wait)
+        try:
+            line = await self._areadline(self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            self._close_stream()  # Any late reply would be out of step with the next command
+            raise socket.timeout("No reply from {}:{}".format(self.ip, self.port))
+        buf = line.decode("ascii", "replace").strip()
+        if self.debug:
+            print("DEBUG {}:{} Read :{}".format(self.ip, self.port, buf))
+        return buf
+
+    async def _aread_block(self, reader):
+        """Read an IEEE 488.2 definite length block, or up to the terminator if the reply isn't one."""
+        first = await reader.readexactly(1)
+        if first != b"#":
+            return first + (await reader.readuntil(self.terminator))[: -len(self.terminator)]
+        digits = await reader.readexactly(1)
+        if digits == b"0":
+            return first + digits + (await reader.readuntil(self.terminator))[: -len(self.terminator)]
+        size = await reader.readexactly(int(digits))
+        data = await reader.readexactly(int(size) + len(self.terminator))
+        return first + digits + size + data[: -len(self.terminator)]
+
+    async def _aread_raw(self, wait=None, timeout=None):
+        if wait is not None:
+            await asyncio.sleep(wait)
+        reader = (await self._stream())[0]
+        try:
+            data = await asyncio.wait_for(
+                self._aread_block(reader), self.timeout if timeout is None else timeout
+            )
+        except asyncio.TimeoutError:
+            self._close_stream()
+            raise socket.timeout("No reply from {}:{}".format(self.ip, self.port))
+        except asyncio.IncompleteReadError:
+            self._close_stream()
+            raise ConnectionError(
+                "Connection to {}:{} closed by the instrument".format(self.ip, self.port)
+            )
+        if self.debug:
+            print("DEBUG {}:{} Read {} bytes".format(self.ip, self.port, len(data)))
+        return data
+
+    async def awrite(self, command, close=True):
+        """Send a string to the instrument."""
+        async with self._exclusive():
+            await self._awrite(command)
+
+    async def aread(self, close=True, wait=None, timeout=None):
+        """Read a string back from the instrument."""
+        async with self._exclusive():
+            return await self._aread(wait, timeout)
+
+    async def aread_raw(self, close=True, wait=None, timeout=None):
+        """Read a binary response, using the length in an IEEE 488.2 block header to know when it is complete."""
+        async with self._exclusive():
+            return await self._aread_raw(wait, timeout)
+
+    async def atrans(self, command, close=True, wait=None, timeout=None):
+        """Do a Write-Read transaction."""
+        async with self._exclusive():
+            await self._awrite(command)
+            return await self._aread(wait, timeout)
+
+    async def atrans_raw(self, command, close=True, wait=None, timeout=None):
+        """Do a Write-Read transaction returning the raw bytes of the response."""
+        async with self._exclusive():
+            await self._awrite(command)
+            return await self._aread_raw(wait, timeout)
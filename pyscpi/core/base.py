@@ -7,16 +7,42 @@ Created on Thu Aug 29 22:21:11 2019
 
 @author: phygbu
 """
-__all__ = ["SCPI_Path_Dict", "Param", "SCPI_Instrument_Mixin"]
+__all__ = [
+    "SCPI_Path_Dict",
+    "Frozen_SCPI_Path_Dict",
+    "Param",
+    "Command_Handle",
+    "SCPI_Instrument_Mixin",
+    "parse_ascii_array",
+    "parse_block",
+    "merge_commands",
+]
 
-import numpy as np
 import re
-from collections import MutableMapping, OrderedDict,Iterable,Mapping
+import sys
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
 from os import path
 
+try:
+    from collections.abc import MutableMapping, Iterable, Mapping
+except ImportError:  # Python 2
+    from collections import MutableMapping, Iterable, Mapping
+
 
 from ..exceptions import CommandError
-from pyscpi.measurements.base import EpisMeasurementMixin
+from .cache import LRU_Cache, Shadow_State, missing
+
+
+def _numpy():
+    """Return the numpy module if something has already imported it, or None.
+
+    numpy is only needed for array parameters, and these can only exist if whoever built the command tree has
+    imported numpy already, so there is no need for the core classes to pay for importing it themselves.
+    """
+    return sys.modules.get("numpy")
 
 
 class SCPI_Path_Dict(MutableMapping):
@@ -26,17 +52,33 @@ class SCPI_Path_Dict(MutableMapping):
     This class uses the abstract base class for a MutableMapping, passing through
     the required abstract methods to an underlying OrderedDict store.
 
-    All name lookups are passed through a functional that understands the partial matching rules of SCPI"""
+    All name lookups are passed through a functional that understands the partial matching rules of SCPI. A
+    name matches a key if the name starts with the key (so *SOUR*, *SOURC* and *SOURCE* all find *SOUR*). To
+    keep this cheap for large trees a prefix index of the key lengths is maintained as keys are inserted, so
+    resolving a name costs at most one dictionary lookup per distinct key length rather than a scan over all
+    the sibling keys. Successful resolutions are also remembered so repeated lookups of the same attribute
+    name are a single dictionary hit.
+    """
+
+    _max_aliases = 1024  # Upper bound on the number of remembered name lookups
 
     def __init__(self, *args, **kargs):
         """Create the actual dictionary store we use and then init it."""
 
-        self._store = OrderedDict(*args)
+        self._store = OrderedDict()
+        self._sorted = []  # Sorted keys for ambiguity checks
+        self._lengths = ()  # Distinct key lengths, longest first
+        self._aliases = {}  # Cache of name -> canonical key
+        self._version = 0  # Bumped on every change so that callers can spot stale caches
+        self.update(*args, **kargs)
 
     def __delitem__(self,name):
         """Delete an item from the dictionary."""
         name = self.canonical(name)
         del self._store[name]
+        del self._sorted[bisect_left(self._sorted, name)]
+        self._reindex()
+        self._version += 1
 
     def __setitem__(self,name, value):
         """Set an item into the dictionary."""
@@ -44,7 +86,9 @@ class SCPI_Path_Dict(MutableMapping):
             name = self.canonical(name)
         except KeyError:
             name = name.upper()  # Force upper case names
+            self._add_key(name)
         self._store[name] = value
+        self._version += 1
 
     def __getitem__(self, name):
         """Get an item from the dictionary."""
@@ -53,7 +97,7 @@ class SCPI_Path_Dict(MutableMapping):
 
     def __iter__(self):
         """Just iterate over our own keys."""
-        return self._store.keys()
+        return iter(self._store)
 
     def __len__(self):
         """Our length."""
@@ -76,93 +120,461 @@ class SCPI_Path_Dict(MutableMapping):
     def items(self):
         return self._store.items()
 
+    def _add_key(self, name):
+        """Add a new key to the prefix index, checking that it doesn't make any existing key ambiguous.
+
+        Raises:
+            ValueError: if *name* is a prefix of a key already in the table - any name that matched the
+                longer key would then match both.
+        """
+        ix = bisect_left(self._sorted, name)
+        if ix < len(self._sorted) and self._sorted[ix].startswith(name):
+            raise ValueError(
+                "SCPI mnemonic {} is ambiguous with {}".format(name, self._sorted[ix])
+            )
+        self._sorted.insert(ix, name)
+        self._reindex()
+
+    def _reindex(self):
+        """Rebuild the table of key lengths and forget any remembered lookups."""
+        self._lengths = tuple(sorted(set(len(k) for k in self._sorted), reverse=True))
+        self._aliases = {}
+
     def canonical(self, name):
-        name = name.upper()
+        """Find the key in this dictionary that *name* is a (possibly long form) match for.
+
+        Args:
+            name (str): The SCPI mnemonic to look up - case insensitive.
+
+        Returns:
+            (str): The key as stored in the dictionary.
+
+        Raises:
+            KeyError: if *name* doesn't match any key.
+        """
         try:
-            return super(SCPI_Path_Dict, self).__getitem__(name)
+            return self._aliases[name]
         except KeyError:
             pass
-        for n in self.keys():
-            if name.startswith(n):
-                return n
+        upper = name.upper()
+        store = self._store
+        size = len(upper)
+        for length in self._lengths:
+            if length > size:
+                continue
+            key = upper[:length]
+            if key in store:
+                break
         else:
             raise KeyError("Cannot make {} into a canonical name:".format(name))
+        if len(self._aliases) >= self._max_aliases:
+            self._aliases.clear()
+        self._aliases[name] = key
+        return key
 
+    def freeze(self):
+        """Return an immutable copy of this tree with all the sub-trees converted as well."""
+        return Frozen_SCPI_Path_Dict(self)
 
-class Param(object):
+    def walk(self, base=""):
+        """Iterate over all the terminal commands below this tree in the order they were declared.
 
-    """Container to hold expected send and return types for SCPI commands."""
+        Keyword Arguments:
+            base (str): The SCPI path of this tree, prefixed to the names yielded.
 
-    def __init__(self, read=None, write=None):
-        self.read = read
-        self.write = write
+        Yields:
+            (name, Param): The full path to each :py:class:`Param`, including any final ``:_``, so that it can
+            be passed back to :py:meth:`SCPI_Instrument_Mixin.handle` and friends.
+        """
+        for key, value in self._store.items():
+            name = "{}:{}".format(base, key) if base else key
+            if isinstance(value, SCPI_Path_Dict):
+                for entry in value.walk(name):
+                    yield entry
+            elif isinstance(value, Param):
+                yield name, value
 
-    def __repr__(self):
-        return "R:{}, W:{}".format(self.read, self.write)
 
-    def format_write(self, tree, value):
-        """Use Parameter info to check and format a string to send."""
-        if isinstance(self.write, type):
-            write = self.write(1)
-        else:
-            write = self.write
-        if self.write is None:
+class Frozen_SCPI_Path_Dict(SCPI_Path_Dict):
+
+    """An immutable :py:class:`SCPI_Path_Dict` whose sub-trees are also Frozen_SCPI_Path_Dicts.
+
+    Instruments keep their command tree in this form so that walking a path never has to re-wrap a plain
+    dictionary and the same nodes can safely be shared between instances.
+    """
+
+    def __init__(self, *args, **kargs):
+        """Populate the tree and then lock it."""
+        self._frozen = False
+        super(Frozen_SCPI_Path_Dict, self).__init__(*args, **kargs)
+        self._frozen = True
+
+    def __delitem__(self, name):
+        """Frozen trees can't be changed."""
+        raise TypeError("Cannot delete {} from a frozen command tree".format(name))
+
+    def __setitem__(self, name, value):
+        """Only allow items to be set whilst the tree is being built, converting sub-trees as we go."""
+        if self._frozen:
+            raise TypeError("Cannot set {} in a frozen command tree".format(name))
+        if isinstance(value, Mapping) and not isinstance(value, Frozen_SCPI_Path_Dict):
+            value = Frozen_SCPI_Path_Dict(value)
+        super(Frozen_SCPI_Path_Dict, self).__setitem__(name, value)
+
+    def freeze(self):
+        """Already frozen, so just return ourselves."""
+        return self
+
+
+_true_strings = frozenset(["1", "ON", "YES", "TRUE"])
+
+
+def parse_ascii_array(text, dtype=float, columns=None, sep=","):
+    """Convert a separated list of numbers from an instrument into a numpy array.
+
+    Args:
+        text (str): The response, e.g. ``"+1.23E-05,+2.00E-01,..."``.
+
+    Keyword Arguments:
+        dtype (numpy dtype): The type of the returned array (default float).
+        columns (int or None): If given, reshape the data to have this many columns - e.g. for a buffer read with
+            several FORM:ELEM elements per reading.
+        sep (str): The separator between values.
+
+    Returns:
+        (ndarray): The data.
+
+    Raises:
+        ValueError: if the text can't be completely parsed or doesn't divide into *columns*.
+
+    numpy parses the text in a single pass, without building intermediate Python objects for each value. A
+    trailing separator is ignored, and the number of values parsed is checked against the number of separators
+    so that a reply with the wrong separator or a missing value raises rather than being silently truncated.
+    """
+    import numpy as np
+
+    text = text.strip()
+    if text.endswith(sep):
+        text = text[: -len(sep)].rstrip()
+    if not text:
+        data = np.zeros(0, dtype=dtype)
+    else:
+        expected = text.count(sep) + 1
+        data = np.fromstring(text, dtype=dtype, sep=sep)
+        if data.size != expected:
+            raise ValueError(
+                "Parsed {} of the {} values in the reply {!r}".format(data.size, expected, text[:40])
+            )
+    if columns:
+        data = data.reshape(-1, int(columns))
+    return data
+
+
+# FORM:DATA settings and the numpy type of each value in a binary block (None for ASCII transfers)
+block_formats = {
+    "ASC": None,
+    "ASCII": None,
+    "REAL": "f4",
+    "REAL,32": "f4",
+    "REAL,64": "f8",
+    "SRE": "f4",
+    "SREAL": "f4",
+    "DRE": "f8",
+    "DREAL": "f8",
+}
+# FORM:BORD settings and the numpy byte order prefix - NORMal is IEEE 488.2 big-endian
+byte_orders = {"NORM": ">", "NORMAL": ">", "SWAP": "<", "SWAPPED": "<"}
+
+
+def parse_block(data, dtype=">f4", columns=None):
+    """Decode an IEEE 488.2 binary block of numbers without copying it.
+
+    Args:
+        data (bytes): The raw response, either a definite length block ``#<n><length><data>`` or an indefinite
+            length block ``#0<data>``, optionally followed by a terminator.
+
+    Keyword Arguments:
+        dtype (numpy dtype): The type and byte order of the values (default big-endian 32 bit floats).
+        columns (int or None): If given, reshape the data to have this many columns.
+
+    Returns:
+        (ndarray): A read-only array that views the data in *data*.
+
+    Raises:
+        ValueError: if *data* is not a well formed block.
+    """
+    import numpy as np
+
+    dtype = np.dtype(dtype)
+    data = memoryview(data).cast("B")
+    start = 0
+    while start < len(data) and data[start] in b" \r\n":  # Skip any leading white space
+        start += 1
+    if len(data) < start + 2 or data[start] != ord("#"):
+        raise ValueError("Binary block does not start with #")
+    digits = data[start + 1] - ord("0")
+    if not 0 <= digits <= 9:
+        raise ValueError("Binary block has a bad header")
+    if digits == 0:  # Indefinite length - runs to the terminator
+        offset = start + 2
+        length = len(data) - offset
+        while length and data[offset + length - 1] in b"\r\n":
+            length -= 1
+    else:
+        offset = start + 2 + digits
+        try:
+            length = int(bytes(data[start + 2 : offset]))
+        except ValueError:
+            raise ValueError("Binary block has a bad length field")
+        if len(data) < offset + length:
+            raise ValueError(
+                "Binary block is truncated: {} of {} bytes".format(
+                    len(data) - offset, length
+                )
+            )
+    values = np.frombuffer(
+        data, dtype=dtype, count=length // dtype.itemsize, offset=offset
+    )
+    if columns:
+        values = values.reshape(-1, int(columns))
+    return values
+
+
+def _make_encoder(write, precision=None, choices=None):
+    """Build the function that Param.format_write uses for the write type *write*.
+
+    The returned function takes the SCPI command and the value and returns the string to send.
+    """
+    if write is None:
+
+        def encode(tree, value):
             raise CommandError(
                 "Read only parameter {} trying to be written with {}".format(
                     tree, value
                 )
             )
-        if isinstance(write, str):
-            return "{} {}".format(tree, value)
-        elif isinstance(write, bool):
-            value = "ON" if value else "OFF"
-            return "{} {}".format(tree, value)
-        elif isinstance(write, int):
-            value = int(value)
-            return "{} {}".format(tree, value)
-        elif isinstance(write, float):
-            value = float(value)
+
+        return encode
+    sample = write(1) if isinstance(write, type) else write
+    np = _numpy()
+    if isinstance(sample, str):
+        if choices is None:
+            return "{} {}".format
+        allowed = frozenset(str(choice).upper() for choice in choices)
+
+        def encode(tree, value):
+            if str(value).upper() not in allowed:
+                raise ValueError(
+                    "{} must be one of {} not {}".format(tree, sorted(allowed), value)
+                )
             return "{} {}".format(tree, value)
-        elif isinstance(write, np.ndarray):
+
+        return encode
+    if isinstance(sample, bool):
+
+        def encode(tree, value):
+            return tree + (" ON" if value else " OFF")
+
+        return encode
+    if isinstance(sample, int):
+
+        def encode(tree, value):
+            return "{} {}".format(tree, int(value))
+
+        return encode
+    if isinstance(sample, float):
+        if precision is None:
+
+            def encode(tree, value):
+                return "{} {}".format(tree, float(value))
+
+        else:
+            fmt = "{{}} {{:.{}g}}".format(int(precision)).format
+
+            def encode(tree, value):
+                return fmt(tree, float(value))
+
+        return encode
+    if np is not None and isinstance(sample, np.ndarray):
+        dtype = sample.dtype
+        length = max(sample.size, 1)
+
+        def encode(tree, value):
             if not isinstance(value, Iterable):
                 raise ValueError(
                     "{} expects an iterable value not a {}".format(tree, type(value))
                 )
-            value = np.array(value).astype(self.write.dtype)
-            length = self.write.size
-            ret = []
-            for ix in range(value.size // length + 1):
-                ret.append(
-                    "{} {}".format(
-                        tree,
-                        ",".join(value[ix * length : (ix + 1) * length].astype(str)),
-                    )
-                )
-            return "\n".join(ret)
-        else:
-            return "{} {}".format(tree, value)
+            value = np.asarray(value).astype(dtype).ravel().astype(str)
+            return "\n".join(
+                "{} {}".format(tree, ",".join(value[ix : ix + length]))
+                for ix in range(0, value.size, length)
+            )
 
-    def do_read(self, tree, instr):
+        return encode
+    return "{} {}".format
+
+
+def _make_decoder(read, columns=None):
+    """Build the function that Param.format_read uses for the read type *read*.
+
+    The returned function takes the string returned from the instrument and converts it to a Python value.
+    """
+    if read is None:
+        return None
+    if read is bool:
+
+        def decode(value):
+            return value.upper().strip() in _true_strings
+
+        return decode
+    read_cls = read if isinstance(read, type) else read.__class__
+    np = _numpy()
+    if np is not None and issubclass(read_cls, np.ndarray):
+        dtype = read.dtype if isinstance(read, np.ndarray) else float
+
+        def decode(value):
+            return parse_ascii_array(value, dtype, columns)
+
+        return decode
+    return read_cls
+
+
+class Param(object):
+
+    """Container to hold expected send and return types for SCPI commands.
+
+    Args:
+        read (type, array or None): The type returned when the command is queried, or None if the command can't be
+            queried.
+        write (type, array or None): The type sent to set the command, or None if it is read only. An array gives
+            the dtype and maximum number of values to send in one command.
+
+    Keyword Arguments:
+        precision (int): Number of significant figures to send for float values (default is the full repr).
+        choices (list of str): The allowed values for a string parameter.
+        columns (int): Reshape array values read back to have this many columns.
+
+    The functions that convert values to and from strings are worked out once, when the types are set, so that
+    formatting doesn't need to check types on every call.
+    """
+
+    def __init__(self, read=None, write=None, precision=None, choices=None, columns=None):
+        self.precision = precision
+        self.choices = choices
+        self.columns = columns
+        self.read = read
+        self.write = write
+
+    def __repr__(self):
+        return "R:{}, W:{}".format(self.read, self.write)
+
+    def __getstate__(self):
+        """The compiled functions can't be pickled, so just save the types."""
+        return {
+            "read": self._read,
+            "write": self._write,
+            "precision": self.precision,
+            "choices": self.choices,
+            "columns": self.columns,
+        }
+
+    def __setstate__(self, state):
+        """Rebuild the compiled functions on unpickling."""
+        self.__init__(**state)
+
+    @property
+    def read(self):
+        """The type expected back from the instrument."""
+        return self._read
+
+    @read.setter
+    def read(self, value):
+        self._read = value
+        self._decode = _make_decoder(value, self.columns)
+        np = _numpy()
+        self._array = np is not None and (
+            isinstance(value, np.ndarray)
+            or (isinstance(value, type) and issubclass(value, np.ndarray))
+        )
+
+    @property
+    def write(self):
+        """The type to send to the instrument."""
+        return self._write
+
+    @write.setter
+    def write(self, value):
+        self._write = value
+        self._encode = _make_encoder(value, self.precision, self.choices)
+
+    def format_write(self, tree, value):
         """Use Parameter info to check and format a string to send."""
-        if self.read is None:
-            instr.write(tree)
+        return self._encode(tree, value)
+
+    def do_read(self, tree, instr, query=None):
+        """Use Parameter info to check and format a string to send.
+
+        Args:
+            tree (str): The SCPI command.
+            instr (SCPI_Instrument_Mixin): The instrument to talk to.
+
+        Keyword Arguments:
+            query (str): The query to send, if already known (default is *tree* with a ? added).
+
+        Array values are transferred as binary blocks if the instrument has been put into a binary data format
+        with :py:meth:`SCPI_Instrument_Mixin.set_data_format`.
+        """
+        if self._decode is None:
+            instr._send_command(tree)
             return None
-        else:
-            return self.format_read(instr.trans(tree + "?"))
+        if query is None:
+            query = tree + "?"
+        if self._array:
+            dtype = getattr(instr, "_block_dtype", None)
+            if dtype is not None:
+                return self.format_block(instr._query_command(query, raw=True), dtype)
+        return self._decode(instr._query_command(query))
 
     def format_read(self, value):
         """Use self.read to convert the return type to something sensible for Python."""
-        if not isinstance(self.read, type):
-            read = self.read.__class__
-        else:
-            read = self.read
-        if self.read is bool:
-            return value.upper().strip() in ["1", "ON", "YES", "TRUE"]
-        if issubclass(read, np.ndarray):
-            value = [float(x) for x in value.split(",")]
-            return np.array(value)
-        else:
-            return read(value)
+        return self._decode(value)
+
+    def format_block(self, data, dtype):
+        """Decode a binary block response for an array parameter with :py:func:`parse_block`."""
+        return parse_block(data, dtype, self.columns)
+
+
+class Command_Handle(object):
+
+    """A pre-resolved SCPI command bound to an instrument.
+
+    Returned by :py:meth:`SCPI_Instrument_Mixin.handle`, this skips the attribute proxies and path lookups and
+    goes straight from the :py:class:`Param` formatting to the instrument's communications methods, so it is the
+    cheapest way to repeatedly read or set the same thing in a polling loop.
+
+    Attributes:
+        param (Param): The parameter information for the command.
+        tree (str): The canonical SCPI command.
+    """
+
+    __slots__ = ("instr", "param", "tree", "_query")
+
+    def __init__(self, instr, param, tree):
+        self.instr = instr
+        self.param = param
+        self.tree = tree
+        self._query = tree + "?"
+
+    def __repr__(self):
+        return "<Command_Handle {} ({})>".format(self.tree, self.param)
+
+    def get(self):
+        """Query the instrument and return the converted result, or just send the command if it has no reply."""
+        return self.instr._read_param(self.param, self.tree, self._query)
+
+    def set(self, value):
+        """Format and send a new value to the instrument."""
+        self.instr._write_param(self.param, self.tree, value)
 
 
 class SCPI_Instrument_Mixin(object):
@@ -172,76 +584,619 @@ class SCPI_Instrument_Mixin(object):
     This Mixin class needs to be used in conjunction with a InstrumentComms subclass
     to provide the methods to actualy communicate with the instrument via the selected
     interface.
+
+    Drivers declare their commands once as a class attribute: either *scpi_schema*, the name of a schema file (see
+    :py:mod:`pyscpi.core.schema`) relative to the driver's module, or *scpi_commands*, a nested mapping of SCPI
+    mnemonics to :py:class:`Param` instances. This is compiled into a :py:class:`Frozen_SCPI_Path_Dict` the first time it is
+    needed and shared by every instance of the class. An instance can still be given its own tree, either by
+    assigning to *_commands* or with :py:meth:`override_commands`.
+
+    Resolving an attribute path such as
+    ``k2182.sens.volt.chan1.rang.upp`` into the command tree is remembered in a per-instrument LRU cache and
+    there is a single proxy object for each branch of the tree, so repeated accesses don't allocate anything.
+    These are all thrown away whenever the command tree is replaced.
+
+    Settings can be grouped with :py:meth:`batch` so that they are sent to the instrument as a few long messages
+    rather than one message each.
+
+    With ``shadow=True`` the instrument keeps a :py:class:`pyscpi.core.cache.Shadow_State` of the settings it has
+    written and read. Setting a parameter that can be both read and set to the value it already has is then not
+    sent at all, and the commands listed in *shadow_ttl* are only queried once per time to live. The shadow is
+    forgotten by :py:meth:`reset`, :py:meth:`clear` and :py:meth:`invalidate_shadow`.
+
+    Keyword Arguments:
+        path_cache_size (int): Maximum number of resolved paths to remember (default 256).
+        shadow (bool or Shadow_State): Keep a shadow of the instrument settings (default False).
+        shadow_ttl (dict): Extra entries for the class' *shadow_ttl* of canonical commands that can be answered
+            from the shadow and for how many seconds (None for until invalidated).
     """
 
+    scpi_commands = {}  # Override in the driver class with the command tree
+    scpi_schema = None  # ... or with the name of a schema file to load it from
+    max_message_length = 1024  # Longest message that batch() will build
+    shadow_ttl = {"*IDN": None}  # Commands whose replies can be reused from the shadow, and for how long
+
+    def __init__(self, *args, **kargs):
+        """Setup the path cache before passing on to the communications class."""
+        self._command_tree = None
+        self._path_cache = LRU_Cache(kargs.pop("path_cache_size", 256))
+        self._path_cache_version = None
+        self._proxies = {}  # canonical tree -> _proxy for each branch
+        self._block_dtype = None  # numpy dtype of binary array transfers, None for ASCII
+        self._batch = None  # List of queued commands when batching
+        shadow = kargs.pop("shadow", False)
+        ttl = dict(self.shadow_ttl)
+        ttl.update(kargs.pop("shadow_ttl", {}))
+        if shadow is True:
+            shadow = Shadow_State(ttl)
+        self._shadow = shadow if shadow is not False else None
+        super(SCPI_Instrument_Mixin, self).__init__(*args, **kargs)
+
+    @classmethod
+    def compiled_commands(cls):
+        """Return the frozen form of the class' *scpi_commands*, building it on first use.
+
+        The compiled tree is stored on the class that declared *scpi_schema* or *scpi_commands*, so subclasses
+        that don't declare their own commands share their parent's tree. If *scpi_schema* is set it takes
+        precedence over *scpi_commands*.
+        """
+        if cls.scpi_schema is not None:
+            spec, owner = cls.scpi_schema, cls._declared_by("scpi_schema")
+        else:
+            spec, owner = cls.scpi_commands, cls._declared_by("scpi_commands")
+        compiled = owner.__dict__.get("_compiled_commands")
+        if compiled is None or compiled[0] is not spec:
+            if cls.scpi_schema is not None:
+                tree = owner._load_schema()
+            else:
+                tree = Frozen_SCPI_Path_Dict(spec)
+            compiled = (spec, tree)
+            owner._compiled_commands = compiled
+        return compiled[1]
+
+    @classmethod
+    def _declared_by(cls, name):
+        """Return the class in the MRO that declares the attribute *name*."""
+        for klass in cls.__mro__:
+            if name in klass.__dict__:
+                return klass
+        return cls
+
+    @classmethod
+    def _load_schema(cls):
+        """Load scpi_schema relative to the module of the class that declared it."""
+        from .schema import load_schema
+
+        klass = cls._declared_by("scpi_schema")
+        directory = path.dirname(path.abspath(sys.modules[klass.__module__].__file__))
+        return load_schema(path.join(directory, cls.scpi_schema))
+
+    @property
+    def _commands(self):
+        """The SCPI command tree for this instrument."""
+        tree = self._command_tree
+        if tree is None:
+            tree = self._command_tree = self.compiled_commands()
+        return tree
+
+    @_commands.setter
+    def _commands(self, value):
+        """Replace the command tree, dropping any resolved paths."""
+        if not isinstance(value, SCPI_Path_Dict):
+            value = SCPI_Path_Dict(value)
+        self._command_tree = value.freeze()
+        self.clear_path_cache()
+
+    def override_commands(self, overrides):
+        """Give this instance its own command tree with some commands added, replaced or removed.
+
+        Args:
+            overrides (Mapping): A nested mapping in the same form as *scpi_commands*. Sub-trees are merged into
+                the existing tree, other values replace the existing entry and None removes it.
+
+        Branches of the tree that are not touched by *overrides* continue to be shared with the class.
+        """
+        self._commands = merge_commands(self._commands, overrides)
+
+    @property
+    def path_cache(self):
+        """The :py:class:`pyscpi.core.cache.LRU_Cache` of resolved command paths."""
+        return self._path_cache
+
+    def clear_path_cache(self):
+        """Forget all resolved command paths."""
+        self._path_cache.clear()
+        self._path_cache_version = None
+        self._proxies = {}
+
+    @property
+    def shadow(self):
+        """The :py:class:`pyscpi.core.cache.Shadow_State` of the instrument settings, or None if not kept."""
+        return self._shadow
+
+    def invalidate_shadow(self, name=None):
+        """Forget the shadowed value of *name* and everything below it, or of everything if *name* is None.
+
+        Call this after changing the instrument in a way that the driver can't see.
+        """
+        if self._shadow is None:
+            return
+        if name is not None and not name.startswith("*"):
+            name = self._get_path(name)[1]
+        self._shadow.invalidate(name)
+
     @property
     def idn(self):
-        return self.trans("*IDN?")
+        shadow = self._shadow
+        if shadow is not None:
+            ret = shadow.value("*IDN")
+            if ret is not missing:
+                return ret
+            ret = self._query_command("*IDN?")
+            shadow.was_read("*IDN", ret)
+            return ret
+        return self._query_command("*IDN?")
 
     @property
     def opc(self):
-        ret = int(self.trans("*OPC?"))
+        ret = int(self._query_command("*OPC?"))
         return ret == 1
 
     @property
     def sre(self):
-        return int(self.trans("*SRE?"))
+        return int(self._query_command("*SRE?"))
 
     @sre.setter
     def sre(self, value):
         value = int(value) % 256  # sanitise sre
-        self.write("*SRE {}".format(value))
+        self._send_command("*SRE {}".format(value))
 
     @property
     def stb(self):
-        return int(self.trans("*STB?"))
+        return int(self._query_command("*STB?"))
 
     def _get_path(self, name):
-        """Locate the current path in the command dictionary."""
-        full_path = name
-        tree = full_path.replace(path.sep, ":")
+        """Locate the current path in the command dictionary.
+
+        Args:
+            name (str): The path to locate, either as SCPI with : separators or as attribute names.
+
+        Returns:
+            (cmd_dict, tree, full_path): The :py:class:`Param` or sub-tree found, the canonical SCPI command and
+            the path as originally given.
+        """
+        cache = self._cached_paths()
+        hit = cache.get(name)
+        if hit is not None:
+            return hit[0], hit[1], name
+        cmd_dict, tree = self._resolve_path(name)
+        cache.put(name, (cmd_dict, tree))
+        return cmd_dict, tree, name
+
+    def _cached_paths(self):
+        """Return the path cache, emptied first if the command tree has changed since it was filled."""
+        cache = self._path_cache
+        version = self._commands._version
+        if self._path_cache_version != version:
+            cache.clear()
+            self._path_cache_version = version
+        return cache
+
+    def _resolve_path(self, name):
+        """Walk the command tree for *name*, returning the (cmd_dict, tree) without using the path cache."""
+        commands = self._commands
+        tree = name.replace(path.sep, ":")
         canonical = []
-        cmd_dict = self._commands
+        cmd_dict = commands
         for part in tree.split(":"):
-            if part not in cmd_dict:
+            try:
+                part = cmd_dict.canonical(part)
+            except (KeyError, AttributeError):
                 raise AttributeError(
                     "{} not recognised by driver as a SCPI command!".format(tree)
                 )
-            else:
-                part = cmd_dict.canonical(part)
-                canonical.append(part)
-                cmd_dict = cmd_dict[part]
-                if isinstance(cmd_dict, Mapping):
-                    cmd_dict = SCPI_Path_Dict(cmd_dict)
+            canonical.append(part)
+            cmd_dict = cmd_dict[part]
         tree = ":".join(canonical)
         if part == "_":
             tree = ":".join(tree.split(":")[:-1])
 
-        tree = tree.strip(":")
-        return cmd_dict, tree, full_path
+        return cmd_dict, tree.strip(":")
 
-    def __getattr__(self, name):
-        """See if we need to construct as sub-path or whether we have a terminal attribute."""
-        try:
-            return getattr(super(SCPI_Instrument_Mixin, self), name)
-        except AttributeError as err:
-            pass
+    def handle(self, name):
+        """Resolve a SCPI command once and return a :py:class:`Command_Handle` for it.
+
+        Args:
+            name (str): The command, e.g. ``"STAT:MEAS:EVEN"``, using the same partial matching as attribute access.
+
+        Returns:
+            (Command_Handle): An object with get() and set(value) methods for the command.
+
+        Raises:
+            CommandError: if *name* is a branch of the command tree and not a terminal command.
+        """
         cmd_dict, tree, full_path = self._get_path(name)
+        if not isinstance(cmd_dict, Param):
+            raise CommandError("{} is not a terminal SCPI command".format(tree))
+        return Command_Handle(self, cmd_dict, tree)
+
+    def aget(self, name):
+        """Awaitable read of the command *name*, e.g. ``await k6221.aget("STAT:MEAS:EVEN")``.
+
+        The reply is converted just as for attribute access, using the instrument's awaitable
+        :py:meth:`pyscpi.core.comms.InstrumentComms.atrans` - see :py:mod:`pyscpi.core.aio`.
+
+        Raises:
+            CommandError: if *name* is a branch of the command tree, or if we are inside a :py:meth:`batch`.
+        """
+        from .aio import get_param
+
+        handle = self.handle(name)
+        return get_param(self, handle.param, handle.tree)
+
+    def aset(self, name, value):
+        """Awaitable setting of the command *name*, e.g. ``await k6221.aset("SOUR:DELT:HIGH", 1e-6)``."""
+        from .aio import set_param
+
+        handle = self.handle(name)
+        return set_param(self, handle.param, handle.tree, value)
+
+    def _proxy_for(self, node, tree):
+        """Return the one :py:class:`_proxy` for the branch *node* at the canonical path *tree*."""
+        try:
+            return self._proxies[tree]
+        except KeyError:
+            proxy = self._proxies[tree] = _proxy(instr=self, node=node, path=tree)
+            return proxy
+
+    def _child(self, base, name, looked_up=False):
+        """Resolve the attribute *name* below the canonical path *base*, remembering the result in the path cache.
+
+        Keyword Arguments:
+            looked_up (bool): The caller has already missed the path cache for (base, name), so don't look again.
+
+        Returns:
+            Either a :py:class:`_proxy` for a branch or a (Param, tree) tuple for a terminal command.
+        """
+        cache = self._cached_paths()
+        key = (base, name)
+        if not looked_up:
+            entry = cache.get(key)
+            if entry is not None:
+                return entry
+        cmd_dict, tree = self._resolve_path("{}:{}".format(base, name) if base else name)
         if isinstance(
             cmd_dict, Mapping
-        ):  # Sub path returned so we're constructing an instance of ourselves from here.
-            return _proxy(instr=self, path=full_path)
-        if not isinstance(cmd_dict, Param):
+        ):  # Sub path returned so we're handing back the proxy for it
+            entry = self._proxy_for(cmd_dict, tree)
+        elif isinstance(cmd_dict, Param):
+            entry = (cmd_dict, tree)
+        else:
             raise CommandError("Unrecognised command {}".format(tree))
-        return cmd_dict.do_read(tree, self)
+        cache.put(key, entry)
+        return entry
+
+    def __getattr__(self, name):
+        """See if we need to construct as sub-path or whether we have a terminal attribute."""
+        if name.startswith("_") and name != "_":  # Private attributes are never SCPI commands
+            raise AttributeError(
+                "{} has no attribute {}".format(type(self).__name__, name)
+            )
+        entry = self._cached_paths().get(("", name))
+        if entry is None:
+            try:
+                return getattr(super(SCPI_Instrument_Mixin, self), name)
+            except AttributeError as err:
+                pass
+            entry = self._child("", name, looked_up=True)
+        if entry.__class__ is _proxy:
+            return entry
+        return self._read_param(entry[0], entry[1])
+
+    def _read_param(self, param, tree, query=None):
+        """Read *param* at *tree*, answering from the shadow if it allows and remembering the result if kept.
+
+        :py:meth:`pyscpi.core.metrics.Metrics.attach` wraps this to time the conversion of the reply.
+        """
+        shadow = self._shadow
+        if shadow is None or param._decode is None or param._array:
+            return param.do_read(tree, self, query)
+        value = shadow.value(tree)
+        if value is missing:
+            value = param.do_read(tree, self, query)
+            self._remember_read(param, tree, value)
+        return value
+
+    def _remember_read(self, param, tree, value):
+        """Store a value read back in the shadow along with the command that would set it."""
+        command = None
+        if param._write is not None:
+            try:
+                command = param.format_write(tree, value)
+            except (ValueError, TypeError):
+                pass
+        self._shadow.was_read(tree, value, command)
+
+    def _write_param(self, param, tree, value):
+        """Format and send a new value for *param*, unless the shadow shows that the instrument already has it.
+
+        Only parameters that can be read as well as set are shadowed, so write only commands that trigger an
+        action are always sent.
+        """
+        command = param.format_write(tree, value)
+        shadow = self._shadow
+        if shadow is None or param._decode is None or param._write is None or param._array:
+            self._send_command(command)
+        elif not shadow.unchanged(tree, command):
+            self._send_command(command)
+            shadow.wrote(tree, command)
+
+    def _send_command(self, command):
+        """Send a command that has no reply - or queue it if we are in a :py:meth:`batch`."""
+        if self._batch is None:
+            self.write(command)
+        else:
+            self._batch.append(command)
+
+    def _query_command(self, query, raw=False):
+        """Send a query and return the reply, sending any batched commands first so that the order is kept.
+
+        Keyword Arguments:
+            raw (bool): Return the reply as bytes with :py:meth:`trans_raw` rather than a string.
+        """
+        if self._batch:
+            self._flush_batch()
+        if raw:
+            return self.trans_raw(query)
+        return self.trans(query)
+
+    def query_many(self, names, max_length=None):
+        """Read several parameters with one compound query.
+
+        Args:
+            names (iterable of str): The commands to read, e.g. ``["SOUR:DELT:HIGH", "SOUR:DELT:LOW", "TRAC:POIN"]``,
+                using the same partial matching as attribute access.
+
+        Keyword Arguments:
+            max_length (int or None): The longest query message to send (default :py:attr:`max_message_length`) -
+                longer lists are split over several transactions.
+
+        Returns:
+            (OrderedDict): The converted values, keyed by the names as given.
+
+        Raises:
+            CommandError: if a name is not a readable command or the reply doesn't have one value per query.
+
+        The queries are sent as ``:A?;:B?;:C?`` and the reply is split on the semicolons, with each part converted by
+        the matching :py:class:`Param`. Array parameters are read on their own if a binary data format is in use.
+        Values that the shadow (if kept) can answer are not queried.
+        """
+        if max_length is None:
+            max_length = self.max_message_length
+        queries = []
+        results = OrderedDict()
+        shadow = self._shadow
+        for name in names:
+            cmd_dict, tree, full_path = self._get_path(name)
+            if not isinstance(cmd_dict, Param) or cmd_dict._decode is None:
+                raise CommandError("{} is not a readable SCPI command".format(tree))
+            if cmd_dict._array and self._block_dtype is not None:
+                results[name] = cmd_dict.do_read(tree, self)
+                continue
+            if shadow is not None and not cmd_dict._array:
+                value = shadow.value(tree)
+                if value is not missing:
+                    results[name] = value
+                    continue
+            queries.append((name, cmd_dict, ":{}?".format(tree), tree))
+            results[name] = None  # Keep the order the names were given in
+        message, group = "", []
+        for entry in queries + [None]:
+            if entry is not None and (not message or len(message) + len(entry[2]) + 1 <= max_length):
+                message = message + ";" + entry[2] if message else entry[2]
+                group.append(entry)
+                continue
+            if group:
+                replies = self._query_command(message).split(";")
+                if len(replies) != len(group):
+                    raise CommandError(
+                        "Expected {} replies to {} but got {}".format(
+                            len(group), message, len(replies)
+                        )
+                    )
+                for (name, param, query, tree), reply in zip(group, replies):
+                    results[name] = param.format_read(reply)
+                    if shadow is not None and not param._array:
+                        self._remember_read(param, tree, results[name])
+            if entry is not None:
+                message, group = entry[2], [entry]
+        return results
+
+    @contextmanager
+    def batch(self, max_length=None, check_errors=True):
+        """Collect the commands sent in a with block and send them as a few semicolon joined messages.
+
+        Keyword Arguments:
+            max_length (int or None): The longest message to send (default :py:attr:`max_message_length`).
+            check_errors (bool): Read the error queue once at the end and raise a CommandError if the instrument
+                reported any errors.
+
+        Commands are sent with their full path from the root (``:SOUR:DELT:HIGH 1e-06;:SOUR:DELT:LOW ...``) so
+        that they can be joined safely. Queries made in the block send the queued commands first. Nested batches
+        just join the outer batch. If the block raises an exception the queued commands are thrown away rather
+        than sending a half finished set of settings.
+        """
+        if self._batch is not None:  # Already batching
+            yield self
+            return
+        self._batch = []
+        try:
+            yield self
+            self._flush_batch(max_length)
+        except BaseException:
+            self.invalidate_shadow()  # The shadow already has the discarded settings, and some may have gone
+            raise
+        finally:
+            self._batch = None
+        if check_errors:
+            self.check_errors()
+
+    def _flush_batch(self, max_length=None):
+        """Send all the queued commands as a few long messages."""
+        if max_length is None:
+            max_length = self.max_message_length
+        queued, self._batch = self._batch, None  # So that our own writes go straight out
+        try:
+            message = ""
+            for command in queued:
+                for part in command.split("\n"):  # Array writes can be several commands
+                    part = part.strip()
+                    if not part:
+                        continue
+                    if part[0] not in "*:":
+                        part = ":" + part
+                    if message and len(message) + len(part) + 1 > max_length:
+                        self.write(message)
+                        message = ""
+                    message = message + ";" + part if message else part
+            if message:
+                self.write(message)
+        finally:
+            self._batch = []
+
+    def check_errors(self, limit=32):
+        """Read the instrument's error queue and raise a CommandError if there were any errors.
+
+        Keyword Arguments:
+            limit (int): Most entries to read from the queue.
+        """
+        errors = []
+        for _ in range(limit):
+            err = self._query_command("SYST:ERR?").strip()
+            if not err or err.split(",")[0].lstrip("+") in ("0", "-0"):
+                break
+            errors.append(err)
+        if errors:
+            self.invalidate_shadow()  # A rejected setting may be in the shadow
+            raise CommandError(
+                "{} reported errors: {}".format(type(self).__name__, "; ".join(errors))
+            )
+
+    def wait_event(
+        self, register, condition, timeout=None, check=None, min_poll=0.01, max_poll=1.0
+    ):
+        """Wait for a status register of the instrument to show that something has happened.
+
+        Args:
+            register (str or Command_Handle): The register to read, e.g. ``"STAT:MEAS:EVEN"``.
+            condition (int or callable): Either a mask, in which case we wait for any of its bits to be set, or a
+                function that is passed the register value and returns True when we are done.
+
+        Keyword Arguments:
+            timeout (float or None): Give up after this many seconds (default wait for ever).
+            check (callable or None): Called with every value read, before *condition* - raise an exception from
+                it to abandon the wait, e.g. when a compliance bit is set.
+            min_poll (float): The first interval between reads of the register, in seconds.
+            max_poll (float): The longest interval between reads, which the interval doubles up to.
+
+        Returns:
+            (int): The last value read from the register.
+
+        Raises:
+            TimeoutError: if *condition* isn't met within *timeout* seconds.
+
+        Between reads we block on the SRQ line if the transport supports it (see
+        :py:meth:`pyscpi.core.comms.InstrumentComms.wait_for_srq`), so if the instrument's status enable
+        registers and SRE are set up to request service for the event we wake as soon as it happens.
+        Otherwise we just sleep.
+        """
+        if not isinstance(register, Command_Handle):
+            register = self.handle(register)
+        if not callable(condition):
+            mask = int(condition)
+
+            def condition(value):
+                return value & mask
+
+        srq = getattr(self, "supports_srq", False)
+        deadline = None if timeout is None else time.time() + timeout
+        delay = min_poll
+        while True:
+            value = register.get()
+            if check is not None:
+                check(value)
+            if condition(value):
+                return value
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise TimeoutError(
+                        "{} did not meet the condition within {} s (last value {})".format(
+                            register.tree, timeout, value
+                        )
+                    )
+                delay = min(delay, remaining)
+            if srq:
+                self.wait_for_srq(delay)
+            else:
+                time.sleep(delay)
+            delay = min(delay * 2, max_poll)
+
+    def wait_opc(self, timeout=None):
+        """Block on *OPC? until the instrument has finished all pending operations.
+
+        Keyword Arguments:
+            timeout (float or None): Read timeout in seconds (default is the transport's timeout).
+
+        Returns:
+            (bool): True if the instrument reported that it had finished.
+        """
+        if self._batch:
+            self._flush_batch()
+        return int(self.trans("*OPC?", timeout=timeout)) == 1
+
+    @property
+    def data_format(self):
+        """The numpy dtype used for binary array transfers, or None if arrays are sent as ASCII."""
+        return self._block_dtype
+
+    def set_data_format(self, data_format="ASC", byte_order="SWAP"):
+        """Select how the instrument sends array data such as TRAC:DATA.
+
+        Keyword Arguments:
+            data_format (str): A FORM:DATA setting - ASCii, REAL,32, REAL,64, SREal or DREal.
+            byte_order (str): The FORM:BORD setting for binary formats - NORMal (big-endian) or SWAPped
+                (little-endian, which matches most PCs and so needs no conversion).
+
+        Binary formats are read back as IEEE 488.2 blocks with :py:meth:`trans_raw` and decoded straight into numpy
+        arrays. Set the format with this method rather than assigning form.data directly so that the driver
+        knows how to decode the data.
+        """
+        key = data_format.upper().replace(" ", "")
+        if key not in block_formats:
+            raise ValueError("Unknown data format {}".format(data_format))
+        code = block_formats[key]
+        if code is not None:
+            order = byte_order.upper()
+            if order not in byte_orders:
+                raise ValueError("Unknown byte order {}".format(byte_order))
+            self._send_command("FORM:BORD {}".format(order))
+            code = byte_orders[order] + code
+        self._send_command("FORM:DATA {}".format(key))
+        self._block_dtype = code
+        if self._shadow is not None:
+            self._shadow.invalidate("FORM")
 
     def reset(self):
         """*RST"""
-        self.write("*RST")
+        self._send_command("*RST")
+        self._block_dtype = None  # *RST puts the data format back to ASCII
+        self.invalidate_shadow()
 
     def clear(self):
         """*CLS"""
-        self.write("*CLS")
+        self._send_command("*CLS")
+        self.invalidate_shadow()
 
     def id_query(self):
         """Do a *IDN? and if self.id_pattern check if it matches."""
@@ -255,71 +1210,72 @@ class SCPI_Instrument_Mixin(object):
             return ret
 
 
-class _proxy(EpisMeasurementMixin):
+def merge_commands(tree, overrides):
+    """Return a new SCPI_Path_Dict of *tree* with the nested mapping *overrides* merged in.
 
-    """Proxy attribute access to build SCPI commands."""
+    Sub-trees of *overrides* are merged into the matching branches of *tree*, other values replace the existing
+    entry and None removes it. Untouched branches are shared with *tree*, which is not changed.
+    """
+    merged = SCPI_Path_Dict(tree)
+    for name, value in overrides.items():
+        if value is None:
+            if name in merged:
+                del merged[name]
+        elif isinstance(value, Mapping) and isinstance(merged.get(name), Mapping):
+            merged[name] = merge_commands(merged[name], value)
+        else:
+            merged[name] = value
+    return merged
+
+
+class _proxy(object):
 
-    def __init__(self, instr=None, path=""):
-        """Make sure I know what instrument I am and what my root is"""
+    """Proxy attribute access to build SCPI commands.
+
+    There is one of these for each branch of an instrument's command tree (see
+    :py:meth:`SCPI_Instrument_Mixin._proxy_for`). Attribute names are resolved through the instrument's
+    :py:attr:`SCPI_Instrument_Mixin.path_cache`, so walking a familiar path is a cache hit at each level.
+    """
+
+    __slots__ = ("_instr", "_node", "_path")
+
+    def __init__(self, instr=None, node=None, path=""):
+        """Make sure I know what instrument I am, what my branch of the tree is and what my root is"""
         self._instr = instr
+        self._node = node
         self._path = path
 
     def _get_path(self, name):
         """Locate the current path in the command dictionary."""
-        full_path = path.join(self._path, name)
-        tree = full_path.replace(path.sep, ":")
-        cmd_dict = self._instr._commands
-        canonical = []
-        for part in tree.split(":"):
-            if part not in cmd_dict:
-                raise AttributeError(
-                    "{} not recognised by driver as a SCPI command!".format(tree)
-                )
-            else:
-                part = cmd_dict.canonical(part)
-                canonical.append(part)
-                cmd_dict = cmd_dict[part]
-                if isinstance(cmd_dict, Mapping):
-                    cmd_dict = SCPI_Path_Dict(cmd_dict)
-        tree = ":".join(canonical)
-        if part == "_":
-            tree = ":".join(tree.split(":")[:-1])
-        tree = tree.strip(":")
-        return cmd_dict, tree, full_path
+        return self._instr._get_path("{}:{}".format(self._path, name))
+
+    def aget(self, name):
+        """Awaitable read of *name* below this branch, e.g. ``await k6221.stat.meas.aget("even")``."""
+        return self._instr.aget("{}:{}".format(self._path, name))
+
+    def aset(self, name, value):
+        """Awaitable setting of *name* below this branch, e.g. ``await k6221.sour.delt.aset("high", 1e-6)``."""
+        return self._instr.aset("{}:{}".format(self._path, name), value)
 
     def __getattr__(self, name):
         """See if we need to construct as sub-path or whether we have a terminal attribute."""
-        try:
-            return super(_proxy, self).__getattr__(name)
-        except AttributeError:
-            pass
-        cmd_dict, tree, full_path = self._get_path(name)
-        if isinstance(
-            cmd_dict, Mapping
-        ):  # Sub path returned so we're constructing an instance of ourselves from here.
-            return _proxy(instr=self._instr, path=full_path)
-        if not isinstance(cmd_dict, Param):
-            raise CommandError("Unrecognised command {}".format(tree))
-        return cmd_dict.do_read(tree, self._instr)
+        if name.startswith("_") and name != "_":
+            raise AttributeError("_proxy has no attribute {}".format(name))
+        entry = self._instr._child(self._path, name)
+        if entry.__class__ is _proxy:
+            return entry
+        return self._instr._read_param(entry[0], entry[1])
 
     def __setattr__(self, name, value):
         """Set a SCIPI Command."""
-        if name in ["commands","debug"] or (name.startswith("_") and name != "_"):
+        if name.startswith("_") and name != "_":
             super(_proxy, self).__setattr__(name, value)
             return None
-        try:
-            val = super(_proxy, self).__getattr__(name)
-            super(_proxy, self).__setattr__(name, value)
-            return None
-        except AttributeError:
-            pass
-        name = name.upper()
-        cmd_dict, tree, full_path = self._get_path(name)
-        if not isinstance(cmd_dict, Param):
+        entry = self._instr._child(self._path, name)
+        if entry.__class__ is _proxy:
             raise CommandError(
                 "Non terminal SCPI command path {} trying to be set a value of {}!".format(
-                    tree, value
+                    entry._path, value
                 )
             )
-        self._instr.write(cmd_dict.format_write(tree, value))
-
+        self._instr._write_param(entry[0], entry[1], value)
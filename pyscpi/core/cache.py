@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Caches used to avoid repeating work on the hot paths of the SCPI drivers.
+
+@author: phygbu
+"""
+__all__ = ["LRU_Cache", "Shadow_State"]
+
+import time
+from collections import OrderedDict
+
+missing = object()  # Marks a shadow entry whose value hasn't been read back
+
+
+class LRU_Cache(object):
+
+    """A small bounded mapping that evicts the least recently used entry when full.
+
+    Used by :py:class:`pyscpi.core.base.SCPI_Instrument_Mixin` to remember how attribute paths resolve into the
+    command tree. The hits and misses counters are kept so that the effectiveness of the cache can be checked on
+    a running system with :py:meth:`cache_info`.
+
+    Keyword Arguments:
+        maxsize (int): Maximum number of entries to keep (default 256).
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = int(maxsize)
+        self.hits = 0
+        self.misses = 0
+        self._store = OrderedDict()
+
+    def __len__(self):
+        return len(self._store)
+
+    def __contains__(self, key):
+        return key in self._store
+
+    def get(self, key, default=None):
+        """Return the entry for *key*, marking it as recently used, or *default* if not present."""
+        try:
+            value = self._store[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._store.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Store *value* under *key*, evicting the oldest entry if we are full."""
+        store = self._store
+        store[key] = value
+        store.move_to_end(key)
+        if len(store) > self.maxsize:
+            store.popitem(last=False)
+
+    def clear(self):
+        """Forget all entries (but not the hit and miss counts)."""
+        self._store.clear()
+
+    def cache_info(self):
+        """Return a dictionary of the hits, misses, current size and maximum size of the cache."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._store),
+            "maxsize": self.maxsize,
+        }
+
+
+class Shadow_State(object):
+
+    """A record of the last value written to, or read from, each setting of an instrument.
+
+    Used by :py:class:`pyscpi.core.base.SCPI_Instrument_Mixin` when it is created with ``shadow=True``. Each entry
+    is keyed by the canonical SCPI command and holds the last formatted set command, the last value read (if it
+    hasn't been written since) and when that happened. The instrument uses this to skip sending a setting that
+    hasn't changed and to answer queries of commands listed in *ttl* without asking the instrument.
+
+    Keyword Arguments:
+        ttl (dict): Maps canonical commands to how many seconds a value read back can be reused for, or None to
+            keep it until the shadow is invalidated. Commands not listed are always queried.
+        clock (callable): Returns the current time in seconds (default :py:func:`time.monotonic`).
+
+    Anything that changes the instrument behind the driver's back - a front panel change, a *RST or commands sent
+    with write() directly - makes the shadow stale, so call :py:meth:`invalidate` when that happens.
+    """
+
+    def __init__(self, ttl=None, clock=time.monotonic):
+        self.ttl = dict(ttl or {})
+        self.clock = clock
+        self.suppressed = 0
+        self.served = 0
+        self._store = {}  # tree -> [command, value, time]
+
+    def __len__(self):
+        return len(self._store)
+
+    def __contains__(self, tree):
+        return tree in self._store
+
+    def unchanged(self, tree, command):
+        """Return True (and count a suppressed write) if *command* was the last thing sent for or read from *tree*."""
+        entry = self._store.get(tree)
+        if entry is not None and entry[0] == command:
+            self.suppressed += 1
+            return True
+        return False
+
+    def wrote(self, tree, command):
+        """Record that *command* has been sent to set *tree*."""
+        self._store[tree] = [command, missing, self.clock()]
+
+    def was_read(self, tree, value, command=None):
+        """Record the *value* read back from *tree* and the *command* that would set it to that value."""
+        self._store[tree] = [command, value, self.clock()]
+
+    def value(self, tree, default=missing):
+        """Return the remembered value of *tree* if its ttl allows, otherwise *default*."""
+        try:
+            ttl = self.ttl[tree]
+            command, value, when = self._store[tree]
+        except KeyError:
+            return default
+        if value is missing or (ttl is not None and self.clock() - when > ttl):
+            return default
+        self.served += 1
+        return value
+
+    def invalidate(self, tree=None):
+        """Forget *tree* and everything below it, or everything if *tree* is None."""
+        if tree is None:
+            self._store.clear()
+            return
+        prefix = tree + ":"
+        for key in [k for k in self._store if k == tree or k.startswith(prefix)]:
+            del self._store[key]
+
+    def cache_info(self):
+        """Return a dictionary of the suppressed writes, cached reads served and current size of the shadow."""
+        return {
+            "suppressed": self.suppressed,
+            "served": self.served,
+            "size": len(self._store),
+        }
@@ -10,19 +10,48 @@ Created on Thu Aug 29 22:28:36 2019
 """
 from __future__ import print_function
 
-__all__ = ["GPIBInstrument", "TelnetInstrument"]
+__all__ = ["GPIBInstrument", "SocketInstrument", "TelnetInstrument", "transport_lock"]
+import socket
 import sys
+import threading
 import time
+import weakref
+from contextlib import contextmanager
 
 
 _global_rm = None  # Store a global via resource manager
+_transport_locks = weakref.WeakKeyDictionary()
+_transport_locks_guard = threading.Lock()
 
 if sys.version_info[0] == 3:
     raw_input = input  # Hack to set up raw_input correctly
 
 
+def load_visa():
+    """Import the VISA library on first use.
+
+    Returns pyvisa, or the older visa module name if that is all that is installed.
+    """
+    try:
+        import pyvisa as visa
+    except ImportError:
+        import visa
+    return visa
+
+
+def visa_errors():
+    """Return a tuple of the VISA I/O exception classes for use in except clauses.
+
+    If VISA isn't installed then nothing can raise its errors, so an empty tuple is returned.
+    """
+    try:
+        return (load_visa().VisaIOError,)
+    except ImportError:
+        return ()
+
+
 def initResourceManager():
-    import visa
+    visa = load_visa()
 
     rm = visa.ResourceManager()
     return rm
@@ -39,17 +68,157 @@ def initGPIBInstrument(rm, resource):
     return instr
 
 
+def transport_lock(comms):
+    """Return the lock held while an operation is run on *comms* for an InstrumentGroup or asyncio code.
+
+    The lock belongs to the transport that carries the traffic (see :py:attr:`InstrumentComms.transport`), so
+    drivers that share a connection, such as a K2182A talking through a K6221, share one lock.
+    """
+    transport = comms.transport
+    with _transport_locks_guard:
+        lock = _transport_locks.get(transport)
+        if lock is None:
+            lock = _transport_locks[transport] = threading.Lock()
+        return lock
+
+
 class InstrumentComms(object):
 
     """Abstract base class for Instrument communications.
 
-    This just defines the interface routines that all communications layers should support."""
+    This just defines the interface routines that all communications layers should support.
+
+    Keyword Arguments:
+        wait(float): Delay used by :py:meth:`wait`, and before each read if *blocking* is False
+        debug(bool): Turn on debugging information
+        slow(float): Multiplier for wait to make everything really slow down
+        timeout(float): Default time in seconds to wait for a reply before giving up
+        blocking(bool): If True (default) reads return as soon as the reply is complete and only sleep when a
+            *wait* is explicitly given. If False, sleep for *wait* before every read as older versions did.
+        idle_timeout(float or None): If set, a request to close the connection is deferred until it has been
+            idle for this many seconds, so that a burst of commands shares one connection.
+        metrics(pyscpi.core.metrics.Metrics or None): Record timings and traffic per command (see
+            :py:meth:`set_metrics`).
+
+    Every operation takes a *close* argument that asks for the connection to be closed afterwards. Inside a
+    :py:meth:`session` these requests are ignored, so that any number of operations share one connection, which
+    is then closed (or left to time out if *idle_timeout* is set) when the last session ends.
+    """
 
     def __init__(self,*args, **kargs):
 
         self._wait = kargs.pop("wait", 0.5)
         self.debug = kargs.pop("debug", False)
         self.slow = kargs.pop("slow", 0.0)
+        self.timeout = kargs.pop("timeout", 10.0)
+        self.blocking = kargs.pop("blocking", True)
+        self.idle_timeout = kargs.pop("idle_timeout", None)
+        self._sessions = 0
+        self._in_use = 0  # Number of operations in progress
+        self._session_lock = threading.Lock()
+        self._idle_timer = None
+        self._last_used = time.time()
+        self.metrics = None
+        self._metric_path = None  # SCPI path of the last command, that replies are counted against
+        self.set_metrics(kargs.pop("metrics", None))
+
+    def set_metrics(self, metrics):
+        """Start recording per command statistics into *metrics*, or stop if it is None.
+
+        The recording wraps this instance's write, read, read_raw and wait methods, so there is no cost at all when
+        metrics aren't being kept.
+        """
+        if self.metrics is not None:
+            self.metrics.detach(self)
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.attach(self)
+
+    @contextmanager
+    def session(self):
+        """Keep the connection open for the duration of a with block.
+
+        Sessions can be nested and shared between threads - the connection is only released when the last one
+        ends.
+        """
+        with self._session_lock:
+            self._sessions += 1
+        try:
+            yield self
+        finally:
+            with self._session_lock:
+                self._sessions -= 1
+            self._close_if_idle(True)
+
+    @property
+    def transport(self):
+        """The comms object whose connection our traffic goes over - ourself unless we talk through another."""
+        return self
+
+    @property
+    def in_session(self):
+        """True if a :py:meth:`session` is currently keeping the connection open."""
+        return self._sessions > 0
+
+    @property
+    def in_use(self):
+        """True while an operation is talking to the instrument."""
+        return self._in_use > 0
+
+    def _acquire(self):
+        """Called at the start of each operation, so that the connection isn't closed under it."""
+        with self._session_lock:
+            self._in_use += 1
+
+    def _release(self, close=True):
+        """Called at the end of each operation (after :py:meth:`_acquire`) to close the connection if asked to."""
+        with self._session_lock:
+            if self._in_use > 0:
+                self._in_use -= 1
+        self._close_if_idle(close)
+
+    def _close_if_idle(self, close=True):
+        """Close the connection if that was asked for and nothing is using it.
+
+        Does nothing inside a session or while another operation is in progress, and with an *idle_timeout* just
+        (re)starts the idle timer.
+        """
+        with self._session_lock:
+            self._last_used = time.time()
+            if not close or self._sessions or self._in_use:
+                return
+            if self.idle_timeout:
+                if self._idle_timer is None:
+                    self._idle_timer = threading.Timer(self.idle_timeout, self._idle_close)
+                    self._idle_timer.daemon = True
+                    self._idle_timer.start()
+                return
+            self.close()
+
+    def _idle_close(self):
+        """Close the connection from the idle timer if nothing has used it since.
+
+        The lock is held while closing, so no operation can start on the connection until it is done. If a session
+        or an operation is in progress nothing happens, and the timer is started again when they finish.
+        """
+        with self._session_lock:
+            self._idle_timer = None
+            if self._sessions or self._in_use:
+                return
+            idle = time.time() - self._last_used
+            if idle < self.idle_timeout:  # Used since the timer started, so wait some more
+                self._idle_timer = threading.Timer(
+                    self.idle_timeout - idle, self._idle_close
+                )
+                self._idle_timer.daemon = True
+                self._idle_timer.start()
+                return
+            self.close()
+
+    def _pre_read(self, wait=None):
+        """Sleep before a read if asked to, or if we are not in blocking mode."""
+        if wait is not None or self.slow or not self.blocking:
+            self.wait(wait)
 
     def close(self):
         """Close our connection."""
@@ -57,18 +226,87 @@ class InstrumentComms(object):
             "Communications drivers need to specify a close method"
         )
 
-    def read(self, close=True):
-        """Read a string back from the iinstrument."""
+    def read(self, close=True, wait=None, timeout=None):
+        """Read a string back from the iinstrument.
+
+        Keyword Arguments:
+            close (bool): Close the connection afterwards.
+            wait (float or None): Sleep for this long before reading - for commands that are known to be slow.
+            timeout (float or None): Override the default timeout for this read.
+        """
         raise NotImplementedError(
             "Communications drivers need to specify a read method"
         )
 
-    def trans(self, command, close=True):
+    def read_raw(self, close=True, wait=None, timeout=None):
+        """Read a binary response back from the instrument as bytes."""
+        raise NotImplementedError(
+            "Communications drivers need to specify a read_raw method for binary transfers"
+        )
+
+    def trans(self, command, close=True, wait=None, timeout=None):
         """Do a Write-Read transaction"""
         raise NotImplementedError(
             "Communications drivers need to specify a trans(action) method"
         )
 
+    def trans_raw(self, command, close=True, wait=None, timeout=None):
+        """Do a Write-Read transaction returning the raw bytes of the response."""
+        self.write(command, close=False)
+        return self.read_raw(close=close, wait=wait, timeout=timeout)
+
+    # Awaitable versions of the operations for asyncio code, taking the same arguments. These run the blocking
+    # methods in the event loop's executor, holding the transport_lock() - transports that can do better override
+    # them with coroutines (see pyscpi.core.aio, which is only imported when they are first used).
+
+    def awrite(self, command, close=True):
+        """Awaitable :py:meth:`write`."""
+        from .aio import run_blocking
+
+        return run_blocking(self, "write", command, close=close)
+
+    def aread(self, close=True, wait=None, timeout=None):
+        """Awaitable :py:meth:`read`."""
+        from .aio import run_blocking
+
+        return run_blocking(self, "read", close=close, wait=wait, timeout=timeout)
+
+    def aread_raw(self, close=True, wait=None, timeout=None):
+        """Awaitable :py:meth:`read_raw`."""
+        from .aio import run_blocking
+
+        return run_blocking(self, "read_raw", close=close, wait=wait, timeout=timeout)
+
+    def atrans(self, command, close=True, wait=None, timeout=None):
+        """Awaitable :py:meth:`trans`."""
+        from .aio import run_blocking
+
+        return run_blocking(self, "trans", command, close=close, wait=wait, timeout=timeout)
+
+    def atrans_raw(self, command, close=True, wait=None, timeout=None):
+        """Awaitable :py:meth:`trans_raw`."""
+        from .aio import run_blocking
+
+        return run_blocking(self, "trans_raw", command, close=close, wait=wait, timeout=timeout)
+
+    @property
+    def supports_srq(self):
+        """True if :py:meth:`wait_for_srq` can wait for a service request from the instrument."""
+        return False
+
+    def wait_for_srq(self, timeout=None):
+        """Block until the instrument requests service.
+
+        Keyword Arguments:
+            timeout (float or None): Longest time to wait in seconds, or None to wait forever.
+
+        Returns:
+            (bool): True if the instrument asserted SRQ, False if we timed out.
+        """
+        raise NotImplementedError(
+            "{} can't wait for service requests".format(type(self).__name__)
+        )
+
     def wait(self, wait=None):
         """Wait for a delay period.
 
@@ -93,18 +331,23 @@ class InstrumentComms(object):
 
 class GPIBInstrument(InstrumentComms):
 
-    """Wrapper around visa for GPIB instrument."""
+    """Wrapper around visa for GPIB instrument.
+
+    Passing *instr* as None doesn't open a VISA resource at all, for subclasses that are sometimes reached by
+    another route.
+    """
 
     def __init__(self, rm=None, instr='GPIB0::11::INSTR', **kargs):
-        if rm is None:
+        if rm is None and instr is not None:
             global _global_rm
             if _global_rm is None:
                 _global_rm = initResourceManager()
             rm = _global_rm
 
-        self._instr = initGPIBInstrument(rm, instr)
+        self._instr = initGPIBInstrument(rm, instr) if instr is not None else None
         self.ip = instr
         self.port = ""
+        self._visa_timeout = None  # The timeout last set on the VISA resource
 
         super(GPIBInstrument, self).__init__(**kargs)
 
@@ -114,37 +357,83 @@ class GPIBInstrument(InstrumentComms):
 
     def write(self, command, close=True):
         """Send a string to the instrument via network port."""
-        if self.debug:
-            print("DEBUG {}:{} Write :{}".format(self.ip, self.port, command))
-        else:
+        self._acquire()
+        try:
+            if self.debug:
+                print("DEBUG {}:{} Write :{}".format(self.ip, self.port, command))
+            else:
+                if self.slow:
+                    self.wait()
+            command = command.strip()
+            self._instr.write(command)
             if self.slow:
                 self.wait()
-        command = command.strip()
-        self._instr.write(command)
-        if self.slow:
-            self.wait()
-        if close:
-            self.close()
+        finally:
+            self._release(close)
+
+    def _set_timeout(self, timeout=None):
+        """Set the VISA timeout for the next read, if it has changed."""
+        if timeout is None:
+            timeout = self.timeout
+        if timeout != self._visa_timeout:
+            self._instr.timeout = None if timeout is None else int(timeout * 1000)
+            self._visa_timeout = timeout
+
+    def read(self, close=True, wait=None, timeout=None):
+        """Read a string back from the iinstrument.
+
+        In blocking mode VISA returns as soon as the instrument asserts END or sends the termination character, so
+        there is no fixed delay unless *wait* is given.
+        """
+        self._acquire()
+        try:
+            self._set_timeout(timeout)
+            buf = ""
+            while True:
+                self._pre_read(wait)
+                buf += self._instr.read()
+                if self.blocking or (len(buf) > 0 and buf[-1] == "\n"):
+                    break
+            if self.debug:
+                print("DEBUG {}:{} Read :{}".format(self.ip, self.port, buf))
+            buf = buf.strip()
+        finally:
+            self._release(close)
+        return buf
 
-    def read(self, close=True):
-        """Read a string back from the iinstrument."""
-        buf = ""
-        while True:
-            self.wait()
-            buf += self._instr.read()
-            if len(buf) > 0 and buf[-1] == "\n":
-                break
-        if self.debug:
-            print("DEBUG {}:{} Read :{}".format(self.ip, self.port, buf))
-        buf = buf.strip()
-        if close:
-            self.close()
+    def read_raw(self, close=True, wait=None, timeout=None):
+        """Read a binary response back from the instrument as bytes."""
+        self._acquire()
+        try:
+            self._set_timeout(timeout)
+            self._pre_read(wait)
+            buf = self._instr.read_raw()
+            if self.debug:
+                print("DEBUG {}:{} Read {} bytes".format(self.ip, self.port, len(buf)))
+        finally:
+            self._release(close)
         return buf
 
-    def trans(self, command, close=True):
+    def trans(self, command, close=True, wait=None, timeout=None):
         """Do a Write-Read transaction"""
         self.write(command, close=False)
-        return self.read(close=close)
+        return self.read(close=close, wait=wait, timeout=timeout)
+
+    @property
+    def supports_srq(self):
+        """VISA GPIB resources can wait on the SRQ line."""
+        return self._instr is not None and hasattr(self._instr, "wait_for_srq")
+
+    def wait_for_srq(self, timeout=None):
+        """Block until the instrument asserts SRQ, returning False if *timeout* seconds pass first."""
+        self._acquire()
+        try:
+            self._instr.wait_for_srq(None if timeout is None else max(int(timeout * 1000), 1))
+        except visa_errors() + (TimeoutError,):
+            return False
+        finally:
+            self._release(False)
+        return True
 
     def close(self):
         """Close our connection."""
@@ -153,6 +442,212 @@ class GPIBInstrument(InstrumentComms):
         # self._connection=None #Fake close
 
 
+class SocketInstrument(InstrumentComms):
+
+    """Raw socket SCPI over a LAN (the "port 5025" style of interface).
+
+    The TCP connection is opened on first use and then kept open, with Nagle's algorithm turned off so that
+    short commands go out immediately. Replies are read with a buffered read up to the terminator, so each read
+    returns as soon as the reply is complete. If the connection has dropped it is re-opened and the command is
+    sent again transparently - for a connection that the instrument closed while it was idle this only shows up
+    when the reply is read, so :py:meth:`trans` and :py:meth:`trans_raw` send the command again in that case too.
+    """
+
+    def __init__(self, ip="127.0.0.1", port=5025, **kargs):
+        """Setup a raw socket connection to an instrument.
+
+        Args:
+            ip (str): IP address or host name
+            port (int): TCPIP port
+
+        Keyword Arguments:
+            terminator (str): Line terminator for commands and replies (default "\\n")
+            connect_timeout (float): Time to wait for the connection to be made
+            persistent (bool): Keep the connection open even when a caller asks for it to be closed (default True)
+            retries (int): Number of times to re-connect and resend a command if the connection has dropped
+
+        See :py:class:`InstrumentComms` for the other keyword arguments. This will set the ip and port instance
+        variables."""
+        self.ip = ip
+        self.port = int(port)
+        self.terminator = kargs.pop("terminator", "\n").encode("ascii")
+        self.connect_timeout = kargs.pop("connect_timeout", 5.0)
+        self.persistent = kargs.pop("persistent", True)
+        self.retries = kargs.pop("retries", 1)
+        self._connection = None
+        self._buffer = bytearray()
+        self._sock_timeout = None
+        super(SocketInstrument, self).__init__(**kargs)
+
+    def __del__(self):
+        """Make sure we close our socket."""
+        self.close()
+
+    @property
+    def connection(self):
+        """Maintain a connection to the IP/port"""
+        if self._connection is None:
+            conn = socket.create_connection(
+                (self.ip, self.port), timeout=self.connect_timeout
+            )
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._connection = conn
+            self._sock_timeout = None
+            del self._buffer[:]
+        return self._connection
+
+    def _set_timeout(self, timeout=None):
+        """Set the socket timeout for the next read, if it has changed."""
+        if timeout is None:
+            timeout = self.timeout
+        conn = self.connection
+        if timeout != self._sock_timeout:
+            conn.settimeout(timeout)
+            self._sock_timeout = timeout
+        return conn
+
+    def _close_if_idle(self, close=True):
+        """Ignore requests to close the connection if we are persistent."""
+        if self.persistent:
+            self._last_used = time.time()
+            return
+        super(SocketInstrument, self)._close_if_idle(close)
+
+    def write(self, command, close=True):
+        """Send a string to the instrument via network port."""
+        self._acquire()
+        try:
+            if self.debug:
+                print("DEBUG {}:{} Write :{}".format(self.ip, self.port, command))
+            elif self.slow:
+                self.wait()
+            data = command.strip().encode("ascii") + self.terminator
+            for attempt in range(self.retries + 1):
+                try:
+                    self.connection.sendall(data)
+                    break
+                except (OSError, IOError):
+                    self.close()
+                    if attempt == self.retries:
+                        raise
+            if self.slow:
+                self.wait()
+        finally:
+            self._release(close)
+
+    def _fill(self, conn):
+        """Receive more data into the buffer, raising an error if the connection has closed."""
+        chunk = conn.recv(65536)
+        if not chunk:
+            self.close()
+            raise ConnectionError(
+                "Connection to {}:{} closed by the instrument".format(self.ip, self.port)
+            )
+        self._buffer += chunk
+
+    def _readline(self, conn):
+        """Return the bytes up to the next terminator, removing them and the terminator from the buffer."""
+        buf = self._buffer
+        term = self.terminator
+        start = 0
+        while True:
+            ix = buf.find(term, start)
+            if ix >= 0:
+                line = bytes(buf[:ix])
+                del buf[: ix + len(term)]
+                return line
+            start = max(len(buf) - len(term) + 1, 0)
+            self._fill(conn)
+
+    def read(self, close=True, wait=None, timeout=None):
+        """Read a string back from the iinstrument."""
+        self._acquire()
+        try:
+            self._pre_read(wait)
+            try:
+                line = self._readline(self._set_timeout(timeout))
+            except socket.timeout:
+                self.close()  # Any late reply would be out of step with the next command
+                raise
+            buf = line.decode("ascii", "replace").strip()
+            if self.debug:
+                print("DEBUG {}:{} Read :{}".format(self.ip, self.port, buf))
+        finally:
+            self._release(close)
+        return buf
+
+    def read_raw(self, close=True, wait=None, timeout=None):
+        """Read a binary response, using the length in an IEEE 488.2 block header to know when it is complete."""
+        self._acquire()
+        try:
+            self._pre_read(wait)
+            try:
+                conn = self._set_timeout(timeout)
+                buf = self._buffer
+                if not buf:
+                    self._fill(conn)
+                while buf[:1] == b"#" and len(buf) < 2:
+                    self._fill(conn)
+                if buf[:1] != b"#" or buf[1:2] == b"0":  # Not a definite length block, so read to the terminator
+                    data = self._readline(conn)
+                else:
+                    digits = int(buf[1:2])
+                    while len(buf) < 2 + digits:
+                        self._fill(conn)
+                    size = 2 + digits + int(bytes(buf[2 : 2 + digits]))
+                    while len(buf) < size + len(self.terminator):
+                        self._fill(conn)
+                    data = bytes(buf[:size])
+                    del buf[: size + len(self.terminator)]
+            except socket.timeout:
+                self.close()
+                raise
+            if self.debug:
+                print("DEBUG {}:{} Read {} bytes".format(self.ip, self.port, len(data)))
+        finally:
+            self._release(close)
+        return data
+
+    def _transact(self, read, command, close, wait, timeout):
+        """Write *command* and return the reply from *read*, retrying on a new connection if the old one had gone.
+
+        Writing to a socket that the instrument has closed still succeeds, so a dropped connection is only seen
+        when the read finds the end of the stream or a reset. Only a connection that was already open is retried -
+        a new one failing is a real error, as are timeouts, when the instrument may have acted on the command.
+        """
+        self._acquire()
+        try:
+            for attempt in range(self.retries + 1):
+                reused = self._connection is not None
+                self.write(command, close=False)
+                try:
+                    return read(close=False, wait=wait, timeout=timeout)
+                except ConnectionError:
+                    self.close()
+                    if not reused or attempt == self.retries:
+                        raise
+        finally:
+            self._release(close)
+
+    def trans(self, command, close=True, wait=None, timeout=None):
+        """Do a Write-Read transaction"""
+        return self._transact(self.read, command, close, wait, timeout)
+
+    def trans_raw(self, command, close=True, wait=None, timeout=None):
+        """Do a Write-Read transaction returning the raw bytes of the response."""
+        return self._transact(self.read_raw, command, close, wait, timeout)
+
+    def close(self):
+        """Close our connection."""
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except (OSError, IOError):
+                pass
+        self._connection = None
+        del self._buffer[:]
+
+
 class TelnetInstrument(InstrumentComms):
     def __init__(self, ip="129.129.113.82", port=1394, **kargs):
         """Open a TCPIP connection to an instrument.
@@ -166,13 +661,12 @@ class TelnetInstrument(InstrumentComms):
             debug(bool): Turn on debugging information
             slow(float): Multiplier for wait to make everything really slow down
 
-        This will set the ip and port instance variables."""
+        This will set the ip and port instance variables. :py:class:`SocketInstrument` is a better choice for
+        instruments that offer a raw socket port."""
         self.ip = ip
         self.port = int(port)
         self._connection = None
-        self._wait = kargs.pop("wait", 0.5)
-        self.debug = kargs.pop("debug", False)
-        self.slow = kargs.pop("slow", 0.0)
+        super(TelnetInstrument, self).__init__(**kargs)
 
     def __del__(self):
         """Make sure we close our telent connection."""
@@ -182,48 +676,81 @@ class TelnetInstrument(InstrumentComms):
     def connection(self):
         """Maintain a connection to the IP/port"""
         if self._connection is None:
+            import telnetlib
+
             self._connection = telnetlib.Telnet(self.ip, self.port)
         return self._connection
 
     def write(self, command, close=True):
         """Send a string to the instrument via network port."""
-        if self.debug:
-            print("DEBUG {}:{} Write :{}".format(self.ip, self.port, command))
-        else:
+        self._acquire()
+        try:
+            if self.debug:
+                print("DEBUG {}:{} Write :{}".format(self.ip, self.port, command))
+            else:
+                if self.slow:
+                    self.wait()
+            if command[-1] != "\n":
+                command += "\n"
+            self.connection.write(command.encode("ascii"))
             if self.slow:
                 self.wait()
-        if command[-1] != "\n":
-            command += "\n"
-        self.connection.write(command)
-        if self.slow:
-            self.wait()
-        if close:
-            self.close()
+        finally:
+            self._release(close)
 
-    def read(self, close=True):
-        """Read a string back from the iinstrument."""
-        buf = ""
+    def read(self, close=True, wait=None, timeout=None):
+        """Read a string back from the iinstrument, blocking until the terminator arrives."""
+        self._acquire()
         try:
-            while True:
-                self.wait()
-                buf += self.connection.read_eager()
-                if len(buf) > 0 and buf[-1] == "\n":
-                    break
-            if self.debug:
-                print("DEBUG {}:{} Read :{}".format(self.ip, self.port, buf))
-        except visa.VisaIOError as err:
-            if self.debug:
-                print("DEBUG: VISA IO Error! {}".format(err))
-            raise err
-        buf = buf.strip()
-        if close:
-            self.close()
+            self._pre_read(wait)
+            if timeout is None:
+                timeout = self.timeout
+            try:
+                buf = self.connection.read_until(b"\n", timeout)
+                if not buf.endswith(b"\n"):
+                    raise socket.timeout(
+                        "No reply from {}:{} within {}s".format(self.ip, self.port, timeout)
+                    )
+                buf = buf.decode("ascii", "replace")
+                if self.debug:
+                    print("DEBUG {}:{} Read :{}".format(self.ip, self.port, buf))
+            except (EOFError, OSError, IOError) as err:
+                if self.debug:
+                    print("DEBUG: Telnet IO Error! {}".format(err))
+                raise err
+            buf = buf.strip()
+        finally:
+            self._release(close)
         return buf
 
-    def trans(self, command, close=True):
+    def _transact(self, read, command, close, wait, timeout):
+        """Write *command* and return the reply from *read*, retrying on a new connection if the old one had gone.
+
+        Writing to a socket that the instrument has closed still succeeds, so a dropped connection is only seen
+        when the read finds the end of the stream or a reset. Only a connection that was already open is retried -
+        a new one failing is a real error, as are timeouts, when the instrument may have acted on the command.
+        """
+        self._acquire()
+        try:
+            for attempt in range(self.retries + 1):
+                reused = self._connection is not None
+                self.write(command, close=False)
+                try:
+                    return read(close=False, wait=wait, timeout=timeout)
+                except ConnectionError:
+                    self.close()
+                    if not reused or attempt == self.retries:
+                        raise
+        finally:
+            self._release(close)
+
+    def trans(self, command, close=True, wait=None, timeout=None):
         """Do a Write-Read transaction"""
-        self.write(command, close=False)
-        return self.read(close=close)
+        return self._transact(self.read, command, close, wait, timeout)
+
+    def trans_raw(self, command, close=True, wait=None, timeout=None):
+        """Do a Write-Read transaction returning the raw bytes of the response."""
+        return self._transact(self.read_raw, command, close, wait, timeout)
 
     def close(self):
         """Close our connection."""
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Send the same commands to several instruments at once.
+
+An :py:class:`InstrumentGroup` looks like a single instrument, but every setting and query goes to all of its
+members concurrently and queries return a list of the replies in member order::
+
+    k6221s = InstrumentGroup([K6221(instr="GPIB0::11::INSTR"), K6221(instr="GPIB0::12::INSTR")])
+    k6221s.sour.delt.high = 1e-6
+    data = k6221s.trac.data  # [station 1 data, station 2 data]
+    k6221s.call("set_data_format", "REAL,32")
+
+Each member is driven from a worker thread holding the :py:func:`pyscpi.core.comms.transport_lock` of its
+connection, which the asyncio operations (and so :py:meth:`InstrumentGroup.aget` and
+:py:meth:`InstrumentGroup.aset`) hold too. A member's transport therefore only ever sees one operation at a time
+from groups and coroutines, even if the member is also in other groups or shares its connection with another
+member, as a K2182A talking through a K6221 does. Configuring or reading out N instruments then takes about as
+long as the slowest of them rather than the sum.
+
+@author: phygbu
+"""
+__all__ = ["InstrumentGroup", "instrument_lock"]
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ..exceptions import CommandError
+from .base import Param
+from .comms import transport_lock
+
+
+def instrument_lock(instr):
+    """Return the lock that groups hold while they talk to *instr* - the :py:func:`transport_lock` of its connection."""
+    return transport_lock(instr)
+
+
+def _get(instr, name):
+    return instr.handle(name).get()
+
+
+def _set(instr, name, value):
+    instr.handle(name).set(value)
+
+
+def _call(instr, method, args, kargs):
+    return getattr(instr, method)(*args, **kargs)
+
+
+class _Group_Proxy(object):
+
+    """A branch of the command tree, shared by all the instruments in a group."""
+
+    __slots__ = ("_group", "_path")
+
+    def __init__(self, group, path):
+        self._group = group
+        self._path = path
+
+    def __repr__(self):
+        return "<InstrumentGroup branch {} of {} instruments>".format(self._path, len(self._group))
+
+    def __getattr__(self, name):
+        if name.startswith("_") and name != "_":
+            raise AttributeError("_Group_Proxy has no attribute {}".format(name))
+        return self._group._access("{}:{}".format(self._path, name))
+
+    def __setattr__(self, name, value):
+        if name.startswith("_") and name != "_":
+            super(_Group_Proxy, self).__setattr__(name, value)
+            return
+        self._group.set("{}:{}".format(self._path, name), value)
+
+
+class InstrumentGroup(object):
+
+    """Broadcast settings, queries and method calls to a list of instruments concurrently.
+
+    Args:
+        instruments (iterable of SCPI_Instrument_Mixin): The members, which should be the same kind of instrument.
+
+    Keyword Arguments:
+        max_workers (int or None): Most members to talk to at the same time (default all of them).
+
+    Attribute access works as for a single instrument - command paths are resolved against the first member's
+    command tree - with queries returning a list with one entry per member. Anything that isn't a SCPI command
+    (such as ``idn``) is looked up on each member instead. Use :py:meth:`call` for methods, and :py:meth:`map` to
+    run any function on every member.
+
+    If any member fails, the first exception (in member order) is raised once all the others have finished.
+    """
+
+    def __init__(self, instruments, max_workers=None):
+        instruments = list(instruments)
+        if not instruments:
+            raise ValueError("An InstrumentGroup needs at least one instrument")
+        self.__dict__["instruments"] = instruments
+        self.__dict__["max_workers"] = max_workers or len(instruments)
+        self.__dict__["_executor"] = None
+        self.__dict__["_executor_lock"] = threading.Lock()
+
+    def __repr__(self):
+        return "<InstrumentGroup of {}>".format(", ".join(repr(instr) for instr in self.instruments))
+
+    def __len__(self):
+        return len(self.instruments)
+
+    def __iter__(self):
+        return iter(self.instruments)
+
+    def __getitem__(self, index):
+        return self.instruments[index]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def executor(self):
+        """The thread pool that the members are driven from, started on first use."""
+        with self._executor_lock:
+            if self._executor is None:
+                self.__dict__["_executor"] = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="InstrumentGroup"
+                )
+            return self._executor
+
+    def close(self):
+        """Shut down the worker threads - they are started again if the group is used afterwards."""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self.__dict__["_executor"] = None
+
+    @staticmethod
+    def _locked(func, instr, args, kargs):
+        with instrument_lock(instr):
+            return func(instr, *args, **kargs)
+
+    def map(self, func, *args, **kargs):
+        """Call ``func(instrument, *args, **kargs)`` for every member concurrently.
+
+        Keyword Arguments:
+            return_exceptions (bool): Put any exceptions in the results rather than raising the first of them.
+
+        Returns:
+            (list): The return values in member order.
+        """
+        return_exceptions = kargs.pop("return_exceptions", False)
+        return self._run([(func, instr, args, kargs) for instr in self.instruments], return_exceptions)
+
+    def _run(self, jobs, return_exceptions=False):
+        """Run (func, instrument, args, kargs) jobs concurrently, each holding its instrument's lock."""
+        if len(jobs) == 1:  # Nothing to overlap with
+            calls = [lambda: self._locked(*jobs[0])]
+        else:
+            calls = [self.executor.submit(self._locked, *job).result for job in jobs]
+        results = []
+        error = None
+        for call in calls:
+            try:
+                results.append(call())
+            except Exception as err:
+                if error is None:
+                    error = err
+                results.append(err)
+        if error is not None and not return_exceptions:
+            raise error
+        return results
+
+    def call(self, method, *args, **kargs):
+        """Call the method named *method* on every member concurrently and return a list of the results."""
+        return self.map(_call, method, args, kargs)
+
+    def _resolve(self, name):
+        """Resolve *name* against the first member's command tree, returning (node, canonical path)."""
+        node, tree, _ = self.instruments[0]._get_path(name)
+        return node, tree
+
+    def _access(self, name):
+        """Return a branch proxy, or read the command *name* from every member."""
+        node, tree = self._resolve(name)
+        if isinstance(node, Param):
+            return self.get(tree)
+        return _Group_Proxy(self, tree)
+
+    def get(self, name):
+        """Read the command *name* from every member, returning a list of the values."""
+        return self.map(_get, name)
+
+    def set(self, name, value):
+        """Set the command *name* to *value* on every member."""
+        node, tree = self._resolve(name)
+        if not isinstance(node, Param):
+            raise CommandError(
+                "Non terminal SCPI command path {} trying to be set a value of {}!".format(tree, value)
+            )
+        self.map(_set, tree, value)
+
+    def set_each(self, name, values):
+        """Set the command *name* to a different value on each member, taken in order from *values*."""
+        values = list(values)
+        if len(values) != len(self.instruments):
+            raise ValueError(
+                "{} values given for {} instruments".format(len(values), len(self.instruments))
+            )
+        self._run([(_set, instr, (name, value), {}) for instr, value in zip(self.instruments, values)])
+
+    def query_many(self, names, max_length=None):
+        """Read several commands from every member with :py:meth:`SCPI_Instrument_Mixin.query_many`."""
+        return self.call("query_many", names, max_length=max_length)
+
+    async def aget(self, name):
+        """Read *name* from every member with their awaitable ``aget``, returning a list of the values.
+
+        Each member's operations hold its transport lock, as they do when the group is used from threads.
+        """
+        import asyncio
+
+        return list(await asyncio.gather(*[instr.aget(name) for instr in self.instruments]))
+
+    async def aset(self, name, value):
+        """Set *name* to *value* on every member with their awaitable ``aset``."""
+        import asyncio
+
+        await asyncio.gather(*[instr.aset(name, value) for instr in self.instruments])
+
+    def __getattr__(self, name):
+        """Read a SCPI command from, or get a branch proxy for, every member - or any other attribute of each."""
+        if name.startswith("_") and name != "_":
+            raise AttributeError("InstrumentGroup has no attribute {}".format(name))
+        try:
+            node, tree = self._resolve(name)
+        except AttributeError:  # Not a SCPI command
+            return self.map(getattr, name)
+        if isinstance(node, Param):
+            return self.get(tree)
+        return _Group_Proxy(self, tree)
+
+    def __setattr__(self, name, value):
+        """Set a SCPI command on every member."""
+        if name.startswith("_") and name != "_":
+            super(InstrumentGroup, self).__setattr__(name, value)
+            return
+        try:
+            self._resolve(name)
+        except AttributeError:
+            self.map(setattr, name, value)
+            return
+        self.set(name, value)
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per command timing and traffic statistics for the communications classes.
+
+Give an instrument a :py:class:`Metrics` with ``metrics=Metrics()`` (or
+:py:meth:`pyscpi.core.comms.InstrumentComms.set_metrics`) and every command and reply is counted against its
+SCPI path, with the time spent blocked on I/O, sleeping in :py:meth:`~pyscpi.core.comms.InstrumentComms.wait`
+and converting replies kept in histograms::
+
+    k6221 = K6221(metrics=Metrics("k6221"))
+    ...
+    print(k6221.metrics.to_text())
+    k6221.metrics.write("/tmp/k6221.prom")
+
+Instruments without metrics don't run any of this code.
+
+@author: phygbu
+"""
+__all__ = ["Histogram", "Metrics", "command_path"]
+
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from time import perf_counter
+
+_bounds = tuple(1e-6 * 2 ** n for n in range(27))  # 1 us to about 67 s
+
+
+def command_path(command):
+    """Return the SCPI path that a message is counted against.
+
+    The first header of the message is used, without its arguments or leading colon, keeping the ``?`` of
+    queries so that setting and reading a value are counted separately. Messages with several commands in them
+    (from :py:meth:`pyscpi.core.base.SCPI_Instrument_Mixin.batch` or ``query_many``) are counted as ``(compound)``.
+
+    Instruments whose messages carry other commands can give a *metric_path* method to be used instead - see
+    :py:meth:`Metrics.attach`.
+    """
+    command = command.strip()
+    if ";" in command:
+        return "(compound)"
+    return command.split(None, 1)[0].lstrip(":") if command else ""
+
+
+class Histogram(object):
+
+    """Count observations in logarithmic buckets, doubling in size from 1 us.
+
+    Attributes:
+        count (int): Number of observations.
+        total (float): Sum of the observations.
+        buckets (list of int): Number of observations no larger than each bound in :py:attr:`bounds`, with a final
+            overflow bucket.
+    """
+
+    bounds = _bounds
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(self.bounds) + 1)
+
+    def observe(self, value):
+        """Add one observation."""
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        self.buckets[bisect_left(self.bounds, value)] += 1
+
+    def quantile(self, q):
+        """Estimate the *q* quantile (0-1) as the upper bound of the bucket it falls in."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.buckets):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        """Return the histogram as a dictionary, listing only the non-empty buckets."""
+        return OrderedDict(
+            [
+                ("count", self.count),
+                ("sum", self.total),
+                ("max", self.max),
+                ("p50", self.quantile(0.5)),
+                ("p99", self.quantile(0.99)),
+                (
+                    "buckets",
+                    [
+                        [bound, count]
+                        for bound, count in zip(self.bounds + (float("inf"),), self.buckets)
+                        if count
+                    ],
+                ),
+            ]
+        )
+
+
+class _Path_Metrics(object):
+
+    """The statistics kept for one SCPI path."""
+
+    __slots__ = ("count", "sent", "received", "errors", "io", "wait", "parse")
+
+    def __init__(self):
+        self.count = 0
+        self.sent = 0
+        self.received = 0
+        self.errors = 0
+        self.io = Histogram()
+        self.wait = Histogram()
+        self.parse = Histogram()
+
+
+class Metrics(object):
+
+    """Statistics on the traffic with an instrument, kept per SCPI path.
+
+    Keyword Arguments:
+        name (str or None): Identifies the instrument in the exported metrics.
+
+    Attributes:
+        io_time (float): Total seconds spent blocked on I/O or waiting, for working out parse times.
+    """
+
+    def __init__(self, name=None):
+        self.name = name
+        self.io_time = 0.0
+        self._paths = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, path):
+        try:
+            return self._paths[path]
+        except KeyError:
+            entry = self._paths[path] = _Path_Metrics()
+            return entry
+
+    def record_io(self, path, seconds, sent=0, received=0):
+        """Record an I/O operation on *path* that took *seconds* and sent or received some bytes."""
+        with self._lock:
+            entry = self._path(path)
+            if sent:
+                entry.count += 1
+                entry.sent += sent
+            entry.received += received
+            entry.io.observe(seconds)
+            self.io_time += seconds
+
+    def record_wait(self, path, seconds):
+        """Record time spent sleeping before talking to the instrument."""
+        with self._lock:
+            self._path(path).wait.observe(seconds)
+            self.io_time += seconds
+
+    def record_parse(self, path, seconds):
+        """Record time spent converting a reply into Python values."""
+        with self._lock:
+            self._path(path).parse.observe(seconds)
+
+    def record_error(self, path):
+        """Count a failed operation."""
+        with self._lock:
+            self._path(path).errors += 1
+
+    def reset(self):
+        """Forget all the statistics."""
+        with self._lock:
+            self._paths.clear()
+            self.io_time = 0.0
+
+    def snapshot(self):
+        """Return all the statistics as a dictionary keyed by SCPI path."""
+        with self._lock:
+            return OrderedDict(
+                (
+                    path,
+                    OrderedDict(
+                        [
+                            ("count", entry.count),
+                            ("bytes_sent", entry.sent),
+                            ("bytes_received", entry.received),
+                            ("errors", entry.errors),
+                            ("io", entry.io.snapshot()),
+                            ("wait", entry.wait.snapshot()),
+                            ("parse", entry.parse.snapshot()),
+                        ]
+                    ),
+                )
+                for path, entry in self._paths.items()
+            )
+
+    def to_text(self):
+        """Return a table of the statistics, slowest paths first."""
+        lines = [
+            "{:<32s} {:>7s} {:>9s} {:>9s} {:>6s} {:>10s} {:>10s} {:>10s} {:>10s}".format(
+                "path", "count", "sent", "received", "errors", "io s", "io p99 ms", "wait s", "parse s"
+            )
+        ]
+        with self._lock:
+            entries = sorted(
+                self._paths.items(),
+                key=lambda item: item[1].io.total + item[1].wait.total + item[1].parse.total,
+                reverse=True,
+            )
+            for path, entry in entries:
+                lines.append(
+                    "{:<32s} {:>7d} {:>9d} {:>9d} {:>6d} {:>10.4f} {:>10.3f} {:>10.4f} {:>10.4f}".format(
+                        path[:32],
+                        entry.count,
+                        entry.sent,
+                        entry.received,
+                        entry.errors,
+                        entry.io.total,
+                        entry.io.quantile(0.99) * 1e3,
+                        entry.wait.total,
+                        entry.parse.total,
+                    )
+                )
+        return "\n".join(lines)
+
+    def to_prometheus(self, prefix="pyscpi"):
+        """Return the statistics in the Prometheus text exposition format."""
+        out = []
+        instrument = 'instrument="{}",'.format(self.name) if self.name else ""
+        counters = [
+            ("commands_total", "Commands sent", "count"),
+            ("bytes_sent_total", "Bytes sent", "sent"),
+            ("bytes_received_total", "Bytes received", "received"),
+            ("errors_total", "Failed operations", "errors"),
+        ]
+        histograms = [
+            ("io_seconds", "Time blocked on I/O", "io"),
+            ("wait_seconds", "Time sleeping before I/O", "wait"),
+            ("parse_seconds", "Time converting replies", "parse"),
+        ]
+        with self._lock:
+            paths = list(self._paths.items())
+            for name, help_text, attr in counters:
+                out.append("# HELP {}_{} {}".format(prefix, name, help_text))
+                out.append("# TYPE {}_{} counter".format(prefix, name))
+                for path, entry in paths:
+                    out.append(
+                        '{}_{}{{{}path="{}"}} {}'.format(
+                            prefix, name, instrument, path, getattr(entry, attr)
+                        )
+                    )
+            for name, help_text, attr in histograms:
+                out.append("# HELP {}_{} {}".format(prefix, name, help_text))
+                out.append("# TYPE {}_{} histogram".format(prefix, name))
+                for path, entry in paths:
+                    hist = getattr(entry, attr)
+                    labels = '{}path="{}"'.format(instrument, path)
+                    seen = 0
+                    for bound, count in zip(hist.bounds, hist.buckets):
+                        seen += count
+                        out.append(
+                            '{}_{}_bucket{{{},le="{:.6g}"}} {}'.format(prefix, name, labels, bound, seen)
+                        )
+                    out.append('{}_{}_bucket{{{},le="+Inf"}} {}'.format(prefix, name, labels, hist.count))
+                    out.append("{}_{}_sum{{{}}} {!r}".format(prefix, name, labels, hist.total))
+                    out.append("{}_{}_count{{{}}} {}".format(prefix, name, labels, hist.count))
+        return "\n".join(out) + "\n"
+
+    def write(self, filename, format="prometheus"):
+        """Write the statistics to *filename* in "prometheus" or "text" format."""
+        text = self.to_prometheus() if format == "prometheus" else self.to_text() + "\n"
+        with open(filename, "w") as data:
+            data.write(text)
+
+    def attach(self, comms):
+        """Install timing wrappers around the write, read, read_raw and wait methods of a comms instance.
+
+        If *comms* is also a SCPI instrument its _read_param method is wrapped too, to time converting the replies.
+        Messages are counted against the path returned by *comms.metric_path(message)* if it has one, otherwise by
+        :py:func:`command_path`. The wrappers are instance attributes and whatever they replaced is kept so that
+        :py:meth:`detach` can put it back.
+        """
+        metrics = self
+        path_of = getattr(comms, "metric_path", command_path)
+        attached = [True]  # Cleared by detach, for wrappers that something else has wrapped in turn
+
+        def timed(method, reply):
+            original = getattr(comms, method)
+
+            def wrapper(*args, **kargs):
+                if not attached:
+                    return original(*args, **kargs)
+                if method == "write":
+                    comms._metric_path = path_of(args[0] if args else kargs["command"])
+                path = comms._metric_path or ""
+                waited = metrics.io_time
+                start = perf_counter()
+                try:
+                    ret = original(*args, **kargs)
+                except Exception:
+                    metrics.record_error(path)
+                    raise
+                elapsed = perf_counter() - start - (metrics.io_time - waited)
+                if reply:
+                    metrics.record_io(path, elapsed, received=len(ret) if ret else 0)
+                else:
+                    metrics.record_io(path, elapsed, sent=len(args[0] if args else kargs["command"]))
+                return ret
+
+            return wrapper
+
+        def wait(*args, **kargs):
+            if not attached:
+                return original_wait(*args, **kargs)
+            start = perf_counter()
+            original_wait(*args, **kargs)
+            metrics.record_wait(comms._metric_path or "", perf_counter() - start)
+
+        original_wait = comms.wait
+        wrappers = {
+            "write": timed("write", False),
+            "read": timed("read", True),
+            "read_raw": timed("read_raw", True),
+            "wait": wait,
+        }
+        if hasattr(comms, "_read_param"):
+            original_read_param = comms._read_param
+
+            def read_param(param, tree, query=None):
+                if param._decode is None or not attached:
+                    return original_read_param(param, tree, query)
+                waited = metrics.io_time
+                start = perf_counter()
+                try:
+                    return original_read_param(param, tree, query)
+                finally:
+                    metrics.record_parse(tree + "?", perf_counter() - start - (metrics.io_time - waited))
+
+            wrappers["_read_param"] = read_param
+        saved = {}
+        for method, wrapper in wrappers.items():
+            saved[method] = (comms.__dict__.get(method), wrapper)
+            setattr(comms, method, wrapper)
+        comms._metrics_saved = (saved, attached)
+
+    @staticmethod
+    def detach(comms):
+        """Remove the wrappers installed by :py:meth:`attach`, putting back what they replaced.
+
+        Wrappers that something else - e.g. a :py:class:`pyscpi.core.record.Recorder` - has since wrapped are left
+        in place, so as not to remove the later wrappers, but stop recording.
+        """
+        saved, attached = comms.__dict__.pop("_metrics_saved", ({}, []))
+        del attached[:]
+        for method, (previous, wrapper) in saved.items():
+            if comms.__dict__.get(method) is not wrapper:
+                continue
+            if previous is None:
+                del comms.__dict__[method]
+            else:
+                setattr(comms, method, previous)
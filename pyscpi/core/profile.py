@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Configuration profiles - named sets of instrument settings that can be saved, compared and applied.
+
+A :py:class:`Profile` is an ordered mapping of SCPI commands to values::
+
+    delta = Profile([("SOUR:DELT:HIGH", 1e-7), ("SOUR:DELT:LOW", -1e-7), ("SOUR:DELT:COUN", 4)])
+    changes = delta.apply(k6221)
+
+Applying a profile reads the current values of its settings back in one compound query, works out which differ
+and sends just those, in the order they appear in the profile, as one :py:meth:`SCPI_Instrument_Mixin.batch`.
+Settings that can't be read back, such as the 6221's SOUR:LIST arrays, are always sent. FORM:DATA and FORM:BORD
+are sent with :py:meth:`SCPI_Instrument_Mixin.set_data_format` so that the driver still knows how to decode arrays.
+
+@author: phygbu
+"""
+__all__ = ["Profile", "settable_commands"]
+
+import json
+from collections import OrderedDict
+
+from ..exceptions import CommandError
+from .base import Param, block_formats
+
+# Settings that must go through set_data_format() so that the driver's array decoding follows them
+_data_format_commands = ("FORM:DATA", "FORM:BORD")
+
+
+def settable_commands(instr):
+    """Return the names of all the commands of *instr* that can be both read and set, in declaration order.
+
+    Args:
+        instr (SCPI_Instrument_Mixin): The instrument whose command tree to walk.
+
+    Returns:
+        (list of str): The SCPI commands, each usable as a :py:class:`Profile` key.
+    """
+    return [
+        name
+        for name, param in instr._commands.walk()
+        if param._decode is not None and param._write is not None and not param._array
+    ]
+
+
+def _resolve(instr, name):
+    """Find the Param and canonical command for *name*, which must be a settable command."""
+    param, tree, name = instr._get_path(name)
+    if not isinstance(param, Param) or param._write is None:
+        raise CommandError("{} is not a settable SCPI command".format(tree))
+    return param, tree
+
+
+def _apply_data_format(instr, formats):
+    """Send FORM:DATA and FORM:BORD settings with set_data_format, reading whichever of them isn't being changed."""
+    settings = dict(formats)
+    missing = [tree for tree in _data_format_commands if tree not in settings]
+    if missing:
+        settings.update(instr.query_many(missing))
+    data_format = str(settings["FORM:DATA"])
+    instr.set_data_format(data_format, str(settings["FORM:BORD"]))
+    if "FORM:BORD" in formats and block_formats.get(data_format.upper().replace(" ", "")) is None:
+        param, tree = _resolve(instr, "FORM:BORD")  # set_data_format() only sends this for binary formats
+        instr._write_param(param, tree, formats["FORM:BORD"])
+
+
+def _plain(value):
+    """Convert numpy values into the plain Python types that json understands."""
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return value
+
+
+class Profile(OrderedDict):
+
+    """An ordered set of SCPI settings for one instrument.
+
+    Keys are SCPI commands in any form that the instrument's attribute access accepts (``"SOUR:DELT:HIGH"``,
+    ``"sour:delt:high"``, ``"TRIG:SOUR:_"``) and values are what would be assigned to them. The order of the
+    entries is the order that changed settings are sent in, so list settings that others depend on first.
+
+    Attributes:
+        instrument (str or None): The name of the instrument class that the profile is for.
+    """
+
+    def __init__(self, *args, **kargs):
+        self.instrument = kargs.pop("instrument", None)
+        super(Profile, self).__init__(*args, **kargs)
+
+    def __repr__(self):
+        return "<Profile {} {}>".format(self.instrument, list(self.items()))
+
+    @classmethod
+    def snapshot(cls, instr, names=None):
+        """Read the current settings of an instrument into a new Profile.
+
+        Args:
+            instr (SCPI_Instrument_Mixin): The instrument to read.
+
+        Keyword Arguments:
+            names (iterable of str): The commands to read (default is every command that can be read and set, see
+                :py:func:`settable_commands`).
+
+        Returns:
+            (Profile): The settings, read with :py:meth:`SCPI_Instrument_Mixin.query_many`.
+        """
+        if names is None:
+            names = settable_commands(instr)
+        values = instr.query_many(names)
+        return cls(values.items(), instrument=type(instr).__name__)
+
+    def diff(self, instr, current=None):
+        """Work out which of our settings differ from those of the instrument.
+
+        Args:
+            instr (SCPI_Instrument_Mixin): The instrument to compare with.
+
+        Keyword Arguments:
+            current (Mapping): The instrument's current settings, e.g. from an earlier :py:meth:`snapshot`. By
+                default they are read from the instrument.
+
+        Returns:
+            (Profile): Our entries that need to be sent to the instrument.
+
+        Values are compared by the set command they would produce, so ``1e-7`` and ``1.0E-07`` read back are the
+        same setting. Settings that can't be read are always included.
+        """
+        resolved = [(name, value) + _resolve(instr, name) for name, value in self.items()]
+        if current is None:
+            current = instr.query_many(
+                [name for name, value, param, tree in resolved if param._decode is not None]
+            )
+        changes = Profile(instrument=self.instrument)
+        for name, value, param, tree in resolved:
+            if name in current and param._decode is not None:
+                try:
+                    old = param.format_write(tree, current[name])
+                except (ValueError, TypeError):
+                    old = None
+                if old is not None and old.upper() == param.format_write(tree, value).upper():
+                    continue
+            changes[name] = value
+        return changes
+
+    def apply(self, instr, current=None, check_errors=True):
+        """Send the settings that differ from the instrument's current ones as a single batch.
+
+        Args:
+            instr (SCPI_Instrument_Mixin): The instrument to configure.
+
+        Keyword Arguments:
+            current (Mapping): The instrument's current settings if already known (see :py:meth:`diff`).
+            check_errors (bool): Check the instrument's error queue after sending (see
+                :py:meth:`SCPI_Instrument_Mixin.batch`).
+
+        Returns:
+            (Profile): The settings that were sent.
+
+        Changes to FORM:DATA or FORM:BORD are sent last, with :py:meth:`SCPI_Instrument_Mixin.set_data_format`.
+        """
+        changes = self.diff(instr, current)
+        if changes:
+            formats = {}
+            with instr.batch(check_errors=check_errors):
+                for name, value in changes.items():
+                    param, tree = _resolve(instr, name)
+                    if tree in _data_format_commands:
+                        formats[tree] = value
+                        continue
+                    instr._write_param(param, tree, value)
+                if formats:
+                    _apply_data_format(instr, formats)
+        return changes
+
+    def to_json(self, **kargs):
+        """Return the profile as a JSON string - keyword arguments are passed to :py:func:`json.dumps`."""
+        return json.dumps(
+            {
+                "instrument": self.instrument,
+                "settings": [[name, _plain(value)] for name, value in self.items()],
+            },
+            **kargs
+        )
+
+    @classmethod
+    def from_json(cls, text):
+        """Make a Profile from a string produced by :py:meth:`to_json`."""
+        data = json.loads(text)
+        return cls(
+            [(name, value) for name, value in data["settings"]],
+            instrument=data.get("instrument"),
+        )
+
+    def save(self, filename):
+        """Write the profile to a JSON file."""
+        with open(filename, "w") as data:
+            data.write(self.to_json(indent=2))
+
+    @classmethod
+    def load(cls, filename):
+        """Read a profile from a JSON file written by :py:meth:`save`."""
+        with open(filename, "r") as data:
+            return cls.from_json(data.read())
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Record the traffic with an instrument to a file, for replaying later without the hardware.
+
+A :py:class:`Recorder` wraps the write, read and transaction methods of any
+:py:class:`pyscpi.core.comms.InstrumentComms` instance and appends one compact JSON line per operation to a file,
+timed from the start of the recording::
+
+    with Recorder(k6221, "/data/beamtime/k6221.jsonl"):
+        meas.main_loop()
+
+The first line of the file describes the instrument, and each following line has a time *t* in seconds and one of:
+
+    ``w``: a command sent (a string).
+    ``r``: a text reply (a string, as returned by read).
+    ``b``: a binary reply (base64 encoded bytes, as returned by read_raw).
+    ``srq``: the result of waiting for a service request (true, or false if the wait timed out).
+    ``e``: an operation that failed, as "ExceptionName: message".
+
+:py:class:`pyscpi.sim.replay.Replay_Resource_Manager` serves a recording back to the drivers.
+
+@author: phygbu
+"""
+__all__ = ["Recorder", "read_recording"]
+
+import base64
+import json
+import threading
+import time
+
+_format = "pyscpi-recording"
+_version = 1
+
+
+def read_recording(filename):
+    """Read a file written by :py:class:`Recorder`.
+
+    Args:
+        filename (str): The recording to read.
+
+    Returns:
+        (dict, list of dict): The header, and the operations in the order they happened.
+
+    Raises:
+        ValueError: if the file isn't a recording.
+    """
+    with open(filename, "r") as data:
+        lines = [json.loads(line) for line in data if line.strip()]
+    if not lines or lines[0].get("format") != _format:
+        raise ValueError("{} is not a pyscpi recording".format(filename))
+    return lines[0], lines[1:]
+
+
+class Recorder(object):
+
+    """Log every command and reply of a communications instance to an append-only file.
+
+    Args:
+        comms (InstrumentComms): The instrument to record.
+        filename (str): File to append the recording to.
+
+    The recorder installs wrappers as instance attributes, so only *comms* is affected, and :py:meth:`close`
+    puts back whatever was there before. Only the outermost operation is logged - the write and read that make up a
+    trans are logged once, as the trans's command and reply. If metrics are being kept on *comms* as well, start
+    them first so that the recorder wraps them rather than the other way around.
+    """
+
+    methods = ("write", "read", "read_raw", "trans", "trans_raw", "wait_for_srq")
+
+    def __init__(self, comms, filename):
+        self.comms = comms
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._saved = {}
+        self._file = open(filename, "a", buffering=1)  # Line buffered, so a crash loses at most one operation
+        self._write_line(
+            {
+                "format": _format,
+                "version": _version,
+                "driver": type(comms).__name__,
+                "address": "{}{}".format(
+                    getattr(comms, "ip", ""),
+                    ":{}".format(comms.port) if getattr(comms, "port", "") else "",
+                ),
+                "start": time.time(),
+            }
+        )
+        self._start = time.perf_counter()
+        for method in self.methods:
+            if method == "wait_for_srq" and not comms.supports_srq:
+                continue
+            self._saved[method] = comms.__dict__.get(method)
+            setattr(comms, method, self._wrap(method, getattr(comms, method)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def closed(self):
+        """True once the recording has been stopped."""
+        return self._file is None
+
+    def _write_line(self, entry):
+        self._file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def log(self, key, value):
+        """Append an operation to the recording (see the module docstring for the keys)."""
+        with self._lock:
+            if self._file is not None:
+                self._write_line({"t": round(time.perf_counter() - self._start, 6), key: value})
+
+    def _wrap(self, method, original):
+        """Return a wrapper for *original* that logs the operation if it isn't part of another one."""
+        recorder = self
+        local = self._local
+
+        def wrapper(*args, **kargs):
+            if getattr(local, "busy", False):
+                return original(*args, **kargs)
+            local.busy = True
+            try:
+                if method in ("write", "trans", "trans_raw"):
+                    recorder.log("w", (args[0] if args else kargs["command"]).strip())
+                try:
+                    ret = original(*args, **kargs)
+                except Exception as err:
+                    recorder.log("e", "{}: {}".format(type(err).__name__, err))
+                    raise
+                if method in ("read", "trans"):
+                    recorder.log("r", ret)
+                elif method in ("read_raw", "trans_raw"):
+                    recorder.log("b", base64.b64encode(ret).decode("ascii"))
+                elif method == "wait_for_srq":
+                    recorder.log("srq", bool(ret))
+                return ret
+            finally:
+                local.busy = False
+
+        return wrapper
+
+    def close(self):
+        """Stop recording, restoring the instrument's methods and closing the file."""
+        if self._file is None:
+            return
+        for method, previous in self._saved.items():
+            if previous is None:
+                self.comms.__dict__.pop(method, None)
+            else:
+                setattr(self.comms, method, previous)
+        self._saved = {}
+        with self._lock:
+            self._file.close()
+            self._file = None
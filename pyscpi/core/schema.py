@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Load instrument command trees from declarative schema files.
+
+A schema is a JSON document with a *commands* object describing the SCPI tree::
+
+    {
+        "instrument": "Keithley 6221",
+        "commands": {
+            "SOUR": {
+                "long": "SOURce",
+                "DELT": {
+                    "HIGH": {"read": "float", "write": "float"},
+                    "ARM": {"read": null, "write": null}
+                },
+                "LIST": {
+                    "CURR": {"read": null, "write": {"array": "float", "length": 100}}
+                }
+            }
+        }
+    }
+
+Upper case keys (and ``_``) are SCPI mnemonics in their short form. A node with *read* or *write* entries is a
+terminal command and becomes a :py:class:`pyscpi.core.base.Param`; any other node is a branch. Types are one of
+``"bool"``, ``"int"``, ``"float"``, ``"str"``, null (no value) or an ``{"array": dtype, "length": n}`` object, where
+*length* is the number of values that the instrument accepts in one command. Terminal commands may also give
+*precision*, *choices* and *columns*, which are passed on to the Param. The optional *long* entry gives the
+long form of the mnemonic and is checked against the short form.
+
+Compiled trees are pickled into a cache directory keyed by a hash of the schema file, so that only the first
+process to see a particular schema pays for parsing and validating it. The cache lives in the directory named
+by the ``PYSCPI_CACHE`` environment variable, or ``~/.cache/pyscpi`` by default. Cache files that can't be
+loaded, or that were written by a different copy or version of pyscpi, are rebuilt.
+
+@author: phygbu
+"""
+__all__ = ["load_schema", "compile_schema", "schema_cache_dir"]
+
+import hashlib
+import json
+import os
+import pickle
+import re
+import tempfile
+
+import numpy as np
+
+from ..exceptions import SchemaError
+from . import base as _base
+from .base import Frozen_SCPI_Path_Dict, Param
+
+SCHEMA_FORMAT = 4  # Bump if the compiled form changes so that old cache files are ignored
+
+_types = {"bool": bool, "int": int, "float": float, "str": str}
+_node_keys = set(["long", "read", "write", "doc", "precision", "choices", "columns"])
+_suffix = re.compile(r"^(.*?)(\d*)$")  # Split off a numeric suffix such as CHAN1
+
+
+def schema_cache_dir():
+    """Return the directory used to cache compiled schemas."""
+    return os.environ.get(
+        "PYSCPI_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "pyscpi")
+    )
+
+
+def _param_type(spec, where):
+    """Convert a schema type specification into the form that Param expects."""
+    if spec is None:
+        return None
+    if isinstance(spec, dict):
+        try:
+            dtype = np.dtype(spec["array"])
+        except (KeyError, TypeError) as err:
+            raise SchemaError("Bad array type {} for {}: {}".format(spec, where, err))
+        return np.zeros(int(spec.get("length", 0)), dtype=dtype)
+    try:
+        return _types[spec]
+    except (KeyError, TypeError):
+        raise SchemaError("Unknown type {} for {}".format(spec, where))
+
+
+def _compile_node(node, where):
+    """Recursively convert a schema node into a dictionary of Params and sub-dictionaries."""
+    if not isinstance(node, dict):
+        raise SchemaError("{} should be an object not {}".format(where, node))
+    out = {}
+    for key, value in node.items():
+        if key in _node_keys:
+            continue
+        if key != "_" and key.upper() != key:
+            raise SchemaError("Unknown entry {} in {}".format(key, where))
+        path = "{}:{}".format(where, key) if where else key
+        if not isinstance(value, dict):
+            raise SchemaError("{} should be an object not {}".format(path, value))
+        long = value.get("long")
+        if long is not None:
+            short_base, short_num = _suffix.match(key).groups()
+            long_base, long_num = _suffix.match(long.upper()).groups()
+            if short_num != long_num or not long_base.startswith(short_base):
+                raise SchemaError("Long form {} does not match {}".format(long, path))
+        if "read" in value or "write" in value:
+            extra = [k for k in value if k not in _node_keys]
+            if extra:
+                raise SchemaError(
+                    "{} has both a value and sub-commands {}".format(path, extra)
+                )
+            out[key] = Param(
+                _param_type(value.get("read"), path),
+                _param_type(value.get("write"), path),
+                precision=value.get("precision"),
+                choices=value.get("choices"),
+                columns=value.get("columns"),
+            )
+        else:
+            out[key] = _compile_node(value, path)
+    return out
+
+
+def compile_schema(schema):
+    """Build a frozen command tree from a parsed schema document.
+
+    Args:
+        schema (dict): The schema as loaded from JSON.
+
+    Returns:
+        (Frozen_SCPI_Path_Dict): The compiled command tree.
+
+    Raises:
+        SchemaError: if the schema is malformed or contains ambiguous mnemonics.
+    """
+    if not isinstance(schema, dict) or "commands" not in schema:
+        raise SchemaError("Schema does not have a commands entry")
+    try:
+        return Frozen_SCPI_Path_Dict(_compile_node(schema["commands"], ""))
+    except SchemaError:
+        raise
+    except ValueError as err:  # Ambiguous mnemonics
+        raise SchemaError(str(err))
+
+
+def load_schema(filename, cache=True):
+    """Load a command tree from a schema file, using the compiled cache if possible.
+
+    Args:
+        filename (str): Path to the JSON schema file.
+
+    Keyword Arguments:
+        cache (bool): Read and write the on-disk cache of compiled schemas (default True).
+
+    Returns:
+        (Frozen_SCPI_Path_Dict): The compiled command tree.
+    """
+    with open(filename, "rb") as data:
+        raw = data.read()
+    digest = hashlib.sha256(raw).hexdigest()[:24]
+    cache_file = os.path.join(
+        schema_cache_dir(),
+        "{}-{}-{}.pickle".format(
+            os.path.splitext(os.path.basename(filename))[0], SCHEMA_FORMAT, digest
+        ),
+    )
+    if cache:
+        try:
+            with open(cache_file, "rb") as data:
+                cached = pickle.load(data)
+            if cached.get("source") == _source_stamp():
+                return cached["tree"]
+        except (
+            OSError,
+            IOError,
+            EOFError,
+            pickle.UnpicklingError,
+            AttributeError,
+            ImportError,
+            ModuleNotFoundError,
+            TypeError,
+            ValueError,
+            KeyError,
+        ):  # Unreadable, or written by a different version of pyscpi - so just rebuild it
+            pass
+    tree = compile_schema(json.loads(raw.decode("utf-8")))
+    if cache:
+        _write_cache(cache_file, {"source": _source_stamp(), "tree": tree})
+    return tree
+
+
+def _source_stamp():
+    """Identify the code that compiled trees are built from and unpickled by.
+
+    The modification times of this module and of :py:mod:`pyscpi.core.base` (where :py:class:`Param` lives) are
+    stored with each cached tree, so that a cache written by any other copy or version of pyscpi is rebuilt.
+    """
+    return [os.path.abspath(__file__)] + [
+        os.path.getmtime(filename) for filename in (__file__, _base.__file__)
+    ]
+
+
+def _write_cache(cache_file, tree):
+    """Atomically write a compiled tree (with its source stamp) to the cache, ignoring any problems doing so."""
+    directory = os.path.dirname(cache_file)
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        handle, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(handle, "wb") as data:
+            pickle.dump(tree, data, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_file)
+    except (OSError, IOError, pickle.PicklingError):
+        try:
+            os.remove(tmp)
+        except (NameError, OSError):
+            pass
@@ -8,7 +8,7 @@ Created on Thu Aug 29 22:02:27 2019
 @author: phygbu
 """
 
-__all__ = ["CommandError", "MeasurementError"]
+__all__ = ["CommandError", "MeasurementError", "SchemaError"]
 
 
 class CommandError(AttributeError):
@@ -18,6 +18,13 @@ class CommandError(AttributeError):
     pass
 
 
+class SchemaError(ValueError):
+
+    """Raised when a command tree schema is malformed."""
+
+    pass
+
+
 class MeasurementError(RuntimeError):
 
     """Something bad happened!"""
@@ -7,191 +7,234 @@ Created on Thu Aug 29 23:05:22 2019
 
 @author: phygbu
 """
-import numpy as np
+import time
+from contextlib import contextmanager
 
-from pyscpi.core.base import SCPI_Instrument_Mixin, SCPI_Path_Dict, Param
-from pyscpi.core.comms import GPIBInstrument
+from pyscpi.core.base import SCPI_Instrument_Mixin, block_formats
+from pyscpi.core.comms import GPIBInstrument, InstrumentComms, SocketInstrument
+from pyscpi.core.metrics import command_path
 
 
+class K6221_Mixin(SCPI_Instrument_Mixin):
 
-class K6221(SCPI_Instrument_Mixin, GPIBInstrument):
+    """The command tree and settings of a K6221, shared by the drivers for each way of connecting to it."""
+
+    scpi_schema = "schemas/keithley_6221.json"
+    shadow_ttl = {"*IDN": None, "SOUR:DELT:NVPR": 10.0}
+
+    def metric_path(self, command):
+        """Count messages for the serial port as :py:meth:`K6221_Serial_Bridge.metric_path` says."""
+        return K6221_Serial_Bridge.metric_path(command)
+
+
+class K6221(K6221_Mixin, GPIBInstrument):
 
     """Will handle a K6221/K2182A combo.
 
     This is a simple instrument since we just talk directly to it via GPIB."""
 
 
-    def __init__(self,*args,**kargs):
-        super(K6221,self).__init__(*args,**kargs)
-        self._commands = SCPI_Path_Dict(
-            {
-                "ABORT": Param(),
-                "FORMAT": {},
-                "SOUR": {
-                    "DELT": {
-                        "NVPR": Param(bool, None),
-                        "HIGH": Param(float, float),
-                        "LOW": Param(float, float),
-                        "DELAY": Param(float, float),
-                        "COUN": Param(int, int),
-                        "CAB": Param(bool, bool),
-                        "CSW": Param(bool, bool),
-                        "ARM": Param(None, None),
-                    },
-                    "SWE": {
-                        "RANG": Param(str, str),
-                        "SPAC": Param(str, str),
-                        "COUN": Param(int, int),
-                        "CAB": Param(bool, bool),
-                        "ARM": Param(None, None),
-                    },
-                    "LIST": {
-                        "CURR": Param(None, np.zeros(100)),
-                        "DELAY": Param(None, np.zeros(100)),
-                        "COMP": Param(None, np.zeros(100)),
-                    },
-                    "WAVE": {
-                        "EXTR": {"ILIN": Param(int, int)},
-                        "PMAR": {"OLIN": Param(int, int)},
-                    },
-                    "CLE": {"IMM": Param(None, None)},
-                },
-                "INIT": {"IMM": Param(None, None)},
-                "OUTP": {
-                    "STAT": Param(bool, bool),
-                    "LTE": Param(bool, bool),
-                    "ISH": Param(str, str),
-                },
-                "STAT": {
-                    "OPER": {
-                        "ENAB": Param(int, int),
-                        "EVEN": Param(int, None),
-                        "COND": Param(int, None),
-                    },
-                    "MEAS": {
-                        "ENAB": Param(int, int),
-                        "EVEN": Param(int, None),
-                        "COND": Param(int, None),
-                    },
-                },
-                "SYST": {
-                    "SER": {"SEND": Param(None, str), "ENT": Param(str, None)},
-                    "ERR": {"_": Param(str, None), "CLE": Param(None, None)},
-                },
-                "TRIG": {
-                    "SOUR": {"_": Param(str, str), "DIR": Param(str, str)},
-                    "TCON": {
-                        "DIR": Param(str, str),
-                        "ASYN": {
-                            "OUTP": Param(str, str),
-                            "ILIN": Param(int, int),
-                            "OLIN": Param(int, int),
-                        },
-                    },
-                },
-                "TRAC": {
-                    "CLE": Param(None, None),
-                    "POIN": Param(int, int),
-                    "FEED": {"_": Param(str, str), "CONT": Param(str, str)},
-                    "DATA": Param(np.ndarray([]), None),
-                    "FREE": Param(int, None),
-                },
-            }
-        )
+class K6221_LAN(K6221_Mixin, SocketInstrument):
+
+    """A K6221 talked to over its ethernet port.
+
+    The 6221 listens for raw socket connections on port 1394."""
+
+    def __init__(self, ip, port=1394, **kargs):
+        super(K6221_LAN, self).__init__(ip, port, **kargs)
+
+
+class K6221_Serial_Bridge(InstrumentComms):
+
+    """Communications with an instrument plugged into the RS-232 port of a K6221.
+
+    Commands are forwarded with SYST:COMM:SER:SEND and the reply is collected by polling SYST:COMM:SER:ENT?.
+    Polls that find nothing back off from *min_poll* to *max_poll* seconds, and the reply is complete as soon as
+    a chunk ends with the *terminator* that the remote instrument sends over RS-232. If *terminator* is None an
+    empty poll after some data marks the end of the reply instead, and if the terminator never arrives whatever
+    has been received when the timeout runs out is returned.
+
+    Args:
+        k6221 (K6221): The 6221 to talk through.
+
+    Keyword Arguments:
+        terminator (str or None): The remote instrument's RS-232 reply terminator (default "\r").
+        min_poll (float): Shortest time between polls in seconds (default 0.002).
+        max_poll (float): Longest time between polls in seconds (default 0.1).
+
+    See :py:class:`pyscpi.core.comms.InstrumentComms` for the other keyword arguments.
+    """
+
+    send_command = "SYST:COMM:SER:SEND"
+
+    def __init__(self, k6221, **kargs):
+        self.k6221 = k6221
+        self.terminator = kargs.pop("terminator", "\r")
+        self.min_poll = kargs.pop("min_poll", 0.002)
+        self.max_poll = kargs.pop("max_poll", 0.1)
+        super(K6221_Serial_Bridge, self).__init__(**kargs)
+
+    @property
+    def transport(self):
+        """Our traffic goes over the 6221's connection."""
+        return self.k6221.transport
 
+    def session(self):
+        """Sessions are held on the 6221's connection."""
+        return self.k6221.session()
+
+    def _acquire(self):
+        """Operations in progress are counted on the 6221, so its connection isn't closed between polls."""
+        self.k6221._acquire()
+
+    def _release(self, close=True):
+        self.k6221._release(close)
+
+    def close(self):
+        """Close the 6221's connection."""
+        self.k6221.close()
+
+    @classmethod
+    def metric_path(cls, command):
+        """Return the path that the 6221's metrics count *command* against.
+
+        Messages forwarded to the serial port are counted against the send command, however many commands for the
+        remote instrument they carry. See :py:meth:`pyscpi.core.metrics.Metrics.attach`.
+        """
+        if command.lstrip(" :").startswith(cls.send_command):
+            return cls.send_command
+        return command_path(command)
+
+    def write(self, command, close=True):
+        """Send a command to the remote instrument."""
+        command = command.strip().replace('"', '""')
+        self.k6221.write('{} "{}"'.format(self.send_command, command), close=close)
+
+    def _poll(self):
+        """Return whatever the 6221 has received from the remote instrument since the last poll."""
+        chunk = self.k6221.trans_raw("SYST:COMM:SER:ENT?", close=False)
+        return chunk.decode("ascii", "replace").rstrip("\n")  # Just the 6221's own terminator
+
+    def read(self, close=True, wait=None, timeout=None):
+        """Poll the 6221 until a complete reply has come back from the remote instrument."""
+        self._pre_read(wait)
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time.time() + timeout
+        term = self.terminator
+        delay = self.min_poll
+        parts = []
+        self._acquire()
+        try:
+            while True:
+                chunk = self._poll()
+                if chunk:
+                    parts.append(chunk)
+                    if term and chunk.endswith(term):
+                        break
+                    delay = self.min_poll
+                    continue
+                if parts and not term:  # Nothing more after some data
+                    break
+                if time.time() > deadline:
+                    if parts:
+                        break
+                    raise TimeoutError(
+                        "No reply through the 6221 serial port after {} s".format(timeout)
+                    )
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_poll)
+        finally:
+            self._release(close)
+        return "".join(parts).strip()
+
+    def trans(self, command, close=True, wait=None, timeout=None):
+        """Do a Write-Read transaction"""
+        self.write(command, close=False)
+        return self.read(close=close, wait=wait, timeout=timeout)
 
 
 class K2182A(SCPI_Instrument_Mixin, GPIBInstrument):
 
-    """Will handle a K2182A optionally using a K6221 instance to talk through"""
+    """Will handle a K2182A optionally using a K6221 instance to talk through
+
+    When talking through a 6221 no GPIB connection is opened for the 2182A, all traffic goes through a
+    :py:class:`K6221_Serial_Bridge` and batched commands are joined into messages of at most
+    *bridge_message_length* characters, each sent with a single SYST:COMM:SER:SEND. The serial link only carries
+    text, so binary data formats can only be used when the 2182A is connected directly.
+    """
+
+    scpi_schema = "schemas/keithley_2182a.json"
+    bridge_message_length = 200  # Longest batch message to send over the 6221's serial link
 
     def __init__(self, *args, **kargs):
         """Grab a via_6221 karg before calling super.
 
         Keyword Arguments:
-            via_6221 (K6221, or False): A K6221 instance to talk throigh.
+            via_6221 (K6221, or False): A K6221 instance to talk throigh - a new one is made if not given.
+            serial_terminator (str or None): Reply terminator of the 2182A's RS-232 port (default "\r").
         """
-        self._6221 = kargs.pop("via_6221", K6221())
+        if "via_6221" in kargs:
+            self._6221 = kargs.pop("via_6221")
+        else:
+            self._6221 = K6221()
+        terminator = kargs.pop("serial_terminator", "\r")
+        if self._6221:
+            self._bridge = K6221_Serial_Bridge(
+                self._6221, terminator=terminator, timeout=kargs.get("timeout", 10.0)
+            )
+            self.max_message_length = self.bridge_message_length
+            if not args:
+                kargs.setdefault("instr", None)  # No need for our own GPIB connection
+        else:
+            self._bridge = None
         super(K2182A, self).__init__(*args, **kargs)
-        self._commands = SCPI_Path_Dict(
-            {
-                "SENS": {
-                    "VOLT": {
-                        "CHAN1": {
-                            "REF": {"_": Param(float, float), "STAT": Param(bool, bool)},
-                            "RANG": {"AUTO": Param(bool, bool), "UPP": Param(float, float)},
-                            "LPAS": {"STAT": Param(bool, bool)},
-                            "DFIL": {
-                                "STAT": Param(bool, bool),
-                                "WIND": Param(float, float),
-                                "TCON": Param(str, str),
-                                "COUN": Param(int, int),
-                            },
-                        },
-                        "DIG": Param(int, int),
-                        "NPLC": Param(float, float),
-                    },
-                    "HOLD": {
-                        "STAT": Param(bool, bool),
-                        "WIND": Param(float, float),
-                        "COUN": Param(int, int),
-                    },
-                },
-                "FORM": {
-                    "DATA": Param(str, str),
-                    "BORD": Param(str, str),
-                    "ELEM": Param(str, str),
-                },
-                "SYST": {
-                    "LSYN": {"STAT": Param(bool, bool)},
-                    "FAZ": {"STAT": Param(bool, bool)},
-                    "AZER": {"STAT": Param(bool, bool)},
-                    "ERR": {"_": Param(str, None), "CLE": Param(None, None)},
-                },
-                "TRIG": {
-                    "SOUR": Param(str, str),
-                    "COUN": Param(str, str),  # Allow INF
-                    "DELAY": {"_": Param(float, float), "AUTO": Param(bool, bool)},
-                    "TIM": Param(float, float),
-                },
-                "TRAC": {
-                    "CLE": Param(None, None),
-                    "POIN": Param(int, int),
-                    "FEED": {"_": Param(str, str), "CONT": Param(str, str)},
-                    "DATA": Param(np.ndarray([]), None),
-                    "FREE": Param(int, None),
-                },
-                "INIT": {"IMM": Param(None, None), "CONT": Param(bool, bool)},
-                "ABORT": Param(None, None),
-            }
-        )
 
+    @property
+    def transport(self):
+        """The 6221's connection if we talk through it."""
+        if self._bridge is not None:
+            return self._bridge.transport
+        return self
+
+    @contextmanager
+    def session(self):
+        """Hold a session on the 6221 as well if we talk through it."""
+        with super(K2182A, self).session():
+            if self._6221:
+                with self._6221.session():
+                    yield self
+            else:
+                yield self
 
     def write(self, command, close=True):
         """Wrap command if calling through a 6221."""
-        if self._6221:  # pass comms to 6221 instance
-            command = 'SYST:COMM:SER:SEND "{}"'.format(command)
-            return self._6221.write(command, close=close)
+        if self._bridge is not None:  # pass comms to 6221 instance
+            return self._bridge.write(command, close=close)
         return super(K2182A, self).write(command, close=close)
 
-    def _read(self):
-        self._6221.write("SYST:COMM:SER:ENT?", close=False)
-        return self._6221.read(close=False).strip()
-
-    def read(self, close=True):
-        """If using a 6221, send the 6221 serial comms command to get data and then listen."""
-        if self._6221:  # Patching comms through the 6221 instance
-            buf = self._read()
-            while buf == "":
-                buf = self._read()
-            overall_buf = buf
-            buf = self._read()
-            while buf != "":
-                overall_buf += buf
-                buf = self._read()
-            if close:
-                self._6221.close()
-            return overall_buf.strip()
-        else:
-            return super(K2182A, self).read(close=close)
+    def read(self, close=True, wait=None, timeout=None):
+        """If using a 6221, poll the 6221's serial port for the reply."""
+        if self._bridge is not None:  # Patching comms through the 6221 instance
+            return self._bridge.read(close=close, wait=wait, timeout=timeout)
+        return super(K2182A, self).read(close=close, wait=wait, timeout=timeout)
+
+    def trans(self, command, close=True, wait=None, timeout=None):
+        """Do a Write-Read transaction"""
+        if self._bridge is not None:
+            return self._bridge.trans(command, close=close, wait=wait, timeout=timeout)
+        return super(K2182A, self).trans(command, close=close, wait=wait, timeout=timeout)
 
+    def set_data_format(self, data_format="ASC", byte_order="SWAP"):
+        """Select how the 2182A sends array data - see :py:meth:`SCPI_Instrument_Mixin.set_data_format`.
+
+        Raises:
+            ValueError: for a binary format if we talk through a 6221, as its serial link only passes text.
+        """
+        if self._bridge is not None and block_formats.get(data_format.upper().replace(" ", "")) is not None:
+            raise ValueError(
+                "Binary data format {} can't be read from a 2182A through the 6221 serial link".format(
+                    data_format
+                )
+            )
+        super(K2182A, self).set_data_format(data_format, byte_order)
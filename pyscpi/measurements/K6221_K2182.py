@@ -1,227 +1,287 @@
-"""SCPI over telnet driver Module
-
-This module provides several classes to support doing SCPI over telnet interfaces. It was hacked together to support the use of
-a Keithley 6221 and 2182A for A STXM run in November 2018.
-
-Author: Gavin Burnell, University of Leeds, g.burnell@leeds.ac.uk.
-"""
-from __future__ import print_function
-
-import time
-import visa
-import numpy as np
-
-from pyscpi.instr.keithley import K2182A, K6221
-from pyscpi.measurements.base import MeasurementBase, EpisMeasurementMixin
-from pyscpi.exceptions import MeasurementError
-
-
-class Measurement(EpisMeasurementMixin,MeasurementBase):
-
-    """Setup a Resitance measurement."""
-
-    def __init__(self, *args, **kargs):
-        """Setup my 6221 and 2182 instances."""
-
-        self.k6221 = K6221(debug=False, slow=0.0)
-        self.k2182 = K2182A(via_6221=self.k6221, debug=False, slow=0.0)
-        self.repeats = kargs.pop("repeats", 4)
-        self.amplitude = kargs.pop("amplitude", 1e-7)
-        self.delay = kargs.pop("delay", 0.2)
-        self.compliance = kargs.pop("compliance", 0.1)
-        self._flag = "X07DA-XTR-LOCKIN:MEASFLAG"
-        self.prefix = kargs.pop("prefix", "X07DA-XTR-LOCKIN:{}")
-        self.poll_time = kargs.pop("poll_time", 1.0)
-        self.mock = kargs.pop("mock", False)
-        debug = kargs.pop("debug", False)
-        self.k6221.debug = debug
-        self.k2182.debug = debug
-
-    def main_loop(self):
-        """Execute a connect, confogure and then enter a loop waiting to do measurements."""
-        self.connect()
-        self.configure_delta()
-        time.sleep(1)  # Give us a chance to catch our breaths...
-        while True:  # Measure for ever
-            if self.mock:
-                time.sleep(5.0)
-            else:
-                self.wait_flag()
-            try:
-                results = self.measure_delta()
-            except visa.VisaIOError:
-                self.flag=-1
-                print("Aborting measurement due to VISA errors")
-                break
-            print("Results\n*******")
-            for k, v in results.items():
-                print("\t{} : {}\n".format(k, v))
-            if not self.mock:
-                self.post(results)
-
-    def waveform(self, key):
-        basis = np.ones(self.repeats * 2)
-        amp = basis * self.amplitude
-        amp[::2] = -amp[::2]
-        delay = basis * self.delay
-        comp = basis * self.compliance
-        ret = {"values": amp, "delay": delay, "compliance": comp}
-        return ret[key]
-
-    def connect(self):
-        if "6221" not in self.k6221.idn:
-            raise RuntimeError("No 6221 !")
-        self.k6221.sre = 4  # sre - set service request
-        if not self.k6221.sour.delt.nvpr:  # checks if nVmeter present
-            raise RuntimeError("2182 Not attached to the 6221")
-        if "2182" not in self.k2182.idn:
-            raise RuntimeError("2182A not communicated with!")
-        self.k2182.reset()
-        self.k6221.reset()
-        self.k6221.clear()  # reset status info
-        self.k2182.clear()
-        self.k2182.sre = 4
-        self.k6221.abort  # if waiting for something - stop waiting for it
-        self.k6221.outp.stat = (
-            False
-        )  # turn output off (eqv to pressing button on current source under blue light)
-
-    def config_buffer(self):
-        self.k2182.trac.cle
-        time.sleep(1)  # Clear takes some time
-        self.k2182.trac.feed.cont = "NEXT"
-
-    def configure(self):
-        # Configure 2182
-        self.k2182.abort
-        self.k2182.sens.volt.chan1.ref._ = 0.0
-        self.k2182.sens.volt.chan1.ref.stat = False
-        self.k2182.sens.volt.chan1.rang.auto = False
-        self.k2182.sens.volt.chan1.rang.upp = 0.1
-        self.k2182.sens.volt.dig = 8
-        self.k2182.sens.volt.nplc = 1.0
-        self.k2182.sens.hold.stat = False
-        self.k2182.syst.lsyn.stat = False
-        self.k2182.syst.faz.stat = True
-        self.k2182.syst.azer.stat = True
-        self.k2182.sens.volt.chan1.lpas.stat = False
-        self.k2182.sens.volt.chan1.dfil.stat = False
-        self.k2182.form.data = "ASC"
-        self.k2182.trig.sour = "EXT"
-        self.k2182.trig.coun = 2 * self.repeats
-        self.k2182.trig.delay.auto = True
-        self.k2182.trac.poin = 2 * self.repeats
-        self.k2182.trac.feed._ = "SENS"
-        self.k2182.trac.feed.cont = "NEXT"
-        self.config_buffer()
-        self.k2182.init.cont = False
-
-        # Now the 6221
-        self.k6221.outp.lte = False
-        self.k6221.outp.ish = "OLOW"
-        self.k6221.sour.swe.rang = "BEST"
-        self.k6221.sour.swe.spac = "LIST"
-        self.k6221.sour.swe.coun = 1
-        self.k6221.sour.list.curr = self.waveform("values")
-        self.k6221.sour.list.delay = self.waveform("delay")
-        self.k6221.sour.list.comp = self.waveform("compliance")
-        self.k6221.sour.swe.cab = False
-        self.k6221.trig.sour._ = "TLIN"
-        self.k6221.trig.tcon.dir = "SOUR"
-        self.k6221.trig.tcon.asyn.outp = "DEL"
-        self.k6221.trig.tcon.asyn.ilin = 1
-        self.k6221.trig.tcon.asyn.olin = 2
-        self.k6221.sour.swe.arm
-
-    def configure_delta(self):
-
-        self.k2182.abort
-        self.k2182.sens.volt.chan1.ref._ = 0.0
-        self.k2182.sens.volt.chan1.ref.stat = False
-        self.k2182.sens.volt.chan1.rang.auto = False
-        self.k2182.sens.volt.chan1.rang.upp = 0.1
-        self.k2182.sens.volt.dig = 8
-        self.k2182.sens.volt.nplc = 1.0  # powerline cycles to average over
-        self.k2182.sens.hold.stat = False
-        self.k2182.syst.lsyn.stat = False
-        self.k2182.syst.faz.stat = True
-        self.k2182.syst.azer.stat = True
-        self.k2182.sens.volt.chan1.lpas.stat = False  # low pass analogue filter off
-        self.k2182.sens.volt.chan1.dfil.stat = False  # digital filter off
-
-        """Configure delta mode."""
-        self.k6221.sour.cle.imm
-        self.k6221.reset()
-        self.k6221.sour.delt.high = self.amplitude
-        self.k6221.sour.delt.low = -self.amplitude
-        self.k6221.sour.delt.delay = (
-            self.delay
-        )  # how long current is up and down for, diag p 88 6221 manual
-        self.k6221.sour.delt.coun = self.repeats
-        self.k6221.sour.swe.coun = 1  # number of times to do said repeats
-        self.k6221.sour.delt.cab = (
-            False
-        )  # continue measuring even if it goes into compliance
-        self.k6221.trac.cle
-        self.k6221.trac.poin = self.repeats
-        self.k6221.trac.feed._ = "SENS"
-        self.k6221.trac.feed.cont = "NEXT"
-        self.k6221.sour.delt.arm
-
-    def measure_delta(self):
-        self.k6221.init.imm
-        meas_event = self.k6221.stat.meas.even
-        while not meas_event & 264:
-            if meas_event & 8:
-                raise MeasurementError("6221 in Compliance!")
-            time.sleep(1)
-            meas_event = self.k6221.stat.meas.even
-        data = self.k6221.trac.data
-        data = np.reshape(data, (data.size / 2, 2))
-        res = {}
-        res["R_data"] = data[:, 0] / self.amplitude
-        res["t-Data"] = data[:, 1]
-        means = np.mean(data, axis=0)
-        stds = np.std(data, axis=0)
-        res["R_XY"] = means[0] / self.amplitude
-        res["DR_XY"] = stds[0] / self.amplitude
-        res["I_AMP"] = self.amplitude
-        res["SAMPLENO"] = float(self.repeats)
-
-        self.k6221.trac.cle
-        self.k6221.trac.feed.cont = "NEXT"
-        return res
-
-    def measure(self):
-        try:
-            self.k6221.clear
-            self.k2182.init.imm
-            self.k6221.init.imm
-            while self.k6221.stat.oper.even & 2:
-                time.sleep(1)
-            data = self.k2182.trac.data
-            curr = self.waveform("values")
-            resistance = data / curr
-            res_mean = np.mean(resistance)
-            res_std = np.std(resistance)
-            self.config_buffer()
-            ret = {
-                "V_data": data,
-                "I_data": curr,
-                "R_data": resistance,
-                "R_xy": res_mean,
-                "dR_xy": res_std,
-                "repeats": float(self.repeats),
-                "I_measure": float(self.amplitude),
-            }
-        except visa.VisaIOError as err:
-            if self.k6221.debug:
-                print("DEBUG: Measurement aborted!")
-            raise err
-        return ret
-
-    def stop(self):
-        self.turn_off()
-
-    def turn_off(self):
-        self.k6221.outp.stat = False
+"""SCPI over telnet driver Module
+
+This module provides several classes to support doing SCPI over telnet interfaces. It was hacked together to support the use of
+a Keithley 6221 and 2182A for A STXM run in November 2018.
+
+Author: Gavin Burnell, University of Leeds, g.burnell@leeds.ac.uk.
+"""
+from __future__ import print_function
+
+import time
+import numpy as np
+
+from pyscpi.core.comms import visa_errors
+from pyscpi.core.profile import Profile
+from pyscpi.core.record import Recorder
+from pyscpi.instr.keithley import K2182A, K6221
+from pyscpi.measurements.base import MeasurementBase, EpisMeasurementMixin
+from pyscpi.exceptions import MeasurementError
+
+
+class Measurement(EpisMeasurementMixin,MeasurementBase):
+
+    """Setup a Resitance measurement."""
+
+    def __init__(self, *args, **kargs):
+        """Setup my 6221 and 2182 instances."""
+
+        shadow = kargs.pop("shadow", False)  # Skip re-sending unchanged settings each cycle
+        simulate = kargs.pop("simulate", False)  # True, or a Simulated_Resource_Manager, to run without hardware
+        rm = None
+        if simulate:
+            from pyscpi.sim import Simulated_Resource_Manager
+
+            rm = simulate if isinstance(simulate, Simulated_Resource_Manager) else Simulated_Resource_Manager()
+        replay = kargs.pop("replay", None)  # A recording file, or a Replay_Resource_Manager, to play back
+        if replay is not None:
+            from pyscpi.sim import Replay_Resource_Manager
+
+            rm = replay if isinstance(replay, Replay_Resource_Manager) else Replay_Resource_Manager(replay)
+        record = kargs.pop("record", None)  # File to record all the instrument traffic to
+        self.k6221 = K6221(rm=rm, debug=False, slow=0.0, shadow=shadow)
+        self.k2182 = K2182A(via_6221=self.k6221, debug=False, slow=0.0, shadow=shadow)
+        # The 2182A is reached through the 6221, so recording the 6221 captures everything
+        self.recorder = Recorder(self.k6221, record) if record is not None else None
+        self.repeats = kargs.pop("repeats", 4)
+        self.amplitude = kargs.pop("amplitude", 1e-7)
+        self.delay = kargs.pop("delay", 0.2)
+        self.compliance = kargs.pop("compliance", 0.1)
+        self._flag = "X07DA-XTR-LOCKIN:MEASFLAG"
+        self.prefix = kargs.pop("prefix", "X07DA-XTR-LOCKIN:{}")
+        self.poll_time = kargs.pop("poll_time", 1.0)
+        self.mock = kargs.pop("mock", False)
+        self.binary = kargs.pop("binary", False)  # Fetch the 6221 buffer as binary data
+        debug = kargs.pop("debug", False)
+        self.k6221.debug = debug
+        self.k2182.debug = debug
+        # Pre-resolved handles for the commands used in the measurement loops
+        self._init = self.k6221.handle("INIT:IMM")
+        self._meas_event = self.k6221.handle("STAT:MEAS:EVEN")
+        self._oper_event = self.k6221.handle("STAT:OPER:EVEN")
+        self._trace_data = self.k6221.handle("TRAC:DATA")
+        self._trace_clear = self.k6221.handle("TRAC:CLE")
+        self._trace_feed = self.k6221.handle("TRAC:FEED:CONT")
+
+    def main_loop(self):
+        """Execute a connect, confogure and then enter a loop waiting to do measurements."""
+        with self.k6221.session(), self.k2182.session():  # Keep the connections open throughout
+            self._main_loop()
+
+    def _main_loop(self):
+        self.connect()
+        self.configure_delta()
+        time.sleep(1)  # Give us a chance to catch our breaths...
+        while True:  # Measure for ever
+            if self.mock:
+                time.sleep(5.0)
+            else:
+                self.wait_flag()
+            try:
+                results = self.measure_delta()
+            except visa_errors():
+                self.flag=-1
+                print("Aborting measurement due to VISA errors")
+                break
+            print("Results\n*******")
+            for k, v in results.items():
+                print("\t{} : {}\n".format(k, v))
+            if not self.mock:
+                self.post(results)
+
+    def waveform(self, key):
+        basis = np.ones(self.repeats * 2)
+        amp = basis * self.amplitude
+        amp[::2] = -amp[::2]
+        delay = basis * self.delay
+        comp = basis * self.compliance
+        ret = {"values": amp, "delay": delay, "compliance": comp}
+        return ret[key]
+
+    def connect(self):
+        if "6221" not in self.k6221.idn:
+            raise RuntimeError("No 6221 !")
+        self.k6221.stat.meas.enab = 264  # so that measurement events set the MSB summary bit ...
+        self.k6221.sre = 5  # sre - set service request on it as well as on errors
+        if not self.k6221.sour.delt.nvpr:  # checks if nVmeter present
+            raise RuntimeError("2182 Not attached to the 6221")
+        if "2182" not in self.k2182.idn:
+            raise RuntimeError("2182A not communicated with!")
+        self.k2182.reset()
+        self.k6221.reset()
+        self.k6221.clear()  # reset status info
+        self.k2182.clear()
+        self.k2182.sre = 4
+        self.k6221.abort  # if waiting for something - stop waiting for it
+        self.k6221.outp.stat = (
+            False
+        )  # turn output off (eqv to pressing button on current source under blue light)
+
+    def config_buffer(self):
+        self.k2182.trac.cle
+        time.sleep(1)  # Clear takes some time
+        self.k2182.trac.feed.cont = "NEXT"
+
+    def _k2182_profile(self):
+        """The 2182A settings shared by both measurement modes."""
+        return Profile(
+            [
+                ("SENS:VOLT:CHAN1:REF:_", 0.0),
+                ("SENS:VOLT:CHAN1:REF:STAT", False),
+                ("SENS:VOLT:CHAN1:RANG:AUTO", False),
+                ("SENS:VOLT:CHAN1:RANG:UPP", 0.1),
+                ("SENS:VOLT:DIG", 8),
+                ("SENS:VOLT:NPLC", 1.0),  # powerline cycles to average over
+                ("SENS:HOLD:STAT", False),
+                ("SYST:LSYN:STAT", False),
+                ("SYST:FAZ:STAT", True),
+                ("SYST:AZER:STAT", True),
+                ("SENS:VOLT:CHAN1:LPAS:STAT", False),  # low pass analogue filter off
+                ("SENS:VOLT:CHAN1:DFIL:STAT", False),  # digital filter off
+            ],
+            instrument="K2182A",
+        )
+
+    def sweep_profiles(self):
+        """Return the (2182A, 6221) :py:class:`Profile` for a list sweep measurement."""
+        k2182 = self._k2182_profile()
+        k2182.update(
+            [
+                ("TRIG:SOUR", "EXT"),
+                ("TRIG:COUN", 2 * self.repeats),
+                ("TRIG:DELAY:AUTO", True),
+                ("TRAC:POIN", 2 * self.repeats),
+                ("TRAC:FEED:_", "SENS"),
+                ("TRAC:FEED:CONT", "NEXT"),
+                ("INIT:CONT", False),
+            ]
+        )
+        k6221 = Profile(
+            [
+                ("OUTP:LTE", False),
+                ("OUTP:ISH", "OLOW"),
+                ("SOUR:SWE:RANG", "BEST"),
+                ("SOUR:SWE:SPAC", "LIST"),
+                ("SOUR:SWE:COUN", 1),
+                ("SOUR:LIST:CURR", self.waveform("values")),
+                ("SOUR:LIST:DELAY", self.waveform("delay")),
+                ("SOUR:LIST:COMP", self.waveform("compliance")),
+                ("SOUR:SWE:CAB", False),
+                ("TRIG:SOUR:_", "TLIN"),
+                ("TRIG:TCON:DIR", "SOUR"),
+                ("TRIG:TCON:ASYN:OUTP", "DEL"),
+                ("TRIG:TCON:ASYN:ILIN", 1),
+                ("TRIG:TCON:ASYN:OLIN", 2),
+            ],
+            instrument="K6221",
+        )
+        return k2182, k6221
+
+    def delta_profiles(self):
+        """Return the (2182A, 6221) :py:class:`Profile` for a delta mode measurement."""
+        k6221 = Profile(
+            [
+                ("SOUR:DELT:HIGH", self.amplitude),
+                ("SOUR:DELT:LOW", -self.amplitude),
+                ("SOUR:DELT:DELAY", self.delay),  # how long current is up and down for, diag p 88 6221 manual
+                ("SOUR:DELT:COUN", self.repeats),
+                ("SOUR:SWE:COUN", 1),  # number of times to do said repeats
+                ("SOUR:DELT:CAB", False),  # continue measuring even if it goes into compliance
+                ("TRAC:POIN", self.repeats),
+                ("TRAC:FEED:_", "SENS"),
+                ("TRAC:FEED:CONT", "NEXT"),
+            ],
+            instrument="K6221",
+        )
+        return self._k2182_profile(), k6221
+
+    def configure(self):
+        """Configure a list sweep, only sending the settings that have changed."""
+        k2182, k6221 = self.sweep_profiles()
+        self.k2182.abort
+        self.k2182.set_data_format("ASC")
+        k2182.apply(self.k2182)
+        self.config_buffer()
+
+        with self.k6221.batch():
+            k6221.apply(self.k6221)
+            self.k6221.sour.swe.arm
+
+    def configure_delta(self):
+        """Configure delta mode, sending the settings as one batch for each instrument.
+
+        The 6221 is reset first so that nothing is left over from a list sweep (sweep spacing, trigger routing,
+        output low shield and so on), and then sent all of its delta settings. Only the 2182A settings that have
+        changed are sent.
+        """
+        k2182, k6221 = self.delta_profiles()
+        self.k2182.abort
+        k2182.apply(self.k2182)
+        with self.k6221.batch():
+            self.k6221.sour.cle.imm
+            self.k6221.reset()
+            self.k6221.trac.cle
+            k6221.apply(self.k6221, current={})  # Nothing to compare with after the reset
+            if self.binary:
+                self.k6221.set_data_format("REAL,32")
+            self.k6221.sour.delt.arm
+
+    def measure_delta(self):
+        self._init.get()
+        self.k6221.wait_event(
+            self._meas_event, 264, check=self._check_compliance, max_poll=self.poll_time
+        )
+        data = self._trace_data.get()
+        data = np.reshape(data, (data.size // 2, 2))
+        res = {}
+        res["R_data"] = data[:, 0] / self.amplitude
+        res["t-Data"] = data[:, 1]
+        means = np.mean(data, axis=0)
+        stds = np.std(data, axis=0)
+        res["R_XY"] = means[0] / self.amplitude
+        res["DR_XY"] = stds[0] / self.amplitude
+        res["I_AMP"] = self.amplitude
+        res["SAMPLENO"] = float(self.repeats)
+
+        self._trace_clear.get()
+        self._trace_feed.set("NEXT")
+        return res
+
+    def _check_compliance(self, meas_event):
+        """Abandon the measurement if the measurement event register shows the 6221 in compliance."""
+        if meas_event & 8:
+            raise MeasurementError("6221 in Compliance!")
+
+    def measure(self):
+        try:
+            self.k6221.clear
+            self.k2182.init.imm
+            self.k6221.init.imm
+            self.k6221.wait_event(
+                self._oper_event, lambda event: not event & 2, max_poll=self.poll_time
+            )
+            data = self.k2182.trac.data
+            curr = self.waveform("values")
+            resistance = data / curr
+            res_mean = np.mean(resistance)
+            res_std = np.std(resistance)
+            self.config_buffer()
+            ret = {
+                "V_data": data,
+                "I_data": curr,
+                "R_data": resistance,
+                "R_xy": res_mean,
+                "dR_xy": res_std,
+                "repeats": float(self.repeats),
+                "I_measure": float(self.amplitude),
+            }
+        except visa_errors() as err:
+            if self.k6221.debug:
+                print("DEBUG: Measurement aborted!")
+            raise err
+        return ret
+
+    def stop(self):
+        self.turn_off()
+
+    def turn_off(self):
+        self.k6221.outp.stat = False
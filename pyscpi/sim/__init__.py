@@ -0,0 +1,15 @@
+"""Simulated instruments for running the drivers and measurements without any hardware."""
+__all__ = [
+    "Simulated_Instrument",
+    "K6221_Simulator",
+    "K2182A_Simulator",
+    "Simulated_Resource_Manager",
+    "Replay_Resource_Manager",
+    "Simulator_Server",
+]
+
+from pyscpi.sim.engine import Simulated_Instrument
+from pyscpi.sim.keithley import K2182A_Simulator, K6221_Simulator
+from pyscpi.sim.replay import Replay_Resource_Manager
+from pyscpi.sim.resources import Simulated_Resource_Manager
+from pyscpi.sim.server import Simulator_Server
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A generic simulated SCPI instrument.
+
+:py:class:`Simulated_Instrument` parses SCPI messages against the same command trees that the drivers use, keeps
+the settings that have been sent to it and answers queries from them. Subclasses add the behaviour of a particular
+instrument by naming methods to call for particular commands in their *actions* and *queries* dictionaries.
+
+@author: phygbu
+"""
+__all__ = ["Simulated_Instrument", "split_message"]
+
+import random
+import re
+import threading
+import time
+from collections import deque
+
+try:
+    from collections.abc import Mapping
+except ImportError:  # Python 2
+    from collections import Mapping
+
+from ..core.base import merge_commands
+
+_header = re.compile(r"^\s*([^\s]+)\s*(.*?)\s*$", re.DOTALL)
+_true_values = ("1", "ON", "TRUE")
+
+
+def split_message(message):
+    """Split a SCPI message into its semicolon separated program units, leaving quoted strings alone.
+
+    Args:
+        message (str): The message as sent by the driver.
+
+    Returns:
+        (list of str): The individual commands and queries.
+    """
+    units = []
+    start = 0
+    quote = None
+    for ix, char in enumerate(message):
+        if quote is not None:
+            if char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char == ";":
+            units.append(message[start:ix])
+            start = ix + 1
+    units.append(message[start:])
+    return [unit.strip() for unit in units if unit.strip()]
+
+
+def unquote(value):
+    """Remove the quotes from a SCPI string argument, undoubling any embedded quotes."""
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+        return value[1:-1].replace(value[0] * 2, value[0])
+    return value
+
+
+class Simulated_Instrument(object):
+
+    """An in-process stand in for a SCPI instrument.
+
+    Messages are handled by :py:meth:`write` and any replies queued for :py:meth:`read`. Commands are looked up in
+    *commands* (as for :py:meth:`pyscpi.core.base.SCPI_Instrument_Mixin._get_path`) after adding any
+    *extra_commands* declared by the class; setting a command stores its value and querying it returns the stored
+    value, or the entry in *defaults*, or "0". Event registers (commands ending in EVEN) are cleared when read, and
+    the IEEE 488.2 common commands and SYST:ERR? error queue work as expected.
+
+    Args:
+        commands (Mapping): The command tree to accept, e.g. ``K6221.compiled_commands()``.
+
+    Keyword Arguments:
+        latency (float): Seconds to take over every message (default 0).
+        jitter (float): Up to this many seconds are randomly added to *latency* (default 0).
+        error_rate (float): Probability that a command (not a query) is rejected with an execution error.
+        seed (int or None): Seed for the random numbers used for jitter, errors and noise.
+        time_scale (float): Multiplier for the time that simulated operations such as sweeps take (default 1).
+    """
+
+    idn = "PYSCPI,SIMULATOR,0,0.0"
+    defaults = {}  # Canonical command -> reply after *RST
+    extra_commands = {}  # Commands to add to the driver's command tree
+    actions = {"SYST:ERR:CLE": "clear_errors"}  # Command -> method called with the argument string
+    queries = {"SYST:ERR": "next_error"}  # Command -> method that returns the reply to the query
+    terminator = "\n"
+
+    def __init__(self, commands, **kargs):
+        self.latency = kargs.pop("latency", 0.0)
+        self.jitter = kargs.pop("jitter", 0.0)
+        self.error_rate = kargs.pop("error_rate", 0.0)
+        self.time_scale = kargs.pop("time_scale", 1.0)
+        self.random = random.Random(kargs.pop("seed", None))
+        if kargs:
+            raise TypeError("Unexpected keyword arguments {}".format(list(kargs)))
+        if self.extra_commands:
+            commands = merge_commands(commands, self.extra_commands).freeze()
+        self.commands = commands
+        self.lock = threading.RLock()
+        self.output = deque()
+        self.errors = deque(maxlen=32)
+        self.messages = 0
+        self.state = {}
+        self.sre = 0
+        self.reset()
+
+    def reset(self):
+        """Return to the power on settings (*RST) - *SRE and the status enable registers are kept."""
+        enables = dict((tree, value) for tree, value in self.state.items() if tree.endswith(":ENAB"))
+        self.state = dict(self.defaults)
+        self.state.update(enables)
+        self.events = {}
+
+    def clear(self):
+        """Clear the event registers and error queue (*CLS)."""
+        self.events = {}
+        self.errors.clear()
+
+    def now(self):
+        """The clock that simulated operations are timed by."""
+        return time.time()
+
+    def error(self, code, message):
+        """Add an entry to the error queue."""
+        self.errors.append('{},"{}"'.format(code, message))
+
+    def next_error(self, args=""):
+        """Pop the oldest entry from the error queue."""
+        if self.errors:
+            return self.errors.popleft()
+        return '0,"No error"'
+
+    def clear_errors(self, args=""):
+        """Empty the error queue."""
+        self.errors.clear()
+
+    def update(self):
+        """Bring any operations in progress up to date - called before every message."""
+
+    def status_byte(self):
+        """Work out the IEEE 488.2 status byte, including the MSS bit if service is requested."""
+        self.update()
+        stb = 0
+        if self.events.get("STAT:MEAS", 0) & int(float(self.state.get("STAT:MEAS:ENAB", 0))):
+            stb |= 1
+        if self.errors:
+            stb |= 4
+        if self.output:
+            stb |= 16
+        if self.events.get("STAT:OPER", 0) & int(float(self.state.get("STAT:OPER:ENAB", 0))):
+            stb |= 128
+        if stb & self.sre & ~64:
+            stb |= 64
+        return stb
+
+    def set_event(self, register, bits):
+        """Latch *bits* in the event *register*, e.g. ``"STAT:MEAS"``."""
+        self.events[register] = self.events.get(register, 0) | bits
+
+    def write(self, message):
+        """Handle a message from the driver, queueing the replies to any queries in it."""
+        with self.lock:
+            self.messages += 1
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+            if delay > 0:
+                time.sleep(delay)
+            self.update()
+            replies = []
+            branch = []
+            for unit in split_message(message):
+                match = _header.match(unit)
+                header, args = match.group(1), match.group(2)
+                query = header.endswith("?")
+                header = header.rstrip("?")
+                if not query and self.error_rate and self.random.random() < self.error_rate:
+                    self.error(-200, "Execution error")
+                    continue
+                if header.startswith("*"):
+                    reply = self._common(header.upper(), args, query)
+                else:
+                    if header.startswith(":"):
+                        parts = header[1:].split(":")
+                    else:
+                        parts = branch + header.split(":")
+                    try:
+                        param, tree = self._resolve(parts)
+                    except KeyError:
+                        self.error(-113, "Undefined header")
+                        continue
+                    branch = tree.split(":")[:-1]
+                    reply = self._dispatch(param, tree, args, query)
+                if query and reply is not None:
+                    replies.append(reply)
+            if replies:
+                if any(isinstance(reply, bytes) for reply in replies):
+                    data = b";".join(
+                        r if isinstance(r, bytes) else str(r).encode("ascii") for r in replies
+                    )
+                else:
+                    data = ";".join(str(r) for r in replies).encode("ascii")
+                self.output.append(data + self.terminator.encode("ascii"))
+
+    def read(self):
+        """Return the next queued reply as bytes, including its terminator.
+
+        Raises:
+            TimeoutError: if there is nothing to read - a real instrument would never answer.
+        """
+        with self.lock:
+            if not self.output:
+                self.error(-420, "Query UNTERMINATED")
+                raise TimeoutError("No reply waiting from the simulated instrument")
+            return self.output.popleft()
+
+    def _resolve(self, parts):
+        """Find the Param for the header *parts*, returning it and its canonical command."""
+        node = self.commands
+        canonical = []
+        for part in parts:
+            if not isinstance(node, Mapping):
+                raise KeyError(part)
+            key = node.canonical(part)
+            canonical.append(key)
+            node = node[key]
+        if isinstance(node, Mapping):  # A branch with a default command
+            if "_" not in node:
+                raise KeyError(":".join(parts))
+            node = node["_"]
+        elif canonical[-1] == "_":
+            canonical.pop()
+        return node, ":".join(canonical)
+
+    def _dispatch(self, param, tree, args, query):
+        """Carry out one command or query, returning the reply to a query."""
+        if query:
+            method = self.queries.get(tree)
+            if method is not None:
+                return getattr(self, method)(args)
+            if tree.endswith(":EVEN"):
+                register = tree[:-5]
+                value = self.events.pop(register, 0)
+                return str(value)
+            if param.read is None:
+                self.error(-113, "Undefined header")
+                return None
+            return self.state.get(tree, "0")
+        method = self.actions.get(tree)
+        if method is not None:
+            getattr(self, method)(args)
+        elif param.write is None:
+            if param.read is not None:
+                self.error(-113, "Undefined header")
+        else:
+            value = self._normalise(param, args)
+            if value is not None:
+                self.state[tree] = value
+        return None
+
+    def _normalise(self, param, args):
+        """Convert a set command's argument to the form that a query would return."""
+        if param.write is bool:
+            return "1" if args.upper() in _true_values else "0"
+        if param.write is str:
+            value = unquote(args).upper()
+            if param.choices is not None and value not in [str(c).upper() for c in param.choices]:
+                self.error(-224, "Illegal parameter value")
+                return None
+            return value
+        return args
+
+    def _common(self, header, args, query):
+        """Handle the IEEE 488.2 common commands."""
+        if header == "*IDN" and query:
+            return self.idn
+        if header == "*RST":
+            self.reset()
+        elif header == "*CLS":
+            self.clear()
+        elif header == "*OPC" and query:
+            return "1"
+        elif header == "*SRE":
+            if query:
+                return str(self.sre)
+            self.sre = int(float(args)) % 256
+        elif header == "*STB" and query:
+            return str(self.status_byte())
+        elif header == "*ESR" and query:
+            return "0"
+        elif header in ("*WAI", "*TRG", "*OPC", "*ESE"):
+            pass
+        else:
+            self.error(-113, "Undefined header")
+        return None
+
+    def state_values(self, tree):
+        """Return the comma separated values stored for *tree* as a list of floats."""
+        value = self.state.get(tree, "")
+        return [float(x) for x in value.split(",") if x.strip()]
+
+    def setting(self, tree, default=0.0):
+        """Return the value stored for *tree* as a float."""
+        try:
+            return float(self.state.get(tree, default))
+        except ValueError:
+            return default
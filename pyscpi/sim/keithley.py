@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Simulated Keithley 6221 current source and 2182A nanovoltmeter.
+
+The pair behave as if measuring a resistor: delta mode and list sweeps on the 6221 fill its (or the 2182A's)
+trace buffer with the voltages expected from Ohm's law plus some gaussian noise, taking as long as the configured
+delays say they should (scaled by *time_scale*). The 2182A can be attached to the 6221's RS-232 port and reached
+with SYST:COMM:SER:SEND and SYST:COMM:SER:ENT? as in the real set up.
+
+@author: phygbu
+"""
+__all__ = ["K6221_Simulator", "K2182A_Simulator"]
+
+import numpy as np
+
+from ..core.base import Param, block_formats, byte_orders
+from ..instr.keithley import K2182A, K6221
+from .engine import Simulated_Instrument, unquote
+
+
+def _format_values(values):
+    """Format an array the way the Keithleys send ASCII data."""
+    return ",".join("{:+.6E}".format(value) for value in values)
+
+
+class _Keithley_Simulator(Simulated_Instrument):
+
+    """The parts common to the two Keithley simulators."""
+
+    def __init__(self, commands, **kargs):
+        self.resistance = kargs.pop("resistance", 100.0)
+        self.noise = kargs.pop("noise", 1e-9)
+        super(_Keithley_Simulator, self).__init__(commands, **kargs)
+
+    def reset(self):
+        super(_Keithley_Simulator, self).reset()
+        self.buffer = []  # Trace buffer readings as (value, timestamp)
+
+    def volts(self, currents):
+        """Return the voltages measured across the simulated sample for an array of *currents*."""
+        currents = np.asarray(currents, dtype=float)
+        noise = [self.random.gauss(0, self.noise) for _ in range(currents.size)]
+        return currents * self.resistance + np.array(noise)
+
+    def trace_clear(self, args=""):
+        self.buffer = []
+
+    def trace_data(self, args=""):
+        """Return the buffer as ASCII or, if a binary FORM:DATA is set, an IEEE 488.2 block.
+
+        Each reading is followed by its timestamp if FORM:ELEM includes TST.
+        """
+        data = np.array(self.buffer, dtype=float).reshape(-1, 2)
+        if "TST" not in self.state.get("FORM:ELEM", "READ"):
+            data = data[:, 0]
+        data = data.ravel()
+        code = block_formats.get(self.state.get("FORM:DATA", "ASC"))
+        if code is None:
+            return _format_values(data)
+        dtype = byte_orders.get(self.state.get("FORM:BORD", "NORM"), ">") + code
+        payload = data.astype(dtype).tobytes()
+        size = str(len(payload))
+        return b"#" + str(len(size)).encode("ascii") + size.encode("ascii") + payload
+
+    def trace_free(self, args=""):
+        points = int(self.setting("TRAC:POIN", 100))
+        return "{},{}".format(max(points - len(self.buffer), 0), len(self.buffer))
+
+    def record(self, readings, timestamps):
+        """Add readings to the trace buffer if it is accepting them, up to TRAC:POIN points."""
+        if self.state.get("TRAC:FEED:CONT", "NEV") == "NEV":
+            return
+        points = int(self.setting("TRAC:POIN", 100))
+        for entry in zip(readings, timestamps):
+            if len(self.buffer) >= points:
+                break
+            self.buffer.append(entry)
+
+
+class K2182A_Simulator(_Keithley_Simulator):
+
+    """A simulated Keithley 2182A nanovoltmeter.
+
+    Readings are added to the trace buffer by an attached :py:class:`K6221_Simulator` as it sweeps.
+
+    Keyword Arguments:
+        resistance (float): The resistance of the simulated sample in Ohms (default 100).
+        noise (float): The rms noise on each voltage reading (default 1 nV).
+
+    See :py:class:`pyscpi.sim.engine.Simulated_Instrument` for the other keyword arguments.
+    """
+
+    idn = "KEITHLEY INSTRUMENTS INC.,MODEL 2182A,0000000,C02  /A02"
+    defaults = {
+        "SENS:VOLT:CHAN1:RANG:UPP": "120",
+        "SENS:VOLT:CHAN1:RANG:AUTO": "1",
+        "SENS:VOLT:DIG": "8",
+        "SENS:VOLT:NPLC": "5",
+        "SYST:AZER:STAT": "1",
+        "SYST:FAZ:STAT": "1",
+        "SYST:LSYN:STAT": "1",
+        "FORM:DATA": "ASC",
+        "FORM:BORD": "SWAP",
+        "FORM:ELEM": "READ",
+        "TRIG:SOUR": "IMM",
+        "TRIG:COUN": "1",
+        "TRAC:POIN": "2",
+        "TRAC:FEED": "SENS",
+        "TRAC:FEED:CONT": "NEV",
+        "INIT:CONT": "1",
+    }
+    actions = dict(
+        Simulated_Instrument.actions, **{"TRAC:CLE": "trace_clear", "ABORT": "abort"}
+    )
+    queries = dict(
+        Simulated_Instrument.queries, **{"TRAC:DATA": "trace_data", "TRAC:FREE": "trace_free"}
+    )
+
+    def __init__(self, **kargs):
+        super(K2182A_Simulator, self).__init__(K2182A.compiled_commands(), **kargs)
+
+    def abort(self, args=""):
+        pass
+
+
+class K6221_Simulator(_Keithley_Simulator):
+
+    """A simulated Keithley 6221 current source, optionally with a 2182A on its RS-232 port.
+
+    Delta mode (SOUR:DELT:ARM then INIT:IMM) puts SOUR:DELT:COUN delta readings and their timestamps into the
+    6221's trace buffer, setting bit 8 (256) of the measurement event register when done - or bit 3 (8) if the
+    voltage needed exceeds *compliance*. A list sweep (SOUR:SWE:ARM then INIT:IMM) steps through SOUR:LIST:CURR,
+    triggering a reading on the 2182A for each point; bit 1 (2) of the operation condition is set while it runs.
+
+    Keyword Arguments:
+        nanovoltmeter (K2182A_Simulator or None): The 2182A connected to the RS-232 port.
+        compliance (float): Voltage compliance limit of the source (default 10 V).
+        serial_rate (float): Characters per second passed back from the RS-232 port, or None for all at once
+            (default 1920, i.e. 19200 baud).
+        resistance (float): The resistance of the simulated sample in Ohms (default 100).
+        noise (float): The rms noise on each voltage reading (default 1 nV).
+
+    See :py:class:`pyscpi.sim.engine.Simulated_Instrument` for the other keyword arguments.
+    """
+
+    idn = "KEITHLEY INSTRUMENTS INC.,MODEL 6221,0000000,D03  /700x"
+    defaults = {
+        "SOUR:DELT:HIGH": "0.001",
+        "SOUR:DELT:LOW": "-0.001",
+        "SOUR:DELT:DELAY": "0.002",
+        "SOUR:DELT:COUN": "1",
+        "SOUR:DELT:CAB": "0",
+        "SOUR:SWE:SPAC": "LIN",
+        "SOUR:SWE:COUN": "1",
+        "SOUR:SWE:RANG": "BEST",
+        "OUTP:STAT": "0",
+        "OUTP:ISH": "OLOW",
+        "FORM:DATA": "ASC",
+        "FORM:BORD": "NORM",
+        "FORM:ELEM": "READ,TST",
+        "TRIG:SOUR": "IMM",
+        "TRAC:POIN": "100",
+        "TRAC:FEED": "SENS",
+        "TRAC:FEED:CONT": "NEV",
+    }
+    extra_commands = {  # The driver talks to the serial port as SYST:COMM:SER
+        "SYST": {"COMM": {"SER": {"SEND": Param(None, str), "ENT": Param(str, None)}}}
+    }
+    actions = dict(
+        Simulated_Instrument.actions,
+        **{
+            "SYST:COMM:SER:SEND": "serial_send",
+            "SYST:SER:SEND": "serial_send",
+            "SOUR:DELT:ARM": "delta_arm",
+            "SOUR:SWE:ARM": "sweep_arm",
+            "SOUR:CLE:IMM": "source_clear",
+            "INIT:IMM": "initiate",
+            "ABORT": "abort",
+            "TRAC:CLE": "trace_clear",
+        }
+    )
+    queries = dict(
+        Simulated_Instrument.queries,
+        **{
+            "SYST:COMM:SER:ENT": "serial_enter",
+            "SYST:SER:ENT": "serial_enter",
+            "SOUR:DELT:NVPR": "nvpresent",
+            "STAT:OPER:COND": "oper_condition",
+            "TRAC:DATA": "trace_data",
+            "TRAC:FREE": "trace_free",
+        }
+    )
+
+    def __init__(self, **kargs):
+        self.nanovoltmeter = kargs.pop("nanovoltmeter", None)
+        self.compliance = kargs.pop("compliance", 10.0)
+        self.serial_rate = kargs.pop("serial_rate", 1920.0)
+        self.serial_out = ""
+        self.serial_since = 0.0
+        super(K6221_Simulator, self).__init__(K6221.compiled_commands(), **kargs)
+
+    def reset(self):
+        super(K6221_Simulator, self).reset()
+        self.armed = None  # "DELT" or "SWE" when armed
+        self.running = None  # (mode, start time, end time) of a sweep in progress
+
+    # Serial port to the 2182A
+
+    def serial_send(self, args):
+        """Pass a message on to the 2182A and collect any reply into the serial buffer."""
+        if self.nanovoltmeter is None:
+            return
+        message = unquote(args)
+        self.nanovoltmeter.write(message)
+        while self.nanovoltmeter.output:
+            reply = self.nanovoltmeter.output.popleft().decode("ascii", "replace").rstrip("\n")
+            if not self.serial_out:
+                self.serial_since = self.now()
+            self.serial_out += reply + "\r"
+
+    def serial_enter(self, args=""):
+        """Return as much of the 2182A's reply as has come down the serial line so far."""
+        if self.serial_rate is None or not self.time_scale:
+            count = len(self.serial_out)
+        else:
+            elapsed = (self.now() - self.serial_since) / self.time_scale
+            count = int(elapsed * self.serial_rate)
+        chunk, self.serial_out = self.serial_out[:count], self.serial_out[count:]
+        self.serial_since = self.now()
+        return chunk
+
+    def nvpresent(self, args=""):
+        return "1" if self.nanovoltmeter is not None else "0"
+
+    # Sweeps
+
+    def delta_arm(self, args=""):
+        if self.nanovoltmeter is None:
+            self.error(-221, "Settings conflict")
+            return
+        self.armed = "DELT"
+
+    def sweep_arm(self, args=""):
+        self.armed = "SWE"
+
+    def source_clear(self, args=""):
+        self.abort()
+        self.state["OUTP:STAT"] = "0"
+
+    def abort(self, args=""):
+        self.armed = None
+        self.running = None
+
+    def initiate(self, args=""):
+        """Start the armed sweep."""
+        if self.armed is None:
+            return
+        delay = self.setting("SOUR:DELT:DELAY", 0.002)
+        if self.armed == "DELT":
+            duration = 2.0 * delay * int(self.setting("SOUR:DELT:COUN", 1))
+        else:
+            delays = self.state_values("SOUR:LIST:DELAY")
+            duration = sum(delays) if delays else 0.0
+        duration *= int(self.setting("SOUR:SWE:COUN", 1)) * self.time_scale
+        start = self.now()
+        self.running = (self.armed, start, start + duration)  # Stays armed, as the 6221 does
+        self.update()
+
+    def oper_condition(self, args=""):
+        self.update()
+        return "2" if self.running is not None else "0"
+
+    def update(self):
+        """Finish the sweep in progress once its time is up."""
+        if self.running is None:
+            return
+        mode, start, end = self.running
+        if self.now() < end:
+            self.set_event("STAT:OPER", 2)
+            return
+        self.running = None
+        if mode == "DELT":
+            self._finish_delta()
+        else:
+            self._finish_sweep()
+
+    def _finish_delta(self):
+        high = self.setting("SOUR:DELT:HIGH", 0.001)
+        low = self.setting("SOUR:DELT:LOW", -0.001)
+        count = int(self.setting("SOUR:DELT:COUN", 1)) * int(self.setting("SOUR:SWE:COUN", 1))
+        amplitude = (high - low) / 2.0
+        if max(abs(high), abs(low)) * self.resistance > self.compliance:
+            self.set_event("STAT:MEAS", 8)
+        readings = self.volts(np.ones(count) * amplitude)
+        timestamps = np.arange(count) * 2.0 * self.setting("SOUR:DELT:DELAY", 0.002)
+        self.record(readings, timestamps)
+        self.set_event("STAT:MEAS", 256)
+
+    def _finish_sweep(self):
+        currents = np.array(self.state_values("SOUR:LIST:CURR"))
+        limits = self.state_values("SOUR:LIST:COMP")
+        limit = min(limits) if limits else self.compliance
+        if currents.size and np.max(np.abs(currents)) * self.resistance > limit:
+            self.set_event("STAT:MEAS", 8)
+        if self.nanovoltmeter is not None:
+            delays = self.state_values("SOUR:LIST:DELAY") or [0.0] * currents.size
+            self.nanovoltmeter.record(self.volts(currents), np.cumsum(delays))
+        self.set_event("STAT:MEAS", 256)
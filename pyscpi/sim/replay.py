@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A stand in for a VISA resource manager that plays back recorded instrument traffic.
+
+Record a session with :py:class:`pyscpi.core.record.Recorder` and then drive the same code against the recording::
+
+    rm = Replay_Resource_Manager("/data/beamtime/k6221.jsonl")
+    meas = Measurement(replay=rm)
+    meas.connect()
+    meas.configure_delta()
+    results = meas.measure_delta()
+
+Every command the drivers send must be the next one in the recording, so a replay doubles as a regression test
+that the drivers still talk to the instrument in exactly the same way. The replies are served as fast as possible,
+or with the recorded timing if *realtime* is True. Recordings made over any transport can be replayed - a session
+recorded from a :py:class:`pyscpi.instr.keithley.K6221_LAN` plays back through the GPIB driver.
+
+@author: phygbu
+"""
+__all__ = ["Replay_Resource_Manager", "Replay_Resource", "ReplayError"]
+
+import base64
+import time
+
+from ..core.record import read_recording
+
+
+class ReplayError(AssertionError):
+
+    """Raised when the drivers do something different from what was recorded."""
+
+    pass
+
+
+class Replay_Resource(object):
+
+    """The VISA resource methods used by :py:class:`pyscpi.core.comms.GPIBInstrument`, served from a recording.
+
+    Args:
+        operations (list of dict): The operations from :py:func:`pyscpi.core.record.read_recording`.
+        resource_name (str): The address it was opened as.
+
+    Keyword Arguments:
+        realtime (bool): Wait to serve each operation until as long after the first as when it was recorded.
+
+    Attributes:
+        timeout (int or None): Read timeout in ms, as for VISA - ignored.
+        position (int): Index of the next operation in the recording.
+    """
+
+    def __init__(self, operations, resource_name, realtime=False):
+        self.operations = operations
+        self.resource_name = resource_name
+        self.realtime = realtime
+        self.timeout = 2000
+        self.position = 0
+        self._start = None
+
+    def __repr__(self):
+        return "<Replay_Resource {} ({}/{})>".format(
+            self.resource_name, self.position, len(self.operations)
+        )
+
+    @property
+    def finished(self):
+        """True once every recorded operation has been replayed."""
+        return self.position >= len(self.operations)
+
+    def _next(self, keys, doing):
+        """Return the next operation, which should have one of *keys*, raising any error recorded in its place."""
+        if self.finished:
+            raise ReplayError(
+                "{}: {} after the end of the recording".format(self.resource_name, doing)
+            )
+        entry = self.operations[self.position]
+        self.position += 1
+        if self.realtime:
+            if self._start is None:
+                self._start = time.perf_counter() - entry["t"]
+            delay = self._start + entry["t"] - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        if "e" in entry:
+            name, _, message = entry["e"].partition(": ")
+            if "Timeout" in name or "timeout" in name:
+                raise TimeoutError(message)
+            raise IOError(message)
+        for key in keys:
+            if key in entry:
+                return entry[key]
+        raise ReplayError(
+            "{}: {} at operation {} but the recording has {}".format(
+                self.resource_name, doing, self.position - 1, entry
+            )
+        )
+
+    def write(self, message):
+        recorded = self._next(("w",), "wrote {!r}".format(message))
+        if recorded != message.strip():
+            raise ReplayError(
+                "{}: wrote {!r} at operation {} but the recording has {!r}".format(
+                    self.resource_name, message, self.position - 1, recorded
+                )
+            )
+        return len(message)
+
+    def _next_reply(self):
+        """Return the next recorded reply - bytes if it was read with read_raw, otherwise a string."""
+        entry = self.operations[self.position] if not self.finished else {}
+        if "b" in entry:
+            return base64.b64decode(self._next(("b",), "read"))
+        return self._next(("r",), "read")
+
+    def read_raw(self):
+        reply = self._next_reply()
+        if isinstance(reply, bytes):
+            return reply
+        return (reply + "\n").encode("ascii")
+
+    def read(self):
+        reply = self._next_reply()
+        if isinstance(reply, bytes):
+            return reply.decode("ascii", "replace")
+        return reply + "\n"
+
+    def query(self, message):
+        self.write(message)
+        return self.read()
+
+    def read_stb(self):
+        return 0
+
+    @property
+    def stb(self):
+        return self.read_stb()
+
+    def wait_for_srq(self, timeout=25000):
+        """Replay a recorded wait for a service request.
+
+        If the recording was made without SRQ support the next operation won't be a wait, and we just return
+        straight away to let the driver poll the status registers as it did.
+
+        Raises:
+            TimeoutError: if the recorded wait timed out - standing in for the VISA timeout error.
+        """
+        if self.finished or "srq" not in self.operations[self.position]:
+            return
+        if not self._next(("srq",), "waited for SRQ"):
+            raise TimeoutError("No SRQ from {}".format(self.resource_name))
+
+    def close(self):
+        pass
+
+
+class Replay_Resource_Manager(object):
+
+    """A VISA-like resource manager whose resources play back recordings.
+
+    Args:
+        recordings (str or dict): A recording file, served at whatever address is opened, or a dictionary mapping
+            resource names to recording files.
+
+    Keyword Arguments:
+        realtime (bool): Keep the recorded timing rather than replaying as fast as possible (default False).
+    """
+
+    def __init__(self, recordings, realtime=False):
+        self.realtime = realtime
+        if isinstance(recordings, dict):
+            self.recordings = dict(recordings)
+        else:
+            self.recordings = {None: recordings}
+        self.resources = {}
+
+    def list_resources(self, query="?*::INSTR"):
+        return tuple(name for name in self.recordings if name is not None)
+
+    def open_resource(self, resource_name, **kargs):
+        filename = self.recordings.get(resource_name, self.recordings.get(None))
+        if filename is None:
+            raise ValueError("No recording for {}".format(resource_name))
+        _, operations = read_recording(filename)
+        resource = Replay_Resource(operations, resource_name, realtime=self.realtime)
+        self.resources[resource_name] = resource
+        return resource
+
+    def close(self):
+        pass
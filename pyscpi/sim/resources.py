@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A stand in for a VISA resource manager that connects drivers to simulated instruments.
+
+Pass a :py:class:`Simulated_Resource_Manager` as the *rm* argument of a GPIB driver and it talks to the simulator
+at that address instead of real hardware::
+
+    rm = Simulated_Resource_Manager()
+    k6221 = K6221(rm=rm)
+    k2182 = K2182A(via_6221=k6221)
+
+@author: phygbu
+"""
+__all__ = ["Simulated_Resource_Manager", "Simulated_Resource"]
+
+import time
+
+from .keithley import K2182A_Simulator, K6221_Simulator
+
+
+class Simulated_Resource(object):
+
+    """The VISA resource methods used by :py:class:`pyscpi.core.comms.GPIBInstrument`, for a simulated instrument.
+
+    Args:
+        instrument (Simulated_Instrument): The simulator to talk to.
+        resource_name (str): The address it was opened as.
+
+    Attributes:
+        timeout (int or None): Read timeout in ms, as for VISA.
+    """
+
+    def __init__(self, instrument, resource_name):
+        self.instrument = instrument
+        self.resource_name = resource_name
+        self.timeout = 2000
+
+    def __repr__(self):
+        return "<Simulated_Resource {} ({})>".format(
+            self.resource_name, type(self.instrument).__name__
+        )
+
+    def write(self, message):
+        self.instrument.write(message)
+        return len(message)
+
+    def read_raw(self):
+        return self.instrument.read()
+
+    def read(self):
+        return self.instrument.read().decode("ascii", "replace")
+
+    def query(self, message):
+        self.write(message)
+        return self.read()
+
+    def read_stb(self):
+        return self.instrument.status_byte()
+
+    @property
+    def stb(self):
+        return self.read_stb()
+
+    def wait_for_srq(self, timeout=25000):
+        """Wait for the simulated instrument to request service.
+
+        Raises:
+            TimeoutError: if it doesn't within *timeout* ms - standing in for the VISA timeout error.
+        """
+        deadline = None if timeout is None else time.time() + timeout / 1000.0
+        while not self.instrument.status_byte() & 64:
+            if deadline is not None and time.time() >= deadline:
+                raise TimeoutError("No SRQ from {}".format(self.resource_name))
+            time.sleep(0.001)
+
+    def close(self):
+        pass
+
+
+class Simulated_Resource_Manager(object):
+
+    """A VISA-like resource manager whose resources are simulated instruments.
+
+    Args:
+        instruments (dict or None): Maps resource names to :py:class:`pyscpi.sim.engine.Simulated_Instrument`
+            instances. By default there is a :py:class:`K6221_Simulator` at GPIB0::11::INSTR with a
+            :py:class:`K2182A_Simulator` on its serial port.
+
+    Keyword Arguments are passed to both default simulators (see :py:class:`K6221_Simulator`).
+    """
+
+    def __init__(self, instruments=None, **kargs):
+        if instruments is None:
+            source = dict((k, kargs.pop(k)) for k in ("compliance", "serial_rate") if k in kargs)
+            k2182 = K2182A_Simulator(**kargs)
+            source.update(kargs)
+            instruments = {"GPIB0::11::INSTR": K6221_Simulator(nanovoltmeter=k2182, **source)}
+        self.instruments = dict(instruments)
+
+    def add(self, resource_name, instrument):
+        """Make *instrument* available as *resource_name*."""
+        self.instruments[resource_name] = instrument
+
+    def list_resources(self, query="?*::INSTR"):
+        return tuple(self.instruments)
+
+    def open_resource(self, resource_name, **kargs):
+        try:
+            return Simulated_Resource(self.instruments[resource_name], resource_name)
+        except KeyError:
+            raise ValueError("No simulated instrument at {}".format(resource_name))
+
+    def close(self):
+        pass
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Serve a simulated instrument over a local TCP port, for testing the socket transports.
+
+@author: phygbu
+"""
+__all__ = ["Simulator_Server"]
+
+import socket
+import socketserver
+import threading
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    """Pass each line received to the simulator and send back any replies."""
+
+    def setup(self):
+        super(_Handler, self).setup()
+        with self.server.connections_lock:
+            self.server.connections.add(self.connection)
+
+    def finish(self):
+        with self.server.connections_lock:
+            self.server.connections.discard(self.connection)
+        try:
+            super(_Handler, self).finish()
+        except OSError:  # Dropped with drop_connections()
+            pass
+
+    def handle(self):
+        instrument = self.server.instrument
+        while True:
+            try:
+                line = self.rfile.readline()
+            except (OSError, ValueError):  # Dropped with drop_connections()
+                break
+            if not line:
+                break
+            message = line.decode("ascii", "replace").strip()
+            if not message:
+                continue
+            with instrument.lock:
+                instrument.write(message)
+                replies = list(instrument.output)
+                instrument.output.clear()
+            for reply in replies:
+                self.wfile.write(reply)
+            self.wfile.flush()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class Simulator_Server(object):
+
+    """Run a simulated instrument as a raw socket SCPI server in a background thread.
+
+    Args:
+        instrument (Simulated_Instrument): The simulator to serve.
+
+    Keyword Arguments:
+        host (str): Address to listen on (default "127.0.0.1").
+        port (int): Port to listen on - 0 (the default) picks a free one, see :py:attr:`address`.
+
+    Use as a context manager, or call :py:meth:`start` and :py:meth:`stop`::
+
+        with Simulator_Server(K6221_Simulator()) as server:
+            k6221 = K6221_LAN(*server.address)
+    """
+
+    def __init__(self, instrument, host="127.0.0.1", port=0):
+        self.instrument = instrument
+        self._server = _Server((host, port), _Handler)
+        self._server.instrument = instrument
+        self._server.connections = set()
+        self._server.connections_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def address(self):
+        """The (host, port) that the server is listening on."""
+        return self._server.server_address[:2]
+
+    def drop_connections(self):
+        """Close every client connection from the server end, as an instrument does when its idle timer runs out."""
+        with self._server.connections_lock:
+            connections = list(self._server.connections)
+        for conn in connections:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            conn.close()
+
+    def start(self):
+        """Start serving in a daemon thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._server.serve_forever)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the listening socket."""
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
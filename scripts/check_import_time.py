@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Check how long it takes a fresh interpreter to import pyscpi.core.
+
+Short lived tools and worker processes import the core driver classes many times a day, so we keep a budget on
+the import time and check that it doesn't drag in the heavyweight optional backends (numpy, VISA, EPICS).
+
+Usage:
+    python scripts/check_import_time.py [module] [--budget ms] [--repeats n]
+
+Exits with a non-zero status if the best of the repeated imports is over budget or a forbidden module was loaded.
+
+@author: phygbu
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+FORBIDDEN = ["numpy", "visa", "pyvisa", "epics", "telnetlib", "asyncio"]
+
+_probe = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"time": elapsed, "loaded": [m for m in {forbidden!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module, repeats):
+    """Import *module* in *repeats* fresh interpreters and return the best time and the forbidden modules seen."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([root, env.get("PYTHONPATH", "")])
+    code = _probe.format(module=module, forbidden=FORBIDDEN)
+    best, loaded = None, set()
+    for _ in range(repeats):
+        out = subprocess.check_output([sys.executable, "-c", code], env=env)
+        result = json.loads(out.decode("utf-8").strip().splitlines()[-1])
+        best = result["time"] if best is None else min(best, result["time"])
+        loaded.update(result["loaded"])
+    return best, sorted(loaded)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("module", nargs="?", default="pyscpi.core")
+    parser.add_argument("--budget", type=float, default=20.0, help="Budget in ms (default 20)")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args(argv)
+    best, loaded = measure(args.module, args.repeats)
+    print("import {}: {:.1f} ms (budget {:.1f} ms)".format(args.module, best * 1e3, args.budget))
+    ok = best * 1e3 <= args.budget
+    if loaded:
+        print("Forbidden modules imported: {}".format(", ".join(loaded)))
+        ok = False
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
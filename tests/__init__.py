@@ -0,0 +1 @@
+"""Tests for pyscpi, run against the simulated instruments in :py:mod:`pyscpi.sim` so no hardware is needed."""
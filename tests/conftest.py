@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Shared fixtures: simulated Keithley instruments, a loopback server for the socket transports and drivers
+connected to them.
+
+@author: phygbu
+"""
+import os
+import tempfile
+
+import pytest
+
+os.environ.setdefault("PYSCPI_CACHE", os.path.join(tempfile.gettempdir(), "pyscpi-test-cache"))
+
+from pyscpi.instr.keithley import K2182A, K6221, K6221_LAN  # noqa: E402
+from pyscpi.sim import (  # noqa: E402
+    K2182A_Simulator,
+    K6221_Simulator,
+    Simulated_Resource_Manager,
+    Simulator_Server,
+)
+
+
+@pytest.fixture
+def k6221_sim():
+    """A 6221 simulator with a 2182A on its serial port, running with no delays."""
+    return K6221_Simulator(
+        nanovoltmeter=K2182A_Simulator(time_scale=0.0, seed=1), time_scale=0.0, serial_rate=None, seed=1
+    )
+
+
+@pytest.fixture
+def rm(k6221_sim):
+    """A simulated resource manager with *k6221_sim* at GPIB0::11::INSTR."""
+    return Simulated_Resource_Manager({"GPIB0::11::INSTR": k6221_sim})
+
+
+@pytest.fixture
+def k6221(rm):
+    """A K6221 driver talking to the simulator over the GPIB transport."""
+    return K6221(rm=rm)
+
+
+@pytest.fixture
+def shadowed(rm):
+    """A K6221 driver keeping a shadow of its settings."""
+    return K6221(rm=rm, shadow=True)
+
+
+@pytest.fixture
+def k2182(k6221):
+    """A K2182A driver talking through *k6221*'s serial port."""
+    return K2182A(via_6221=k6221)
+
+
+@pytest.fixture
+def server(k6221_sim):
+    """*k6221_sim* served on a loopback TCP port."""
+    with Simulator_Server(k6221_sim) as srv:
+        yield srv
+
+
+@pytest.fixture
+def k6221_lan(server):
+    """A K6221_LAN driver connected to the loopback *server*."""
+    instr = K6221_LAN(*server.address, timeout=2.0)
+    yield instr
+    instr.close()
+
+
+@pytest.fixture
+def sent(k6221_sim, monkeypatch):
+    """The list of messages that reach *k6221_sim*, in order."""
+    messages = []
+    write = k6221_sim.write
+
+    def recording_write(message):
+        messages.append(message)
+        write(message)
+
+    monkeypatch.setattr(k6221_sim, "write", recording_write)
+    return messages
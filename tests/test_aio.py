@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the awaitable operations - the executor bridge and the native asyncio socket transport.
+
+@author: phygbu
+"""
+import asyncio
+import socket
+
+import numpy as np
+import pytest
+
+from pyscpi.core.aio import AsyncSocketInstrument
+from pyscpi.exceptions import CommandError
+from pyscpi.instr.keithley import K6221, K6221_LAN
+
+
+class K6221_Async(K6221_LAN, AsyncSocketInstrument):
+
+    pass
+
+
+@pytest.fixture
+def k6221_async(server):
+    """A native asyncio K6221 connected to the loopback *server*."""
+    instr = K6221_Async(*server.address, timeout=2.0)
+    yield instr
+    instr.close()
+
+
+def test_executor_bridge(k6221, k2182, k6221_sim):
+    async def main():
+        await k6221.aset("SOUR:DELT:HIGH", 2e-6)
+        await k6221.sour.delt.aset("low", -2e-6)
+        high, low, nplc = await asyncio.gather(
+            k6221.aget("SOUR:DELT:HIGH"), k6221.sour.delt.aget("low"), k2182.aget("SENS:VOLT:NPLC")
+        )
+        return high, low, nplc, await k2182.atrans("*IDN?")
+
+    high, low, nplc, idn = asyncio.run(main())
+    assert (high, low, nplc) == (pytest.approx(2e-6), pytest.approx(-2e-6), 5.0)
+    assert "2182" in idn
+    assert float(k6221_sim.state["SOUR:DELT:LOW"]) == pytest.approx(-2e-6)
+
+
+def test_concurrent_coroutines_get_their_own_replies(k6221_async):
+    async def main():
+        await k6221_async.aset("SOUR:DELT:COUN", 7)
+        return await asyncio.gather(
+            *[k6221_async.aget(name) for name in ["SOUR:DELT:COUN", "SOUR:DELT:HIGH", "TRAC:POIN"] * 10]
+        )
+
+    values = asyncio.run(main())
+    assert values[0::3] == [7] * 10
+    assert values[1::3] == [pytest.approx(1e-3)] * 10
+    assert values[2::3] == [100] * 10
+
+
+def test_native_binary_trace(k6221_async):
+    async def main():
+        await k6221_async.aset("SOUR:DELT:COUN", 2)
+        await k6221_async.aset("TRAC:FEED:CONT", "NEXT")
+        await k6221_async.awrite("SOUR:DELT:ARM")
+        await k6221_async.awrite("INIT:IMM")
+        return await k6221_async.aget("TRAC:DATA")
+
+    k6221_async.set_data_format("REAL,32")
+    data = asyncio.run(main())
+    assert isinstance(data, np.ndarray) and data.size == 4
+    assert data.dtype == np.dtype("<f4")
+
+
+def test_native_timeout(k6221_async):
+    async def main():
+        with pytest.raises(socket.timeout):
+            await k6221_async.aread(timeout=0.05)
+        assert k6221_async._writer is None  # A late reply would be out of step
+        return await k6221_async.atrans("*IDN?")
+
+    assert "6221" in asyncio.run(main())
+
+
+def test_not_in_batch(k6221):
+    async def main():
+        with k6221.batch(check_errors=False):
+            with pytest.raises(CommandError):
+                await k6221.aget("SOUR:DELT:HIGH")
+            with pytest.raises(CommandError):
+                await k6221.aset("SOUR:DELT:HIGH", 1e-6)
+
+    asyncio.run(main())
+
+
+def test_shadow_used(rm, sent):
+    k6221 = K6221(rm=rm, shadow=True)
+
+    async def main():
+        await k6221.aset("SOUR:DELT:HIGH", 1e-6)
+        await k6221.aset("SOUR:DELT:HIGH", 1e-6)
+        first = await k6221.aget("SOUR:DELT:NVPR")
+        return first, await k6221.aget("SOUR:DELT:NVPR")
+
+    assert asyncio.run(main()) == (True, True)
+    assert len(sent) == 2
+
+
+def test_new_event_loops(k6221_async):
+    async def main():
+        return await k6221_async.aget("SOUR:DELT:HIGH")
+
+    assert asyncio.run(main()) == pytest.approx(1e-3)
+    assert asyncio.run(main()) == pytest.approx(1e-3)
+    assert "6221" in asyncio.run(k6221_async.atrans("*IDN?"))
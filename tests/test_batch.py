@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for collecting settings into a few long messages with SCPI_Instrument_Mixin.batch.
+
+@author: phygbu
+"""
+import pytest
+
+
+def test_batch_joins_settings(k6221, k6221_sim, sent):
+    with k6221.batch(check_errors=False):
+        k6221.sour.delt.high = 1e-6
+        k6221.sour.delt.low = -1e-6
+        assert sent == []
+    assert len(sent) == 1
+    assert sent[0].count(";:SOUR:DELT:") == 1
+    assert float(k6221_sim.state["SOUR:DELT:HIGH"]) == pytest.approx(1e-6)
+    assert float(k6221_sim.state["SOUR:DELT:LOW"]) == pytest.approx(-1e-6)
+
+
+def test_batch_splits_long_messages(k6221, sent):
+    with k6221.batch(max_length=40, check_errors=False):
+        k6221.sour.delt.high = 1e-6
+        k6221.sour.delt.low = -1e-6
+        k6221.sour.delt.delay = 0.002
+    assert len(sent) == 3
+    assert all(len(message) <= 40 for message in sent)
+
+
+def test_batch_checks_errors_once(k6221, sent):
+    with k6221.batch():
+        k6221.sour.delt.high = 1e-6
+        k6221.sour.delt.low = -1e-6
+    assert len(sent) == 2
+    assert sent[1].upper().startswith("SYST:ERR?")
+
+
+def test_batch_discards_queue_on_error(k6221, k6221_sim, sent):
+    before = dict(k6221_sim.state)
+    with pytest.raises(RuntimeError):
+        with k6221.batch():
+            k6221.sour.delt.high = 1e-6
+            raise RuntimeError("Abandoned")
+    assert sent == []
+    assert k6221_sim.state == before
+    assert k6221._batch is None
+    k6221.sour.delt.low = -1e-6  # Not batching any more
+    assert len(sent) == 1
+
+
+def test_batch_error_forgets_shadowed_settings(shadowed, k6221_sim, sent):
+    shadowed.sour.delt.high = 2e-6
+    shadowed.sour.delt.low = -2e-6
+    assert "SOUR:DELT:HIGH" in shadowed.shadow
+    with pytest.raises(RuntimeError):
+        with shadowed.batch():
+            shadowed.sour.delt.high = 1e-6
+            raise RuntimeError("Abandoned")
+    assert "SOUR:DELT:HIGH" not in shadowed.shadow
+    assert "SOUR:DELT:LOW" not in shadowed.shadow
+    assert float(k6221_sim.state["SOUR:DELT:HIGH"]) == pytest.approx(2e-6)
+    del sent[:]
+    shadowed.sour.delt.high = 1e-6  # Not suppressed by the discarded setting
+    assert len(sent) == 1
+    assert float(k6221_sim.state["SOUR:DELT:HIGH"]) == pytest.approx(1e-6)
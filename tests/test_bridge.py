@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for talking to a K2182A through the RS-232 port of a K6221 with K6221_Serial_Bridge.
+
+@author: phygbu
+"""
+import pytest
+
+from pyscpi.instr.keithley import K2182A, K6221
+from pyscpi.sim import K2182A_Simulator, K6221_Simulator, Simulated_Resource_Manager
+
+
+def polls(messages):
+    return sum(1 for message in messages if message.startswith("SYST:COMM:SER:ENT?"))
+
+
+def test_reply_ends_at_terminator(k2182, sent):
+    assert "2182" in k2182.trans("*IDN?")
+    assert sent[0] == 'SYST:COMM:SER:SEND "*IDN?"'
+    assert polls(sent) == 1  # No extra empty poll to find the end
+
+
+def test_slow_serial_reply_assembled():
+    sim = K6221_Simulator(nanovoltmeter=K2182A_Simulator(time_scale=0.0), serial_rate=2000.0)
+    rm = Simulated_Resource_Manager({"GPIB0::11::INSTR": sim})
+    k2182 = K2182A(via_6221=K6221(rm=rm))
+    assert k2182.trans("*IDN?") == K2182A_Simulator.idn
+    assert sim.messages > 2  # Collected over several polls
+    assert k2182.sens.volt.nplc == 5.0
+
+
+def test_no_terminator_ends_on_empty_poll(k6221, sent):
+    k2182 = K2182A(via_6221=k6221, serial_terminator=None)
+    assert "2182" in k2182.trans("*IDN?")
+    assert polls(sent) == 2
+
+
+def test_no_reply_times_out(k2182):
+    with pytest.raises(TimeoutError):
+        k2182._bridge.read(timeout=0.05)
+
+
+def test_quotes_doubled(k2182, sent):
+    k2182.write('SENS:FUNC "VOLT"')
+    assert sent == ['SYST:COMM:SER:SEND "SENS:FUNC ""VOLT"""']
+
+
+def test_batches_fit_serial_messages(k2182, k6221_sim, sent):
+    with k2182.batch(check_errors=False):
+        for channel in range(20):
+            k2182.sens.volt.nplc = 1 + channel % 2
+            k2182.sens.volt.dig = 6 + channel % 3
+    assert 1 < len(sent) < 40
+    assert all(len(message) <= K2182A.bridge_message_length + len('SYST:COMM:SER:SEND ""') for message in sent)
+    assert float(k6221_sim.nanovoltmeter.state["SENS:VOLT:NPLC"]) == 2.0
+
+
+def test_no_gpib_connection_of_its_own(k2182, k6221):
+    assert k2182._instr is None
+    assert k2182.transport is k6221
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the connection handling shared by the communications classes - sessions and idle closing.
+
+@author: phygbu
+"""
+import threading
+import time
+
+from pyscpi.core.comms import InstrumentComms
+from pyscpi.instr.keithley import K6221_LAN
+from pyscpi.sim import K6221_Simulator, Simulator_Server
+
+
+class Slow_Comms(InstrumentComms):
+
+    """A transport whose reads take *delay* seconds, recording any close that happens during one."""
+
+    def __init__(self, delay=0.3, **kargs):
+        self.delay = delay
+        self.reading = False
+        self.closes = 0
+        self.closed_while_reading = 0
+        super(Slow_Comms, self).__init__(**kargs)
+
+    def close(self):
+        self.closes += 1
+        if self.reading:
+            self.closed_while_reading += 1
+
+    def write(self, command, close=True):
+        self._acquire()
+        try:
+            pass
+        finally:
+            self._release(close)
+
+    def read(self, close=True, wait=None, timeout=None):
+        self._acquire()
+        try:
+            self.reading = True
+            time.sleep(self.delay)
+            self.reading = False
+            return "1"
+        finally:
+            self._release(close)
+
+    def trans(self, command, close=True, wait=None, timeout=None):
+        self.write(command, close=False)
+        return self.read(close=close)
+
+
+def test_idle_close_waits_for_read_in_progress():
+    comms = Slow_Comms(delay=0.3, idle_timeout=0.05)
+    comms.write("*CLS")  # Starts the idle timer
+    assert comms.read() == "1"  # Outlasts the idle timeout
+    assert comms.closed_while_reading == 0
+    assert not comms.in_use
+    time.sleep(0.2)
+    assert comms.closes == 1  # Closed once the read had finished and the connection was idle
+
+
+def test_idle_close_waits_for_other_threads():
+    comms = Slow_Comms(delay=0.3, idle_timeout=0.05)
+    reader = threading.Thread(target=comms.read, kwargs={"close": False})
+    reader.start()
+    time.sleep(0.05)
+    comms.write("*CLS")  # Asks for a close while the other thread is still reading
+    reader.join()
+    assert comms.closed_while_reading == 0
+
+
+def test_no_idle_close_inside_session():
+    comms = Slow_Comms(delay=0.0, idle_timeout=0.05)
+    with comms.session():
+        comms.trans("*OPC?")
+        time.sleep(0.15)
+        assert comms.closes == 0
+    time.sleep(0.15)
+    assert comms.closes == 1
+
+
+def test_no_close_without_idle_timeout_while_in_use():
+    comms = Slow_Comms(delay=0.2)
+    reader = threading.Thread(target=comms.read, kwargs={"close": False})
+    reader.start()
+    time.sleep(0.05)
+    comms.write("*CLS")
+    reader.join()
+    assert comms.closed_while_reading == 0
+
+
+def test_socket_read_outlasting_idle_timeout():
+    with Simulator_Server(K6221_Simulator(time_scale=0.0, latency=0.3)) as server:
+        instr = K6221_LAN(*server.address, persistent=False, idle_timeout=0.05, timeout=2.0)
+        try:
+            assert "6221" in instr.trans("*IDN?")
+            assert "6221" in instr.trans("*IDN?")
+        finally:
+            instr.close()
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the driver classes and their command trees.
+
+@author: phygbu
+"""
+import pytest
+
+from pyscpi.instr.keithley import K2182A, K6221, K6221_LAN, K6221_Mixin
+from pyscpi.sim import K2182A_Simulator
+
+
+def test_k6221_drivers_share_settings():
+    for name in ("scpi_schema", "shadow_ttl"):
+        assert name not in K6221.__dict__
+        assert name not in K6221_LAN.__dict__
+        assert getattr(K6221, name) is getattr(K6221_LAN, name) is getattr(K6221_Mixin, name)
+    names = [name for name, _ in K6221.compiled_commands().walk()]
+    assert names == [name for name, _ in K6221_LAN.compiled_commands().walk()]
+
+
+def test_k6221_drivers_share_compiled_commands():
+    tree = K6221_Mixin.compiled_commands()
+    assert K6221.compiled_commands() is tree
+    assert K6221_LAN.compiled_commands() is tree
+    assert "_compiled_commands" in K6221_Mixin.__dict__
+    assert "_compiled_commands" not in K6221.__dict__
+    assert "_compiled_commands" not in K6221_LAN.__dict__
+    assert K2182A.compiled_commands() is not tree
+
+
+def test_bridged_k2182_rejects_binary_format(k2182, k6221_sim):
+    nanovoltmeter = k6221_sim.nanovoltmeter
+    sent = nanovoltmeter.messages
+    with pytest.raises(ValueError):
+        k2182.set_data_format("REAL,32")
+    with pytest.raises(ValueError):
+        k2182.set_data_format("sreal")
+    assert nanovoltmeter.messages == sent  # Nothing reached the instrument
+    assert k2182.data_format is None
+    k2182.set_data_format("ASC")
+    assert nanovoltmeter.state["FORM:DATA"] == "ASC"
+
+
+def test_direct_k2182_allows_binary_format(rm):
+    rm.add("GPIB0::7::INSTR", K2182A_Simulator(time_scale=0.0, seed=1))
+    k2182 = K2182A(rm=rm, instr="GPIB0::7::INSTR", via_6221=False)
+    k2182.set_data_format("REAL,32")
+    assert k2182.data_format == "<f4"
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for reads through the VISA transport, GPIBInstrument, against a simulated resource.
+
+@author: phygbu
+"""
+import time
+
+import pytest
+
+from pyscpi.instr.keithley import K6221
+
+
+def test_blocking_read_returns_at_once(k6221):
+    start = time.perf_counter()
+    for _ in range(10):
+        assert "6221" in k6221.trans("*IDN?")
+    assert time.perf_counter() - start < k6221._wait  # Less than one of the old fixed delays for all ten
+
+
+def test_explicit_wait(k6221):
+    start = time.perf_counter()
+    k6221.trans("*IDN?", wait=0.1)
+    assert time.perf_counter() - start >= 0.1
+
+
+def test_polled_reads_sleep_first(rm):
+    k6221 = K6221(rm=rm, blocking=False, wait=0.05)
+    start = time.perf_counter()
+    assert "6221" in k6221.trans("*IDN?")
+    assert time.perf_counter() - start >= 0.05
+
+
+def test_read_timeout_set_on_resource(k6221):
+    k6221.trans("*IDN?", timeout=1.5)
+    assert k6221._instr.timeout == 1500
+    k6221.trans("*IDN?")
+    assert k6221._instr.timeout == int(k6221.timeout * 1000)
+
+
+def test_read_with_nothing_to_read_times_out(k6221):
+    with pytest.raises(TimeoutError):
+        k6221.read(timeout=0.01)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for InstrumentGroup and the transport locks that it shares with the asyncio operations.
+
+@author: phygbu
+"""
+import asyncio
+import threading
+
+import pytest
+
+from pyscpi.core.aio import AsyncSocketInstrument
+from pyscpi.core.comms import transport_lock
+from pyscpi.core.group import InstrumentGroup, instrument_lock
+from pyscpi.instr.keithley import K6221, K6221_LAN
+from pyscpi.sim import K6221_Simulator, Simulated_Resource_Manager
+
+
+class K6221_Async(K6221_LAN, AsyncSocketInstrument):
+
+    pass
+
+
+@pytest.fixture
+def stations():
+    """Two K6221 drivers on separate simulators."""
+    sims = [K6221_Simulator(time_scale=0.0, seed=seed) for seed in (1, 2)]
+    rm = Simulated_Resource_Manager({"GPIB0::{}::INSTR".format(11 + ix): sim for ix, sim in enumerate(sims)})
+    with InstrumentGroup([K6221(instr="GPIB0::11::INSTR", rm=rm), K6221(instr="GPIB0::12::INSTR", rm=rm)]) as group:
+        yield group, sims
+
+
+def test_group_settings_and_queries(stations):
+    group, sims = stations
+    group.sour.delt.high = 1e-6
+    assert [float(sim.state["SOUR:DELT:HIGH"]) for sim in sims] == [1e-6, 1e-6]
+    group.set_each("SOUR:DELT:COUN", [2, 3])
+    assert group.sour.delt.coun == [2, 3]
+    assert group.query_many(["SOUR:DELT:HIGH", "SOUR:DELT:COUN"])[1]["SOUR:DELT:COUN"] == 3
+    assert all("6221" in idn for idn in group.idn)
+
+
+def test_group_raises_first_error(stations):
+    group, sims = stations
+
+    def fail_second(instr):
+        if instr is group[1]:
+            raise RuntimeError("Station 2")
+        return instr.sour.delt.high
+
+    with pytest.raises(RuntimeError):
+        group.map(fail_second)
+    results = group.map(fail_second, return_exceptions=True)
+    assert isinstance(results[1], RuntimeError)
+
+
+def test_bridged_meter_shares_transport_lock(k6221, k2182, rm):
+    assert k2182.transport is k6221
+    assert transport_lock(k2182) is transport_lock(k6221)
+    assert instrument_lock(k2182) is transport_lock(k6221)
+    assert transport_lock(K6221(rm=rm)) is not transport_lock(k6221)
+
+
+def test_group_serialises_shared_transport(k6221, k2182, k6221_sim, monkeypatch):
+    k6221_sim.latency = 0.002
+    senders = []
+    write = k6221_sim.write
+
+    def recording_write(message):
+        senders.append(threading.get_ident())
+        write(message)
+
+    monkeypatch.setattr(k6221_sim, "write", recording_write)
+
+    def poll(instr):
+        return [instr.sens.volt.nplc if instr is k2182 else instr.sour.delt.high for _ in range(5)]
+
+    with InstrumentGroup([k6221, k2182]) as group:
+        group.map(poll)
+    switches = sum(1 for first, second in zip(senders, senders[1:]) if first != second)
+    assert switches == 1  # Each member's job ran without the other's traffic in between
+
+
+def test_blocking_async_operations_wait_for_transport(k6221, k2182):
+    async def main():
+        lock = transport_lock(k6221)
+        lock.acquire()
+        task = asyncio.ensure_future(k2182.atrans("*IDN?"))
+        await asyncio.sleep(0.1)
+        assert not task.done()
+        lock.release()
+        return await task
+
+    assert "2182" in asyncio.run(main())
+
+
+def test_native_async_operations_wait_for_transport(server):
+    instr = K6221_Async(*server.address, timeout=2.0)
+
+    async def main():
+        lock = transport_lock(instr)
+        lock.acquire()
+        task = asyncio.ensure_future(instr.atrans("*IDN?"))
+        await asyncio.sleep(0.1)
+        assert not task.done()
+        lock.release()
+        return await task
+
+    try:
+        assert "6221" in asyncio.run(main())
+        assert transport_lock(instr).acquire(blocking=False)
+        transport_lock(instr).release()
+    finally:
+        instr.close()
+
+
+def test_group_aget_uses_transport_lock(stations):
+    group, sims = stations
+
+    async def main():
+        lock = transport_lock(group[0])
+        lock.acquire()
+        task = asyncio.ensure_future(group.aget("SOUR:DELT:HIGH"))
+        await asyncio.sleep(0.1)
+        assert not task.done()
+        lock.release()
+        await group.aset("SOUR:DELT:LOW", -2e-6)
+        return await task
+
+    assert len(asyncio.run(main())) == 2
+    assert [float(sim.state["SOUR:DELT:LOW"]) for sim in sims] == [-2e-6, -2e-6]
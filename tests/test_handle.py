@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the pre-resolved commands returned by SCPI_Instrument_Mixin.handle.
+
+@author: phygbu
+"""
+import pytest
+
+from pyscpi.core.base import Command_Handle
+from pyscpi.exceptions import CommandError
+
+
+def test_handle_resolves_partial_names(k6221):
+    handle = k6221.handle("sour:delt:high")
+    assert isinstance(handle, Command_Handle)
+    assert handle.tree == "SOUR:DELT:HIGH"
+    assert "SOUR:DELT:HIGH" in repr(handle)
+
+
+def test_get_and_set(k6221, k6221_sim, sent):
+    handle = k6221.handle("SOUR:DELT:HIGH")
+    handle.set(1e-6)
+    assert len(sent) == 1
+    assert float(k6221_sim.state["SOUR:DELT:HIGH"]) == pytest.approx(1e-6)
+    assert handle.get() == pytest.approx(1e-6)
+    assert sent[-1].upper().startswith("SOUR:DELT:HIGH?")
+    assert handle.get() == k6221.sour.delt.high
+
+
+def test_set_matches_attribute_access(k6221, sent):
+    k6221.handle("SOUR:DELT:HIGH").set(2e-6)
+    k6221.sour.delt.high = 2e-6
+    assert sent[0] == sent[1]
+
+
+def test_non_terminal_path(k6221):
+    with pytest.raises(CommandError):
+        k6221.handle("SOUR:DELT")
+    with pytest.raises(AttributeError):
+        k6221.handle("SOUR:NOTHING")
+
+
+def test_set_suppressed_by_shadow(shadowed, sent):
+    handle = shadowed.handle("SOUR:DELT:HIGH")
+    handle.set(1e-6)
+    handle.set(1e-6)
+    shadowed.sour.delt.high = 1e-6
+    assert len(sent) == 1
+    handle.set(2e-6)
+    assert len(sent) == 2
+
+
+def test_get_served_by_shadow(shadowed, sent):
+    handle = shadowed.handle("SOUR:DELT:NVPR")
+    first = handle.get()
+    assert handle.get() == first
+    assert shadowed.sour.delt.nvpr == first
+    assert len(sent) == 1  # Listed in shadow_ttl
+    high = shadowed.handle("SOUR:DELT:HIGH")
+    high.get()
+    high.get()
+    assert len(sent) == 3  # Not listed, so always queried
+
+
+def test_get_remembers_for_set(shadowed, sent):
+    handle = shadowed.handle("SOUR:DELT:HIGH")
+    handle.set(handle.get())
+    assert len(sent) == 1  # Just the query
+
+
+def test_set_queued_in_batch(k6221, k6221_sim, sent):
+    high = k6221.handle("SOUR:DELT:HIGH")
+    low = k6221.handle("SOUR:DELT:LOW")
+    with k6221.batch(check_errors=False):
+        high.set(1e-6)
+        low.set(-1e-6)
+        assert sent == []
+    assert len(sent) == 1
+    assert float(k6221_sim.state["SOUR:DELT:LOW"]) == pytest.approx(-1e-6)
+
+
+def test_get_flushes_batch(k6221, sent):
+    high = k6221.handle("SOUR:DELT:HIGH")
+    with k6221.batch(check_errors=False):
+        high.set(3e-6)
+        assert high.get() == pytest.approx(3e-6)  # The queued setting is sent first
+        assert len(sent) == 2
+    assert len(sent) == 2
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for per command metrics kept by pyscpi.core.metrics.Metrics.
+
+@author: phygbu
+"""
+from pyscpi.core.metrics import Metrics, command_path
+from pyscpi.core.record import Recorder
+from pyscpi.instr.keithley import K6221, K6221_Serial_Bridge
+
+
+def test_metrics_time_reads(rm):
+    metrics = Metrics(name="k6221")
+    k6221 = K6221(rm=rm, metrics=metrics)
+    k6221.sour.delt.high = 1e-6
+    assert k6221.sour.delt.high == 1e-6
+    stats = metrics.snapshot()
+    assert stats["SOUR:DELT:HIGH"]["count"] == 1
+    assert stats["SOUR:DELT:HIGH?"]["count"] == 1
+    assert stats["SOUR:DELT:HIGH?"]["bytes_received"] > 0
+    assert stats["SOUR:DELT:HIGH?"]["parse"]["count"] == 1
+    assert 'path="SOUR:DELT:HIGH?"' in metrics.to_prometheus()
+
+
+def test_metrics_detach_restores_methods(k6221):
+    assert "_read_param" not in vars(k6221)
+    metrics = Metrics()
+    k6221.set_metrics(metrics)
+    assert "_read_param" in vars(k6221)
+    k6221.set_metrics(None)
+    assert not set(vars(k6221)) & {"write", "read", "read_raw", "wait", "_read_param"}
+    k6221.sour.delt.high
+    assert "SOUR:DELT:HIGH?" not in metrics.snapshot()
+
+
+def test_command_paths():
+    assert command_path(":SOUR:DELT:HIGH 1e-06\n") == "SOUR:DELT:HIGH"
+    assert command_path("SOUR:DELT:HIGH?") == "SOUR:DELT:HIGH?"
+    assert command_path(":SOUR:DELT:HIGH 1e-06;:SOUR:DELT:LOW -1e-06") == "(compound)"
+    assert command_path('SYST:COMM:SER:SEND ":SENS:CHAN 1;:SENS:FUNC \'VOLT\'"') == "(compound)"
+
+
+def test_bridge_supplies_metric_path(k6221, k2182):
+    message = 'SYST:COMM:SER:SEND ":SENS:CHAN 1;:SENS:FUNC \'VOLT\'"'
+    assert K6221_Serial_Bridge.metric_path(message) == "SYST:COMM:SER:SEND"
+    assert k6221.metric_path(message) == "SYST:COMM:SER:SEND"
+    assert k6221.metric_path("SOUR:DELT:HIGH?") == "SOUR:DELT:HIGH?"
+    metrics = Metrics()
+    k6221.set_metrics(metrics)
+    with k2182.batch(check_errors=False):
+        k2182.sens.volt.dig = 7
+        k2182.sens.volt.nplc = 1
+    stats = metrics.snapshot()
+    assert stats["SYST:COMM:SER:SEND"]["count"] == 1
+    assert "(compound)" not in stats
+
+
+def test_detach_keeps_later_recorder(k6221, tmp_path):
+    metrics = Metrics()
+    k6221.set_metrics(metrics)
+    recorder = Recorder(k6221, str(tmp_path / "k6221.jsonl"))
+    k6221.set_metrics(None)
+    assert set(vars(k6221)) >= {"write", "read", "read_raw"}  # The recorder's wrappers
+    k6221.sour.delt.high
+    assert "SOUR:DELT:HIGH?" not in metrics.snapshot()
+    recorder.close()  # Puts back the detached metrics wrappers, which no longer record
+    k6221.sour.delt.low
+    assert "SOUR:DELT:LOW?" not in metrics.snapshot()
+    with open(str(tmp_path / "k6221.jsonl")) as data:
+        assert "SOUR:DELT:HIGH?" in data.read()
+
+
+def test_detach_restores_earlier_recorder(k6221, tmp_path):
+    recorder = Recorder(k6221, str(tmp_path / "k6221.jsonl"))
+    recorded = dict((name, vars(k6221)[name]) for name in ("write", "read", "read_raw"))
+    metrics = Metrics()
+    k6221.set_metrics(metrics)
+    k6221.sour.delt.high
+    assert metrics.snapshot()["SOUR:DELT:HIGH?"]["count"] == 1
+    k6221.set_metrics(None)
+    for name, wrapper in recorded.items():
+        assert vars(k6221)[name] is wrapper
+    assert "wait" not in vars(k6221)
+    recorder.close()
+    with open(str(tmp_path / "k6221.jsonl")) as data:
+        assert "SOUR:DELT:HIGH?" in data.read()
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the conversion functions that Param builds for its read and write types.
+
+The old format path, which checked the types on every call, is kept here as a reference so that the compiled
+encoders and decoders can be checked against it.
+
+@author: phygbu
+"""
+import numpy as np
+import pytest
+
+from pyscpi.core.base import Param
+from pyscpi.exceptions import CommandError
+
+
+def old_format_write(write, tree, value):
+    """Param.format_write as it was before the encoders were compiled."""
+    sample = write(1) if isinstance(write, type) else write
+    if isinstance(sample, str):
+        return "{} {}".format(tree, value)
+    elif isinstance(sample, bool):
+        return "{} {}".format(tree, "ON" if value else "OFF")
+    elif isinstance(sample, int):
+        return "{} {}".format(tree, int(value))
+    elif isinstance(sample, float):
+        return "{} {}".format(tree, float(value))
+    elif isinstance(sample, np.ndarray):
+        value = np.array(value).astype(write.dtype)
+        length = write.size
+        return "\n".join(
+            "{} {}".format(tree, ",".join(value[ix * length : (ix + 1) * length].astype(str)))
+            for ix in range(value.size // length + 1)
+        )
+    return "{} {}".format(tree, value)
+
+
+def old_format_read(read, value):
+    """Param.format_read as it was before the decoders were compiled."""
+    read_cls = read if isinstance(read, type) else read.__class__
+    if read is bool:
+        return value.upper().strip() in ["1", "ON", "YES", "TRUE"]
+    if issubclass(read_cls, np.ndarray):
+        return np.array([float(x) for x in value.split(",")])
+    return read_cls(value)
+
+
+@pytest.mark.parametrize(
+    "write,value",
+    [
+        (str, "NEXT"),
+        (str, 3),
+        (bool, True),
+        (bool, 0),
+        (bool, "ON"),
+        (int, 3),
+        (int, 3.7),
+        (int, True),
+        (float, 1e-6),
+        (float, 2),
+        (float, -0.25),
+        (float, 1.0 / 3.0),
+        (np.zeros(3), [1.0, 2.0, 3.5, 4.0]),
+        (np.zeros(4, dtype=int), range(6)),
+        (np.zeros(2), [0.5]),  # Not exact multiples of the size - see test_array_chunking for those
+    ],
+)
+def test_encoders_match_old_format(write, value):
+    assert Param(write=write).format_write("SOUR:TEST", value) == old_format_write(write, "SOUR:TEST", value)
+
+
+@pytest.mark.parametrize(
+    "read,reply",
+    [
+        (str, "NEXT"),
+        (bool, "1"),
+        (bool, "on\n"),
+        (bool, "0"),
+        (bool, "OFF"),
+        (int, "12"),
+        (float, "+1.234000E-06"),
+        (float, "-2.5E+00\n"),
+        (np.ndarray, "+1.0E+00,-2.5E-01,3"),
+        (np.zeros(1), "1,2,3,4"),
+    ],
+)
+def test_decoders_match_old_format(read, reply):
+    new = Param(read=read).format_read(reply)
+    old = old_format_read(read, reply)
+    if isinstance(old, np.ndarray):
+        np.testing.assert_array_equal(new, old)
+    else:
+        assert new == old
+        assert type(new) is type(old)
+
+
+@pytest.mark.parametrize(
+    "precision,value,expected",
+    [
+        (None, 1.0 / 3.0, "SOUR:TEST 0.3333333333333333"),
+        (3, 1.0 / 3.0, "SOUR:TEST 0.333"),
+        (3, 123456.0, "SOUR:TEST 1.23e+05"),
+        (6, 1e-6, "SOUR:TEST 1e-06"),
+        (4, 2, "SOUR:TEST 2"),
+        (2, -0.0456, "SOUR:TEST -0.046"),
+    ],
+)
+def test_float_precision(precision, value, expected):
+    assert Param(write=float, precision=precision).format_write("SOUR:TEST", value) == expected
+
+
+@pytest.mark.parametrize("value", ["NEXT", "next", "Never"])
+def test_choices_accepted(value):
+    param = Param(write=str, choices=["NEXT", "NEVer"])
+    assert param.format_write("TRAC:FEED:CONT", value) == "TRAC:FEED:CONT {}".format(value)
+
+
+@pytest.mark.parametrize("value", ["NEX", "ALWAYS", "", 1])
+def test_choices_rejected(value):
+    param = Param(write=str, choices=["NEXT", "NEVer"])
+    with pytest.raises(ValueError):
+        param.format_write("TRAC:FEED:CONT", value)
+
+
+@pytest.mark.parametrize("value", [True, False])
+def test_bool_round_trip(value):
+    param = Param(read=bool, write=bool)
+    command = param.format_write("OUTP", value)
+    assert command == ("OUTP ON" if value else "OUTP OFF")
+    assert param.format_read(command.split()[1]) is value
+
+
+@pytest.mark.parametrize(
+    "size,count,chunks",
+    [(3, 1, 1), (3, 3, 1), (3, 4, 2), (3, 6, 2), (3, 7, 3), (1, 2, 2), (100, 250, 3)],
+)
+def test_array_chunking(size, count, chunks):
+    param = Param(write=np.zeros(size))
+    values = np.arange(count, dtype=float)
+    lines = param.format_write("SOUR:LIST:CURR", values).split("\n")
+    assert len(lines) == chunks  # No trailing empty command when count is a multiple of size
+    assert all(line.startswith("SOUR:LIST:CURR ") for line in lines)
+    sent = [float(x) for line in lines for x in line.split(" ", 1)[1].split(",")]
+    np.testing.assert_array_equal(sent, values)
+    assert all(len(line.split(",")) <= size for line in lines)
+
+
+def test_array_write_needs_iterable():
+    with pytest.raises(ValueError):
+        Param(write=np.zeros(3)).format_write("SOUR:LIST:CURR", 1.0)
+
+
+def test_read_only_write_raises():
+    with pytest.raises(CommandError):
+        Param(read=float).format_write("SOUR:TEST", 1.0)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for decoding array replies - ASCII lists and IEEE 488.2 binary blocks.
+
+@author: phygbu
+"""
+import numpy as np
+import pytest
+
+from pyscpi.core.base import parse_ascii_array, parse_block
+
+
+def block(values, dtype=">f4", digits=None, terminator=b"\n"):
+    payload = np.asarray(values, dtype=dtype).tobytes()
+    size = str(len(payload)).encode("ascii")
+    if digits is not None:
+        size = size.rjust(digits, b"0")
+    return b"#" + str(len(size)).encode("ascii") + size + payload + terminator
+
+
+@pytest.mark.parametrize("dtype", [">f4", "<f4", ">f8", "<f8"])
+def test_definite_length_block(dtype):
+    values = np.linspace(-1.0, 1.0, 11)
+    data = parse_block(block(values, dtype), dtype)
+    assert data.dtype == np.dtype(dtype)
+    np.testing.assert_allclose(data, values, rtol=1e-6)
+    assert not data.flags.writeable  # A view of the reply, not a copy
+
+
+def test_block_with_padded_length_and_columns():
+    data = parse_block(b"\r\n" + block(range(6), digits=5), columns=2)
+    assert data.shape == (3, 2)
+    assert data[2, 1] == 5.0
+
+
+def test_indefinite_length_block():
+    payload = np.arange(4, dtype="<f4").tobytes()
+    np.testing.assert_array_equal(parse_block(b"#0" + payload + b"\r\n", "<f4"), [0, 1, 2, 3])
+
+
+def test_empty_block():
+    assert parse_block(b"#10\n").size == 0
+
+
+@pytest.mark.parametrize(
+    "data",
+    [b"1.0,2.0", b"#", b"#A123", b"#2xx", block(range(4))[:-6]],
+    ids=["ascii", "short", "bad digits", "bad length", "truncated"],
+)
+def test_bad_blocks(data):
+    with pytest.raises(ValueError):
+        parse_block(data)
+
+
+def test_ascii_arrays():
+    np.testing.assert_array_equal(parse_ascii_array("+1.0E+00,-2.5E-01,3\n"), [1.0, -0.25, 3.0])
+    assert parse_ascii_array("  ").size == 0
+    assert parse_ascii_array("1,2,3,4,5,6", columns=3).shape == (2, 3)
+
+
+@pytest.mark.parametrize(
+    "text,sep,expected",
+    [("1,2,", ",", [1.0, 2.0]), ("1,2, \r\n", ",", [1.0, 2.0]), ("1;2;3", ";", [1.0, 2.0, 3.0]), (",", ",", [])],
+    ids=["trailing", "trailing with terminator", "other separator", "only separator"],
+)
+def test_ascii_array_trailing_separator(text, sep, expected):
+    np.testing.assert_array_equal(parse_ascii_array(text, sep=sep), expected)
+
+
+@pytest.mark.parametrize(
+    "text,sep",
+    [("1;2", ","), ("1,2", ";"), ("1,,2", ","), ("1,x,3", ","), ("1 2,3", ","), ("1,2,,", ",")],
+    ids=["wrong separator", "other wrong separator", "empty value", "not a number", "missing separator", "two trailing"],
+)
+def test_malformed_ascii_arrays(text, sep):
+    with pytest.raises(ValueError):
+        parse_ascii_array(text, sep=sep)
+
+
+def test_ascii_array_wrong_columns():
+    with pytest.raises(ValueError):
+        parse_ascii_array("1,2,3", columns=2)
+
+
+def test_binary_trace_through_driver(k6221, k6221_sim):
+    k6221.sour.delt.coun = 4
+    k6221.trac.feed.cont = "NEXT"
+    k6221.sour.delt.arm
+    k6221.init.imm
+    ascii = k6221.trac.data
+    assert ascii.size == 8  # Reading and timestamp for each delta
+    k6221.set_data_format("REAL,64", "SWAP")
+    assert k6221.data_format == "<f8"
+    assert k6221_sim.state["FORM:BORD"] == "SWAP"
+    np.testing.assert_allclose(k6221.trac.data, ascii, rtol=1e-6)
+    with pytest.raises(ValueError):
+        k6221.set_data_format("REAL,16")
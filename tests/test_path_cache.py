@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the bounded cache of resolved command paths behind attribute access.
+
+@author: phygbu
+"""
+import pytest
+
+from pyscpi.instr.keithley import K6221
+
+
+def test_repeat_reads_hit(k6221):
+    """Walking the same attribute path again is a cache hit at each level."""
+    k6221.clear_path_cache()
+    before = k6221.path_cache.cache_info()
+    for _ in range(10):
+        k6221.sour.delt.high
+    info = k6221.path_cache.cache_info()
+    assert info["misses"] - before["misses"] == 3
+    assert info["hits"] - before["hits"] == 27
+
+
+def test_string_paths_hit(k6221):
+    """Paths resolved by name share the same cache."""
+    k6221.clear_path_cache()
+    before = k6221.path_cache.cache_info()
+    for _ in range(5):
+        k6221._get_path("SOUR:DELT:HIGH")
+    info = k6221.path_cache.cache_info()
+    assert (info["hits"] - before["hits"], info["misses"] - before["misses"]) == (4, 1)
+
+
+def test_eviction(rm):
+    """The cache never grows beyond its size limit and evicted paths still resolve."""
+    k6221 = K6221(rm=rm, path_cache_size=2)
+    k6221.sour.delt.high = 1e-6
+    k6221.sour.delt.coun = 10
+    assert len(k6221.path_cache) <= 2
+    assert k6221.path_cache.cache_info()["maxsize"] == 2
+    assert k6221.sour.delt.high == pytest.approx(1e-6)
+    assert len(k6221.path_cache) <= 2
+
+
+def test_clear_path_cache(k6221):
+    """Clearing the cache makes the next walk miss again."""
+    k6221.sour.delt.high
+    assert len(k6221.path_cache) > 0
+    k6221.clear_path_cache()
+    assert len(k6221.path_cache) == 0
+    misses = k6221.path_cache.cache_info()["misses"]
+    k6221.sour.delt.high
+    assert k6221.path_cache.cache_info()["misses"] - misses == 3
+
+
+def test_override_invalidates(k6221):
+    """Changing the command tree drops paths resolved against the old one."""
+    assert k6221.sour.delt.high is not None
+    k6221.override_commands({"SOUR": {"DELT": {"HIGH": None}}})
+    with pytest.raises(AttributeError):
+        k6221.sour.delt.high
+    with pytest.raises(AttributeError):
+        k6221._get_path("SOUR:DELT:HIGH")
+    assert k6221.sour.delt.low is not None
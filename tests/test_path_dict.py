@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for SCPI mnemonic matching in SCPI_Path_Dict.
+
+@author: phygbu
+"""
+import pytest
+
+from pyscpi.core.base import Frozen_SCPI_Path_Dict, SCPI_Path_Dict
+
+
+@pytest.fixture
+def tree():
+    return SCPI_Path_Dict([("SOUR", 1), ("STAT", 2), ("SENS", 3), ("TRIGGER", 4)])
+
+
+@pytest.mark.parametrize(
+    "name,key",
+    [("SOUR", "SOUR"), ("source", "SOUR"), ("SOURc", "SOUR"), ("status", "STAT"), ("triggered", "TRIGGER")],
+)
+def test_canonical_matches_long_forms(tree, name, key):
+    assert tree.canonical(name) == key
+    assert tree[name] == tree[key]
+    assert name in tree
+
+
+def test_unknown_mnemonics(tree):
+    assert "SO" not in tree
+    assert "TRIG" not in tree  # Short forms must be declared
+    assert "TRAC" not in tree
+    with pytest.raises(KeyError):
+        tree["SO"]
+
+
+def test_long_form_sets_existing_key(tree):
+    tree["SOURCE"] = 5
+    assert list(tree) == ["SOUR", "STAT", "SENS", "TRIGGER"]
+    assert tree["SOUR"] == 5
+
+
+def test_ambiguous_mnemonics_rejected(tree):
+    with pytest.raises(ValueError):
+        tree["SOU"] = 6  # Would take over everything that SOUR matches
+    with pytest.raises(ValueError):
+        tree["S"] = 6
+    assert "SOU" not in tree._store
+    with pytest.raises(ValueError):
+        SCPI_Path_Dict([("TRACE", 1), ("TRAC", 2)])
+
+
+def test_delete_reindexes(tree):
+    del tree["STATUS"]
+    assert "STAT" not in tree
+    tree["ST"] = 7  # No longer ambiguous
+    assert tree["STATUS"] == 7
+    del tree["TRIGGER"]
+    assert tree._lengths == (4, 2)
+
+
+def test_many_siblings():
+    tree = SCPI_Path_Dict(("K{:03d}X".format(ix), ix) for ix in range(500))
+    assert tree["k250xyz"] == 250
+    assert len(tree._lengths) == 1
+
+
+def test_frozen_tree():
+    frozen = Frozen_SCPI_Path_Dict([("SOUR", {"DELT": {"HIGH": 1}})])
+    assert isinstance(frozen["source"]["delta"], Frozen_SCPI_Path_Dict)
+    assert frozen.freeze() is frozen
+    with pytest.raises(TypeError):
+        frozen["TRAC"] = 1
+    with pytest.raises(TypeError):
+        del frozen["SOUR"]
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for configuration profiles and the Measurement configuration built on them.
+
+@author: phygbu
+"""
+import numpy as np
+import pytest
+
+from pyscpi.core.profile import Profile, settable_commands
+from pyscpi.measurements.K6221_K2182 import Measurement
+
+
+def test_snapshot_round_trip(k6221, tmp_path):
+    snapshot = Profile.snapshot(k6221)
+    assert list(snapshot) == settable_commands(k6221)
+    assert snapshot.instrument == "K6221"
+    snapshot.save(str(tmp_path / "k6221.json"))
+    loaded = Profile.load(str(tmp_path / "k6221.json"))
+    assert loaded == snapshot
+    assert loaded.instrument == "K6221"
+    assert not loaded.diff(k6221)
+
+
+def test_diff_compares_set_commands(k6221):
+    k6221.sour.delt.high = 1e-7
+    profile = Profile([("SOUR:DELT:HIGH", 1.0e-7), ("sour:delt:low", -2e-7)])
+    assert list(profile.diff(k6221)) == ["sour:delt:low"]
+    assert list(profile.diff(k6221, current={"SOUR:DELT:HIGH": "1.000E-07"})) == ["sour:delt:low"]
+
+
+def test_apply_sends_only_changes(k6221, k6221_sim, sent):
+    k6221.sour.delt.high = 1e-7
+    del sent[:]
+    changes = Profile([("SOUR:DELT:HIGH", 1e-7), ("SOUR:DELT:LOW", -2e-7)]).apply(k6221, check_errors=False)
+    assert list(changes) == ["SOUR:DELT:LOW"]
+    assert not any("SOUR:DELT:HIGH " in message for message in sent)
+    assert float(k6221_sim.state["SOUR:DELT:LOW"]) == pytest.approx(-2e-7)
+    assert not Profile([("SOUR:DELT:LOW", -2e-7)]).apply(k6221)
+
+
+def test_apply_data_format_follows(k6221, k6221_sim):
+    k6221.sour.delt.arm
+    k6221.init.imm
+    k6221.trac.feed.cont = "NEXT"
+    Profile([("FORM:DATA", "REAL,32")]).apply(k6221)
+    assert k6221_sim.state["FORM:DATA"] == "REAL,32"
+    assert k6221.data_format == ">f4"
+    assert isinstance(k6221.trac.data, np.ndarray)
+    Profile([("FORM:BORD", "SWAP")]).apply(k6221)
+    assert k6221.data_format == "<f4"
+    Profile([("FORM:DATA", "ASC")]).apply(k6221)
+    assert k6221.data_format is None
+
+
+def test_configure_delta_after_sweep(rm, k6221_sim):
+    meas = Measurement(simulate=rm, repeats=4)
+    meas.connect()
+    meas.configure()
+    assert k6221_sim.state["SOUR:SWE:SPAC"] == "LIST"
+    meas.configure_delta()
+    assert k6221_sim.state["SOUR:SWE:SPAC"] != "LIST"
+    assert k6221_sim.state["TRIG:SOUR"] == "IMM"
+    assert not any(name.startswith("TRIG:TCON") for name in k6221_sim.state)
+    assert meas.measure_delta()["R_XY"] == pytest.approx(100.0, rel=1e-3)
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the attribute proxies that walk an instrument's command tree.
+
+@author: phygbu
+"""
+import pytest
+
+from pyscpi.core.base import _proxy
+from pyscpi.exceptions import CommandError
+
+
+def test_proxies_reused(k6221):
+    assert k6221.sour is k6221.sour
+    assert k6221.sour.delt is k6221.sour.delt
+    assert k6221.sour.delta is k6221.SOUR.DELT  # Same branch, however it is spelt
+    assert isinstance(k6221.sour.delt, _proxy)
+
+
+def test_proxies_replaced_with_tree(k6221):
+    old = k6221.sour.delt
+    k6221.clear_path_cache()
+    assert k6221.sour.delt is not old
+    assert k6221.sour.delt is k6221.sour.delt
+
+
+def test_proxies_have_no_dict(k6221):
+    proxy = k6221.sour
+    assert not hasattr(proxy, "__dict__")
+    with pytest.raises(AttributeError):
+        proxy._extra = 1
+    with pytest.raises(AttributeError):
+        proxy._extra
+
+
+def test_setting_branch_raises(k6221):
+    with pytest.raises(CommandError):
+        k6221.sour.delt = 1
+    with pytest.raises(AttributeError):
+        k6221.sour.nothing = 1
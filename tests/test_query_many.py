@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for reading several commands in one round trip with SCPI_Instrument_Mixin.query_many.
+
+@author: phygbu
+"""
+import pytest
+
+from pyscpi.exceptions import CommandError
+from pyscpi.instr.keithley import K6221
+
+names = ["SOUR:DELT:HIGH", "sour:delt:low", "TRAC:POIN", "OUTP:STAT", "SOUR:SWE:SPAC"]
+
+
+def test_one_round_trip(k6221, sent):
+    k6221.sour.delt.high = 2e-6
+    del sent[:]
+    values = k6221.query_many(names)
+    assert list(values) == names
+    assert len(sent) == 1
+    assert sent[0] == ":SOUR:DELT:HIGH?;:SOUR:DELT:LOW?;:TRAC:POIN?;:OUTP:STAT?;:SOUR:SWE:SPAC?"
+    assert values["SOUR:DELT:HIGH"] == pytest.approx(2e-6)
+    assert values["sour:delt:low"] == pytest.approx(-1e-3)
+    assert values["OUTP:STAT"] is False
+    assert values == dict((name, k6221.handle(name).get()) for name in names)
+
+
+def test_long_lists_split(k6221, sent):
+    values = k6221.query_many(names, max_length=40)
+    assert len(sent) > 1
+    assert all(len(message) <= 40 for message in sent)
+    assert values == k6221.query_many(names)
+
+
+def test_unreadable_commands(k6221, sent):
+    with pytest.raises(CommandError):
+        k6221.query_many(["SOUR:DELT"])  # A branch
+    with pytest.raises(CommandError):
+        k6221.query_many(["SOUR:DELT:ARM"])  # Write only
+    assert sent == []
+
+
+def test_reply_count_checked(k6221, k6221_sim, monkeypatch):
+    monkeypatch.setattr(k6221_sim, "read", lambda: b"1;2\n")
+    with pytest.raises(CommandError):
+        k6221.query_many(names[:3])
+
+
+def test_shadow_answers_known_values(rm, k6221_sim):
+    k6221 = K6221(rm=rm, shadow=True, shadow_ttl={"SOUR:DELT:HIGH": None})
+    first = k6221.query_many(["SOUR:DELT:HIGH", "SOUR:DELT:LOW"])
+    before = k6221_sim.messages
+    assert k6221.query_many(["SOUR:DELT:HIGH"]) == {"SOUR:DELT:HIGH": first["SOUR:DELT:HIGH"]}
+    assert k6221_sim.messages == before
+    k6221.query_many(["SOUR:DELT:HIGH", "SOUR:DELT:LOW"])
+    assert k6221_sim.messages == before + 1  # Only SOUR:DELT:LOW is asked for
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for recording instrument traffic and replaying it with Replay_Resource_Manager.
+
+@author: phygbu
+"""
+import numpy as np
+import pytest
+
+from pyscpi.core.record import Recorder, read_recording
+from pyscpi.instr.keithley import K6221
+from pyscpi.measurements.K6221_K2182 import Measurement
+from pyscpi.sim import Replay_Resource_Manager
+from pyscpi.sim.replay import ReplayError
+
+
+def run(meas):
+    meas.connect()
+    meas.configure_delta()
+    return meas.measure_delta()
+
+
+@pytest.mark.parametrize("binary", [False, True], ids=["ascii", "binary"])
+def test_measurement_replays(rm, tmp_path, binary):
+    recording = str(tmp_path / "session.jsonl")
+    meas = Measurement(simulate=rm, record=recording, binary=binary)
+    expected = run(meas)
+    meas.recorder.close()
+    header, operations = read_recording(recording)
+    assert header["driver"] == "K6221"
+    assert operations[0] == {"t": operations[0]["t"], "w": "*IDN?"}
+    replay = Replay_Resource_Manager(recording)
+    results = run(Measurement(replay=replay, binary=binary))
+    np.testing.assert_array_equal(results["R_data"], expected["R_data"])
+    assert results["R_XY"] == expected["R_XY"]
+    assert all(resource.finished for resource in replay.resources.values())
+
+
+def test_replay_spots_different_commands(rm, tmp_path):
+    recording = str(tmp_path / "session.jsonl")
+    with Recorder(K6221(rm=rm), recording) as recorder:
+        recorder.comms.sour.delt.high = 1e-6
+        recorder.comms.sour.delt.high
+    k6221 = K6221(rm=Replay_Resource_Manager(recording))
+    with pytest.raises(ReplayError):
+        k6221.sour.delt.high = 2e-6
+    with pytest.raises(ReplayError):
+        k6221.sour.delt.low  # Past the end of the recording
+
+
+def test_recorder_restores_methods(k6221, tmp_path):
+    recorder = Recorder(k6221, str(tmp_path / "session.jsonl"))
+    assert "trans" in vars(k6221)
+    recorder.close()
+    assert recorder.closed
+    assert not set(vars(k6221)) & set(Recorder.methods)
+
+
+def test_errors_replayed(k6221, tmp_path):
+    recording = str(tmp_path / "session.jsonl")
+    with Recorder(k6221, recording):
+        with pytest.raises(TimeoutError):
+            k6221.read(timeout=0.01)
+    k6221 = K6221(rm=Replay_Resource_Manager(recording))
+    with pytest.raises(TimeoutError):
+        k6221.read(timeout=0.01)
+
+
+def test_socket_session_replays_over_gpib(k6221_lan, tmp_path):
+    recording = str(tmp_path / "session.jsonl")
+    with Recorder(k6221_lan, recording):
+        k6221_lan.set_data_format("REAL,32")
+        k6221_lan.sour.delt.coun = 2
+        data = k6221_lan.trac.data
+    k6221 = K6221(rm=Replay_Resource_Manager(recording))
+    k6221.set_data_format("REAL,32")
+    k6221.sour.delt.coun = 2
+    np.testing.assert_array_equal(k6221.trac.data, data)
+
+
+def test_not_a_recording(tmp_path):
+    bogus = tmp_path / "bogus.jsonl"
+    bogus.write_text('{"t": 0, "w": "*IDN?"}\n')
+    with pytest.raises(ValueError):
+        read_recording(str(bogus))
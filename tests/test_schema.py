@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for loading command trees from schema files and the compiled schema cache.
+
+@author: phygbu
+"""
+import glob
+import json
+import os
+import pickle
+
+import pytest
+
+from pyscpi.core.base import Param
+from pyscpi.core.schema import compile_schema, load_schema
+from pyscpi.exceptions import SchemaError
+
+SCHEMA = {
+    "commands": {
+        "SOUR": {
+            "long": "SOURce",
+            "DELT": {"HIGH": {"read": "float", "write": "float"}, "ARM": {"read": None, "write": None}},
+        }
+    }
+}
+
+
+@pytest.fixture
+def schema_file(tmp_path, monkeypatch):
+    monkeypatch.setenv("PYSCPI_CACHE", str(tmp_path / "cache"))
+    filename = tmp_path / "test.json"
+    filename.write_text(json.dumps(SCHEMA))
+    return str(filename)
+
+
+def _cache_files(tmp_path):
+    return glob.glob(str(tmp_path / "cache" / "*.pickle"))
+
+
+def test_compile_schema():
+    tree = compile_schema(SCHEMA)
+    assert isinstance(tree["SOURCE"]["DELT"]["HIGH"], Param)
+    with pytest.raises(SchemaError):
+        compile_schema({"nothing": {}})
+
+
+def test_load_schema_uses_cache(schema_file, tmp_path):
+    tree = load_schema(schema_file)
+    files = _cache_files(tmp_path)
+    assert len(files) == 1
+    assert "HIGH" in load_schema(schema_file)["SOUR"]["DELT"]
+    assert list(tree) == ["SOUR"]
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        b"garbage",
+        b"cno_such_pyscpi_module\nThing\n(tR.",  # A class that has moved or gone - ImportError when loaded
+        pickle.dumps({"source": ["another copy of pyscpi", 0, 0], "tree": "stale"}),
+    ],
+)
+def test_bad_cache_is_rebuilt(schema_file, tmp_path, content):
+    load_schema(schema_file)
+    cache_file = _cache_files(tmp_path)[0]
+    with open(cache_file, "wb") as data:
+        data.write(content)
+    tree = load_schema(schema_file)
+    assert isinstance(tree["SOUR"]["DELT"]["HIGH"], Param)
+    with open(cache_file, "rb") as data:
+        assert pickle.load(data)["tree"]["SOUR"]["DELT"]["HIGH"]._array is False
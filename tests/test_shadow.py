@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the shadow of instrument settings that lets drivers skip redundant writes and static queries.
+
+@author: phygbu
+"""
+import pytest
+
+from pyscpi.core.cache import Shadow_State
+from pyscpi.exceptions import CommandError
+
+
+class Clock(object):
+
+    """A clock for the shadow's ttl that only moves when told to."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_unchanged_writes_suppressed(shadowed, sent):
+    shadowed.sour.delt.high = 1e-6
+    shadowed.sour.delt.high = 1e-6
+    shadowed.sour.delt.high = 1.0e-6
+    assert len(sent) == 1
+    shadowed.sour.delt.high = 2e-6
+    assert len(sent) == 2
+    assert shadowed.shadow.cache_info()["suppressed"] == 2
+
+
+def test_read_value_suppresses_write(shadowed, sent):
+    high = shadowed.sour.delt.high
+    shadowed.sour.delt.high = high
+    assert len(sent) == 1  # Just the query
+
+
+def test_actions_always_sent(shadowed, sent):
+    shadowed.sour.delt.arm
+    shadowed.sour.delt.arm
+    assert len(sent) == 2
+
+
+def test_static_queries_served(shadowed, sent):
+    assert "6221" in shadowed.idn
+    assert shadowed.sour.delt.nvpr
+    shadowed.idn
+    shadowed.sour.delt.nvpr
+    assert len(sent) == 2
+    shadowed.sour.delt.high
+    shadowed.sour.delt.high
+    assert len(sent) == 4  # Not listed in shadow_ttl
+
+
+def test_ttl_expires():
+    clock = Clock()
+    shadow = Shadow_State({"SOUR:DELT:NVPR": 10.0}, clock=clock)
+    shadow.was_read("SOUR:DELT:NVPR", True)
+    clock.now = 9.0
+    assert shadow.value("SOUR:DELT:NVPR") is True
+    clock.now = 11.0
+    assert shadow.value("SOUR:DELT:NVPR", None) is None
+
+
+@pytest.mark.parametrize("method", ["reset", "clear"])
+def test_reset_and_clear_invalidate(shadowed, sent, method):
+    shadowed.sour.delt.high = 1e-6
+    shadowed.idn
+    getattr(shadowed, method)()
+    del sent[:]
+    shadowed.sour.delt.high = 1e-6
+    shadowed.idn
+    assert len(sent) == 2
+
+
+def test_invalidate_branch(shadowed, sent):
+    shadowed.sour.delt.high = 1e-6
+    shadowed.sour.delt.low = -1e-6
+    shadowed.trac.poin = 10
+    shadowed.invalidate_shadow("SOUR:DELTA")
+    assert "TRAC:POIN" in shadowed.shadow
+    assert "SOUR:DELT:HIGH" not in shadowed.shadow
+    del sent[:]
+    shadowed.sour.delt.high = 1e-6
+    shadowed.trac.poin = 10
+    assert len(sent) == 1
+
+
+def test_instrument_errors_invalidate(shadowed, k6221_sim):
+    shadowed.sour.delt.high = 1e-6
+    k6221_sim.error(-222, "Data out of range")
+    with pytest.raises(CommandError):
+        shadowed.check_errors()
+    assert len(shadowed.shadow) == 0
+
+
+def test_off_by_default(k6221, sent):
+    assert k6221.shadow is None
+    k6221.sour.delt.high = 1e-6
+    k6221.sour.delt.high = 1e-6
+    assert len(sent) == 2
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the simulated instruments in pyscpi.sim.
+
+@author: phygbu
+"""
+import pytest
+
+from pyscpi.instr.keithley import K6221
+from pyscpi.measurements.K6221_K2182 import Measurement
+from pyscpi.sim import K6221_Simulator
+from pyscpi.sim.engine import split_message, unquote
+
+
+def test_split_message_leaves_quotes_alone():
+    assert split_message(':SOUR:DELT:HIGH 1e-6; :SYST:COMM:SER:SEND "VOLT;:TRAC"; *OPC?') == [
+        ":SOUR:DELT:HIGH 1e-6",
+        ':SYST:COMM:SER:SEND "VOLT;:TRAC"',
+        "*OPC?",
+    ]
+    assert unquote('"say ""hi"""') == 'say "hi"'
+    assert unquote("NEXT") == "NEXT"
+
+
+def test_extra_commands_leave_driver_tree_alone(k6221_sim):
+    assert "SEND" in k6221_sim.commands["SYST"]["COMM"]["SER"]
+    assert "COMM" not in K6221.compiled_commands()["SYST"]
+
+
+def test_settings_and_errors(k6221_sim):
+    k6221_sim.write("SOUR:DELT:HIGH 2e-6;LOW -2e-6;:SOUR:DELT:HIGH?;LOW?")
+    high, low = k6221_sim.read().decode("ascii").strip().split(";")
+    assert float(high) == pytest.approx(2e-6)
+    assert float(low) == pytest.approx(-2e-6)
+    k6221_sim.write(":NOT:A:COMMAND 1")
+    assert k6221_sim.status_byte() & 4
+    k6221_sim.write("SYST:ERR?")
+    assert k6221_sim.read().startswith(b"-113,")
+    with pytest.raises(TimeoutError):
+        k6221_sim.read()
+
+
+def test_event_registers_clear_when_read(k6221_sim):
+    k6221_sim.set_event("STAT:MEAS", 256)
+    k6221_sim.write("STAT:MEAS:EVEN?")
+    assert int(k6221_sim.read()) == 256
+    k6221_sim.write("STAT:MEAS:EVEN?")
+    assert int(k6221_sim.read()) == 0
+
+
+def test_error_rate_rejects_settings():
+    sim = K6221_Simulator(time_scale=0.0, error_rate=1.0, seed=1)
+    sim.write("SOUR:DELT:HIGH 2e-6")
+    assert "SOUR:DELT:HIGH" not in sim.state or sim.state["SOUR:DELT:HIGH"] != "2e-6"
+    sim.write("SYST:ERR?")
+    assert sim.read().startswith(b"-200,")
+
+
+def test_serial_port_reaches_nanovoltmeter(k2182, k6221_sim):
+    assert "2182" in k2182.idn
+    k2182.sens.volt.nplc = 2
+    assert float(k6221_sim.nanovoltmeter.state["SENS:VOLT:NPLC"]) == 2
+
+
+def test_list_sweep_reads_nanovoltmeter(rm):
+    meas = Measurement(simulate=rm, repeats=4)
+    meas.connect()
+    meas.configure()
+    results = meas.measure()
+    assert results["R_xy"] == pytest.approx(100.0, rel=1e-3)
+
+
+def test_reset_keeps_service_request_setup(k6221, k6221_sim):
+    k6221.stat.meas.enab = 264
+    k6221.sre = 5
+    k6221.sour.delt.high = 1e-6
+    k6221.reset()
+    assert k6221_sim.sre == 5
+    assert int(float(k6221_sim.state["STAT:MEAS:ENAB"])) == 264
+    assert "SOUR:DELT:HIGH" not in k6221_sim.state or float(k6221_sim.state["SOUR:DELT:HIGH"]) != 1e-6
+
+
+def test_measurement_requests_service(rm, k6221_sim):
+    meas = Measurement(simulate=rm, repeats=4)
+    meas.connect()
+    meas.configure_delta()
+    assert not k6221_sim.status_byte() & 64
+    meas.k6221.init.imm
+    assert k6221_sim.status_byte() & 64
+    assert meas.k6221.stat.meas.even & 256
+    meas.k6221.trac.feed.cont = "NEXT"
+    assert meas.k6221.trac.data.size == 8
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the raw socket transport against a loopback server.
+
+@author: phygbu
+"""
+import socket
+
+import numpy as np
+import pytest
+
+from pyscpi.instr.keithley import K6221_LAN
+
+
+def test_trans_keeps_one_connection(k6221_lan):
+    assert "6221" in k6221_lan.trans("*IDN?")
+    conn = k6221_lan.connection
+    k6221_lan.sour.delt.high = 2e-6
+    assert k6221_lan.sour.delt.high == 2e-6
+    assert k6221_lan.connection is conn
+
+
+def test_reconnects_after_drop(k6221_lan, server):
+    k6221_lan.trans("*IDN?")
+    for _ in range(3):
+        conn = k6221_lan.connection
+        server.drop_connections()  # The instrument closes the idle connection
+        assert "6221" in k6221_lan.trans("*IDN?")
+        assert k6221_lan.connection is not conn
+    server.drop_connections()
+    assert k6221_lan.trans_raw("SYST:COMM:SER:ENT?") == b""
+
+
+def test_no_retries(server):
+    instr = K6221_LAN(*server.address, timeout=2.0, retries=0)
+    try:
+        instr.trans("*IDN?")
+        server.drop_connections()
+        with pytest.raises(ConnectionError):
+            instr.trans("*IDN?")
+        assert instr._connection is None
+        assert "6221" in instr.trans("*IDN?")
+    finally:
+        instr.close()
+
+
+def test_read_raw_empty_reply(k6221_lan):
+    """A reply that is just the terminator comes back as no bytes rather than hanging."""
+    assert k6221_lan.trans_raw("SYST:COMM:SER:ENT?") == b""
+    assert "6221" in k6221_lan.trans("*IDN?")  # Still in step
+
+
+def test_read_raw_binary_block(k6221_lan):
+    for command in ["FORM:ELEM READ", "SOUR:DELT:COUN 4", "TRAC:POIN 4", "TRAC:FEED:CONT NEXT", "SOUR:DELT:ARM"]:
+        k6221_lan.write(command)
+    k6221_lan.write("INIT:IMM")
+    ascii_data = k6221_lan.trac.data
+    k6221_lan.set_data_format("REAL,32")
+    binary_data = k6221_lan.trac.data
+    assert len(binary_data) == 4
+    np.testing.assert_allclose(binary_data, ascii_data, rtol=1e-6)
+
+
+def test_timeout_closes_connection(k6221_lan):
+    k6221_lan.write("*CLS")  # No reply to wait for
+    with pytest.raises(socket.timeout):
+        k6221_lan.read(timeout=0.1)
+    assert k6221_lan._connection is None
+    assert "6221" in k6221_lan.trans("*IDN?")
+
+
+def test_connection_refused():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    instr = K6221_LAN("127.0.0.1", port, connect_timeout=0.5)
+    with pytest.raises(OSError):
+        instr.trans("*IDN?")